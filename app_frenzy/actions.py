@@ -1,26 +1,76 @@
 from datetime import datetime, timezone
-from typing import List
+from types import SimpleNamespace
+from typing import Dict, List, Optional
 
 from app_frenzy.models import (
+    MINUTES_PER_DAY,
     Days,
     MenuItem,
     Restaurant,
-    RestaurantTiming,
+    RestaurantMenuStats,
+    RestaurantOpenInterval,
     User,
     UserTransaction,
+    minute_of_week,
+    to_cents,
 )
 from app_frenzy.schemas import (
+    ListRestaurantResponseSchema,
     RestaurantFilterQueryParamsSchema,
     ProcessCartRequestSchema,
     UserTransactionResponseSchema,
 )
-from app_frenzy.db import SessionLocal
+from app_frenzy.config import get_app_frenzy_settings
+from app_frenzy.db import AsyncSessionLocal, SessionLocal
+from app_frenzy.idempotency import (
+    build_claim_query,
+    build_store_query,
+    build_stored_query,
+    hash_request,
+    replay,
+)
+from app_frenzy.ledger import build_balance_query
+from app_frenzy.metrics import phase
+from app_frenzy.pagination import (
+    decode_cursor,
+    encode_cursor,
+    invalid_cursor,
+    keyset_after,
+    parse_cursor_float,
+    parse_cursor_int,
+    parse_cursor_money,
+    parse_cursor_str,
+)
+from app_frenzy.responses import dump_json
 
 from fastapi import HTTPException
-from sqlalchemy import select, func
+from sqlalchemy import (
+    DateTime,
+    Integer,
+    String,
+    and_,
+    case,
+    cast,
+    false,
+    literal,
+    null,
+    or_,
+    select,
+    union_all,
+    func,
+    insert,
+    true,
+    update,
+)
 from sqlalchemy.orm import Session
 
 import enum
+import re
+
+
+settings = get_app_frenzy_settings()
+
+SEARCH_WORD_RE = re.compile(r"\w+")
 
 
 class RestaurantFilterEnum(enum.Enum):
@@ -29,8 +79,23 @@ class RestaurantFilterEnum(enum.Enum):
     NDISH = "ndish"
 
 
+class RestaurantSortEnum(enum.Enum):
+    ID = "id"
+    NAME = "name"
+    NDISH = "ndish"
+    PRICE = "price"
+
+
 class RestaurantFilter:
     FILTERS = list(map(lambda x: x.value, list(RestaurantFilterEnum)))
+    SORTS = list(map(lambda x: x.value, list(RestaurantSortEnum)))
+    # Parsers of the sort key value carried by cursors, by sort.
+    CURSOR_VALUE_PARSERS = {
+        RestaurantSortEnum.ID.value: parse_cursor_int,
+        RestaurantSortEnum.NAME.value: parse_cursor_str,
+        RestaurantSortEnum.NDISH.value: parse_cursor_int,
+        RestaurantSortEnum.PRICE.value: parse_cursor_money,
+    }
 
     def __init__(
         self,
@@ -41,6 +106,8 @@ class RestaurantFilter:
         ndish_gt,
         ndish_lt,
         limit,
+        sort=RestaurantSortEnum.ID.value,
+        cursor=None,
     ):
         self.filters = filters
         # Parse and transform query params to required form.
@@ -52,6 +119,8 @@ class RestaurantFilter:
             ndish_gt=ndish_gt,
             ndish_lt=ndish_lt,
             limit=limit,
+            sort=sort,
+            cursor=cursor,
         ).dict()
         self.open_at = query_params["open_at"]
         self.price_lower = query_params["price_lower"]
@@ -59,13 +128,21 @@ class RestaurantFilter:
         self.ndish_gt = query_params["ndish_gt"]
         self.ndish_lt = query_params["ndish_lt"]
         self.limit = query_params["limit"]
+        self.sort = query_params["sort"]
+        self.cursor = query_params["cursor"]
 
         self.validate_filter_params()
+        self.validate_sort_params()
         self.optimise_filters()
         if self.add_default_filter():
             # By default if no filters are specified we apply
             # RestaurantFilterEnum.OPEN_AT
-            self.filters.append(RestaurantFilterEnum.OPEN_AT)
+            self.filters.append(RestaurantFilterEnum.OPEN_AT.value)
+        if (
+            RestaurantFilterEnum.OPEN_AT.value in self.filters
+            and self.open_at is None
+        ):
+            self.open_at = datetime.utcnow()
 
     @staticmethod
     def validate_filters(filters: List[str]):
@@ -96,6 +173,25 @@ class RestaurantFilter:
                 detail="Filter ndish requires at least one of ndish_gt or ndish_lt.",
             )
 
+    def validate_sort_params(self):
+        if self.sort not in RestaurantFilter.SORTS:
+            raise HTTPException(status_code=422, detail="Invalid sort.")
+        if self.cursor is None:
+            return
+        # Cursors are only valid for the sort they were generated with.
+        cursor = decode_cursor(self.cursor)
+        if cursor.get("sort") != self.sort:
+            raise HTTPException(
+                status_code=400, detail="Cursor does not match the sort."
+            )
+        # Values are checked against the sort key's type, so a tampered
+        # cursor never reaches the query. Only the id sort key can't be
+        # NULL.
+        value = cursor.get("value")
+        if value is not None or self.sort == RestaurantSortEnum.ID.value:
+            value = self.CURSOR_VALUE_PARSERS[self.sort](value)
+        self.after = (value, parse_cursor_int(cursor.get("id")))
+
     def optimise_filters(self):
         # In this function we will be removing the filters
         # which are useless since they don't really filter on anything.
@@ -109,26 +205,40 @@ class RestaurantFilter:
         return False
 
     def apply_filter_open_at(self, query, joins, open_at: datetime):
-        day = Days(open_at.weekday())
-        open_at_time = open_at.time()
-        if "timings" not in joins:
-            joins["timings"] = 1
-            query = query.join(Restaurant.timings)
-        query = query.filter(
-            RestaurantTiming.day == day,
-            RestaurantTiming.opens < open_at_time,
-            RestaurantTiming.closes > open_at_time,
+        now = minute_of_week(Days(open_at.weekday()), open_at.time())
+        # Intervals never span more than a day, so bounding opens_at from
+        # below keeps the index probe to the intervals opened in the last
+        # day. EXISTS avoids duplicate rows for overlapping intervals.
+        open_now = select(RestaurantOpenInterval.id).where(
+            RestaurantOpenInterval.restaurant == Restaurant.id,
+            RestaurantOpenInterval.opens_at > now - MINUTES_PER_DAY,
+            RestaurantOpenInterval.opens_at <= now,
+            RestaurantOpenInterval.closes_at > now,
         )
+        return query.where(open_now.exists())
+
+    def join_menu_stats(self, query, joins):
+        if "menu_stats" not in joins:
+            joins["menu_stats"] = 1
+            query = query.join(Restaurant.menu_stats)
         return query
 
     def apply_filter_price(self, query, joins, price_lower, price_upper):
-        if "menu" not in joins:
-            joins["menu"] = 1
-            query = query.join(Restaurant.menu)
-        if price_lower:
-            query = query.filter(MenuItem.price >= price_lower)
-        if price_upper:
-            query = query.filter(MenuItem.price <= price_upper)
+        # A restaurant serves a dish in the band only if its price range
+        # overlaps it. With a single bound that check is exact, with both
+        # an EXISTS probe on (restaurant, price) confirms the match.
+        query = self.join_menu_stats(query, joins)
+        if price_lower is not None:
+            query = query.filter(RestaurantMenuStats.max_price >= price_lower)
+        if price_upper is not None:
+            query = query.filter(RestaurantMenuStats.min_price <= price_upper)
+        if price_lower is not None and price_upper is not None:
+            dish_in_band = select(MenuItem.id).where(
+                MenuItem.restaurant == Restaurant.id,
+                MenuItem.price >= price_lower,
+                MenuItem.price <= price_upper,
+            )
+            query = query.filter(dish_in_band.exists())
         return query
 
     def apply_filter_ndish(
@@ -141,108 +251,622 @@ class RestaurantFilter:
         # Preferance is given to greater than if both the
         # operations are present in the request and we allow
         # it to flow to db.
-        if "menu" not in joins:
-            joins["menu"] = 1
-            query = query.join(Restaurant.menu)
+        query = self.join_menu_stats(query, joins)
         if ndish_gt:
-            query = query.group_by(Restaurant.id).having(
-                func.count(Restaurant.menu) > ndish_gt
-            )
+            query = query.filter(RestaurantMenuStats.dish_count > ndish_gt)
         elif ndish_lt:
-            query = query.group_by(Restaurant.id).having(
-                func.count(Restaurant.menu) < ndish_lt
-            )
+            query = query.filter(RestaurantMenuStats.dish_count < ndish_lt)
         return query
 
+    def get_sort_key(self, query, joins):
+        if self.sort == RestaurantSortEnum.NAME.value:
+            return query, Restaurant.name
+        if self.sort == RestaurantSortEnum.NDISH.value:
+            query = self.join_menu_stats(query, joins)
+            return query, RestaurantMenuStats.dish_count
+        if self.sort == RestaurantSortEnum.PRICE.value:
+            query = self.join_menu_stats(query, joins)
+            return query, RestaurantMenuStats.min_price
+        return query, Restaurant.id
+
+    def apply_sort(self, query, joins):
+        # Keyset pagination, rows after the cursor are found with an index
+        # probe on (sort key, id) so every page costs the same.
+        query, sort_key = self.get_sort_key(query, joins)
+        query = query.add_columns(sort_key.label("sort_key"))
+        if self.cursor is not None:
+            last_value, last_id = self.after
+            query = query.filter(
+                keyset_after(sort_key, Restaurant.id, last_value, last_id)
+            )
+        return query.order_by(sort_key, Restaurant.id)
+
     def apply_limit(self, query, limit):
         if not limit:
             return query
         return query.limit(limit)
 
+    def make_page(self, rows):
+        # Returns the restaurants along with the cursor for the next page,
+        # which is None once the results are exhausted.
+        # Rows carry the response columns, the sort key is only read here.
+        next_cursor = None
+        if self.limit and len(rows) == self.limit:
+            next_cursor = encode_cursor(
+                {
+                    "sort": self.sort,
+                    "value": rows[-1].sort_key,
+                    "id": rows[-1].id,
+                }
+            )
+        return rows, next_cursor
+
+    def build_query(self):
+        # Only the columns of the response are selected, as plain rows.
+        query = select(
+            *get_schema_columns(ListRestaurantResponseSchema, Restaurant)
+        )
+        # This dict is mutated by downstream filter funcs
+        joins = {}
+        for filter_type in self.filters:
+            if filter_type == RestaurantFilterEnum.OPEN_AT.value:
+                query = self.apply_filter_open_at(query, joins, self.open_at)
+            elif filter_type == RestaurantFilterEnum.PRICE.value:
+                query = self.apply_filter_price(
+                    query, joins, self.price_lower, self.price_upper
+                )
+            elif filter_type == RestaurantFilterEnum.NDISH.value:
+                query = self.apply_filter_ndish(
+                    query, joins, self.ndish_gt, self.ndish_lt
+                )
+        query = self.apply_sort(query, joins)
+        return self.apply_limit(query, self.limit)
+
+    def get_cache_params(self):
+        # Everything a page depends on, normalized so that requests getting
+        # the same page share a cache entry: open_at is reduced to its
+        # minute of the week and prices to cents, as the query does.
+        params = {
+            "filters": sorted(self.filters),
+            "limit": self.limit,
+            "sort": self.sort,
+            "cursor": self.cursor,
+        }
+        if RestaurantFilterEnum.OPEN_AT.value in self.filters:
+            params["open_at"] = minute_of_week(
+                Days(self.open_at.weekday()), self.open_at.time()
+            )
+        if RestaurantFilterEnum.PRICE.value in self.filters:
+            params["price"] = [
+                None if price is None else to_cents(price)
+                for price in (self.price_lower, self.price_upper)
+            ]
+        if RestaurantFilterEnum.NDISH.value in self.filters:
+            params["ndish"] = [self.ndish_gt, self.ndish_lt]
+        return params
+
     def get_filtered_restaurants(self):
-        with SessionLocal() as session:
-            query = select(Restaurant)
-            # This dict is mutated by downstream filter funcs
-            joins = {}
-            for filter_type in self.filters:
-                if filter_type == RestaurantFilterEnum.OPEN_AT.value:
-                    open_at = (
-                        self.open_at if self.open_at else datetime.utcnow()
-                    )
-                    query = self.apply_filter_open_at(query, joins, open_at)
-                elif filter_type == RestaurantFilterEnum.PRICE.value:
-                    query = self.apply_filter_price(
-                        query, joins, self.price_lower, self.price_upper
-                    )
-                elif filter_type == RestaurantFilterEnum.NDISH.value:
-                    query = self.apply_filter_ndish(
-                        query, joins, self.ndish_gt, self.ndish_lt
-                    )
-            query = self.apply_limit(query, self.limit)
-            return session.execute(query).scalars().all()
+        with phase("build_query"):
+            query = self.build_query()
+        with SessionLocal() as session, phase("db"):
+            rows = session.execute(query).all()
+        return self.make_page(rows)
+
+
+class AsyncRestaurantFilter(RestaurantFilter):
+    async def get_filtered_restaurants(self):
+        with phase("build_query"):
+            query = self.build_query()
+        async with AsyncSessionLocal() as session:
+            with phase("db"):
+                result = await session.execute(query)
+                rows = result.all()
+        return self.make_page(rows)
 
 
 class Search:
-    def __init__(self, terms: str, model, field):
+    """
+    Full-text search of one result set. Only builds the query, searches
+    are run together by CombinedSearch.
+    """
+
+    LANGUAGE = "english"
+    # Sets of results in a search, each paginated on its own.
+    RESULT_SETS = ("restaurants", "dishes")
+
+    def __init__(
+        self,
+        terms: str,
+        model,
+        field,
+        limit=None,
+        after=None,
+        prefix=False,
+    ):
         self.terms = terms
         self.model = model
         self.field = field
+        self.limit = limit
+        # (rank, id) of the last result of the previous page.
+        self.after = after
+        self.prefix = prefix
 
-    def search(self):
-        with SessionLocal() as session:
-            query = select(self.model)
+    @staticmethod
+    def normalize_terms(terms: str):
+        # Search words are ANDed, so case, order, punctuation and repeats
+        # don't change the query.
+        return " ".join(sorted(set(SEARCH_WORD_RE.findall(terms.lower()))))
+
+    def build_tsquery(self):
+        if self.prefix:
+            # Typeahead, every word matches as a prefix (chick:* & tik:*).
+            words = SEARCH_WORD_RE.findall(self.terms)
+            return func.to_tsquery(
+                self.LANGUAGE, " & ".join(word + ":*" for word in words)
+            )
+        return func.plainto_tsquery(self.LANGUAGE, self.terms)
+
+    def build_match(self):
+        # Returns the predicate selecting matches and their rank.
+        tsquery = self.build_tsquery()
+        return self.field.op("@@")(tsquery), func.ts_rank_cd(
+            self.field, tsquery
+        )
+
+    def build_query(self, columns):
+        match, rank = self.build_match()
+        query = select(*columns, rank.label("rank")).where(match)
+        if self.after is not None:
+            # Keyset on rank DESC, id ASC.
+            last_rank, last_id = self.after
             query = query.where(
-                self.field.op("@@")(func.plainto_tsquery(self.terms))
+                or_(
+                    rank < last_rank,
+                    and_(rank == last_rank, self.model.id > last_id),
+                )
+            )
+        query = query.order_by(rank.desc(), self.model.id)
+        if self.limit:
+            query = query.limit(self.limit)
+        return query
+
+    @staticmethod
+    def decode_cursor(cursor: Optional[str]):
+        # Maps every result set to the position to continue from. None
+        # means from the start and False that the set is exhausted.
+        if cursor is None:
+            return dict.fromkeys(Search.RESULT_SETS)
+        doc = decode_cursor(cursor)
+        positions = {}
+        for result_set in Search.RESULT_SETS:
+            position = doc.get(result_set, False)
+            if position is not False:
+                if not (isinstance(position, list) and len(position) == 2):
+                    raise invalid_cursor()
+                position = [
+                    parse_cursor_float(position[0]),
+                    parse_cursor_int(position[1]),
+                ]
+            positions[result_set] = position
+        return positions
+
+    @staticmethod
+    def encode_cursor(positions: Dict):
+        if not any(positions.values()):
+            return None
+        return encode_cursor(
+            {
+                result_set: position or False
+                for result_set, position in positions.items()
+            }
+        )
+
+
+class FuzzySearch(Search):
+    """
+    Typo tolerant search on a text column (not the tsvector) using pg_trgm.
+    Matches are the rows whose words are similar enough to the terms
+    (SEARCH_FUZZY_THRESHOLD) and are ranked by that similarity.
+    """
+
+    def build_match(self):
+        # field %> terms is word_similarity(terms, field) >= threshold,
+        # written with the column on the left so the trigram index is used.
+        return self.field.op("%>")(self.terms), func.word_similarity(
+            self.terms, self.field
+        )
+
+
+class CombinedSearch:
+    """
+    Runs the searches of several result sets as a single UNION ALL query,
+    so a search costs one connection checkout and one round trip.
+    """
+
+    # Every result set is projected to (id, restaurant, name, price) and
+    # the docs handed to the response schemas are built from them.
+    DOC_FIELDS = {
+        Restaurant: ("id", None, "name", None),
+        MenuItem: ("id", "restaurant", "dish_name", "price"),
+    }
+
+    def __init__(self, searches: Dict[str, Search]):
+        self.searches = searches
+
+    @staticmethod
+    def get_columns(model):
+        if model is Restaurant:
+            columns = (
+                Restaurant.id,
+                cast(null(), MenuItem.restaurant.type),
+                Restaurant.name,
+                cast(null(), MenuItem.price.type),
+            )
+        else:
+            columns = (
+                MenuItem.id,
+                MenuItem.restaurant,
+                MenuItem.dish_name,
+                MenuItem.price,
             )
-            return session.execute(query).scalars().all()
+        return [
+            column.label(label)
+            for column, label in zip(
+                columns, ("id", "restaurant", "name", "price")
+            )
+        ]
+
+    def build_query(self):
+        parts = []
+        for result_set, search in self.searches.items():
+            query = search.build_query(self.get_columns(search.model))
+            query = query.add_columns(
+                cast(literal(result_set), String).label("result_set")
+            )
+            parts.append(select(query.subquery()))
+        union = union_all(*parts).subquery()
+        return select(union).order_by(
+            union.c.result_set, union.c.rank.desc(), union.c.id
+        )
+
+    def make_doc(self, model, row):
+        doc = SimpleNamespace()
+        for field, value in zip(self.DOC_FIELDS[model], row):
+            if field is not None:
+                setattr(doc, field, value)
+        return doc
+
+    def make_pages(self, rows):
+        # Returns result set -> (docs, position to continue from).
+        grouped = {result_set: [] for result_set in self.searches}
+        for row in rows:
+            grouped[row.result_set].append(row)
+        pages = {}
+        for result_set, search in self.searches.items():
+            set_rows = grouped[result_set]
+            docs = [self.make_doc(search.model, row) for row in set_rows]
+            after = None
+            if search.limit and len(set_rows) == search.limit:
+                after = [set_rows[-1].rank, set_rows[-1].id]
+            pages[result_set] = (docs, after)
+        return pages
+
+    def search(self):
+        if not self.searches:
+            return {}
+        with phase("build_query"):
+            query = self.build_query()
+        with SessionLocal() as session, phase("db"):
+            rows = session.execute(query).all()
+        return self.make_pages(rows)
+
+
+class AsyncCombinedSearch(CombinedSearch):
+    async def search(self):
+        if not self.searches:
+            return {}
+        with phase("build_query"):
+            query = self.build_query()
+        async with AsyncSessionLocal() as session:
+            with phase("db"):
+                result = await session.execute(query)
+                rows = result.all()
+        return self.make_pages(rows)
 
 
 class Cart:
-    def __init__(self, cart: ProcessCartRequestSchema):
+    """
+    Checks out a cart in a single statement: the user is debited the
+    total only if the balance covers it (UPDATE ... WHERE cash_balance >=
+    total), the restaurant is credited and a transaction per dish is
+    inserted, all in one round trip. The row lock taken by the debit
+    serializes concurrent checkouts of the same user, and the balance
+    condition is rechecked against the committed value once the lock is
+    granted, so a user can never be overdrawn. Every dish must be on the
+    restaurant's menu or nothing is written. In ledger mode the restaurant
+    is credited later, see app_frenzy.ledger.
+    """
+
+    ledger = settings.RESTAURANT_LEDGER
+
+    def __init__(
+        self,
+        cart: ProcessCartRequestSchema,
+        idempotency_key: Optional[str] = None,
+    ):
         self.cart = cart
+        # Retries with the same key get the first result back, see
+        # app_frenzy.idempotency.
+        self.idempotency_key = idempotency_key
+        self.request_hash = hash_request(cart.json(sort_keys=True))
+        # Quantity per dish, repeated dishes are merged.
+        self.quantities = {}
+        for item in cart.items:
+            self.quantities[item.dish_id] = (
+                self.quantities.get(item.dish_id, 0) + item.quantity
+            )
 
-    def get_user_by_id(self, user_id, session):
-        return session.execute(
-            select(User).filter_by(user_id=user_id)
-        ).scalar_one()
+    def build_items_query(self):
+        quantity = cast(
+            case(
+                {
+                    dish_id: cast(literal(quantity), Integer)
+                    for dish_id, quantity in self.quantities.items()
+                },
+                value=MenuItem.id,
+            ),
+            Integer,
+        )
+        return select(
+            MenuItem.id,
+            quantity.label("quantity"),
+            (MenuItem.price * quantity).label("amount"),
+        ).where(
+            MenuItem.id.in_(list(self.quantities)),
+            MenuItem.restaurant == self.cart.restaurant_id,
+        )
 
-    def get_restaurant_by_id(self, restaurant_id, session):
-        return session.get(Restaurant, restaurant_id)
+    def build_credit(self, debit):
+        # Returns the restaurant id, the debit joined with the credit and
+        # whether the transactions are settled (credited to the restaurant).
+        if self.ledger:
+            # Credited later by app_frenzy.ledger, so checkouts of a
+            # popular restaurant don't queue on its row.
+            restaurant_id = cast(literal(self.cart.restaurant_id), Integer)
+            return restaurant_id, debit, false()
+        credit = (
+            update(Restaurant)
+            .where(
+                Restaurant.id == self.cart.restaurant_id,
+                # Credits only once the user is debited.
+                debit.c.amount.isnot(None),
+            )
+            .values(cash_balance=Restaurant.cash_balance + debit.c.amount)
+            .returning(Restaurant.id)
+            .cte("credit")
+        )
+        return credit.c.id, debit.join(credit, true()), true()
+
+    def build_checkout_query(self):
+        items = self.build_items_query().cte("items")
+        total = select(
+            func.sum(items.c.amount).label("amount"),
+            func.count().label("dish_count"),
+        ).cte("total")
+        debit = (
+            update(User)
+            .where(
+                User.user_id == self.cart.user_id,
+                User.cash_balance >= total.c.amount,
+                total.c.dish_count == len(self.quantities),
+            )
+            .values(cash_balance=User.cash_balance - total.c.amount)
+            .returning(User.id, total.c.amount)
+            .cte("debit")
+        )
+        restaurant_id, payment, settled = self.build_credit(debit)
+        user_transactions = (
+            insert(UserTransaction)
+            .from_select(
+                [
+                    "user",
+                    "restaurant",
+                    "menu_item",
+                    "quantity",
+                    "transaction_amount",
+                    "transaction_date",
+                    "settled",
+                ],
+                select(
+                    debit.c.id,
+                    restaurant_id,
+                    items.c.id,
+                    items.c.quantity,
+                    items.c.amount,
+                    # Select list parameters need an explicit type.
+                    cast(literal(datetime.utcnow()), DateTime),
+                    settled,
+                ).select_from(items.join(payment, true())),
+            )
+            .returning(
+                UserTransaction.id,
+                UserTransaction.restaurant,
+                UserTransaction.menu_item,
+                UserTransaction.quantity,
+                UserTransaction.transaction_amount,
+                UserTransaction.transaction_date,
+            )
+            .cte("user_transactions")
+        )
+        return select(user_transactions).order_by(user_transactions.c.id)
+
+    def build_failure_query(self):
+        # Only run when the checkout wrote nothing, to tell why.
+        dishes = (
+            select(func.array_agg(MenuItem.id))
+            .where(
+                MenuItem.id.in_(list(self.quantities)),
+                MenuItem.restaurant == self.cart.restaurant_id,
+            )
+            .scalar_subquery()
+        )
+        return select(User.id, dishes.label("dish_ids")).where(
+            User.user_id == self.cart.user_id
+        )
 
-    def get_menu_item_by_id(self, menu_id, session):
-        return session.get(MenuItem, menu_id)
+    def raise_checkout_failure(self, row):
+        if row is None:
+            raise HTTPException(status_code=404, detail="User not found.")
+        missing = set(self.quantities) - set(row.dish_ids or ())
+        if missing:
+            raise HTTPException(
+                status_code=404,
+                detail="Dishes not found in restaurant: %s."
+                % (", ".join(map(str, sorted(missing)))),
+            )
+        raise HTTPException(status_code=402, detail="Wallet low on funds.")
+
+    def make_result(self, user_transactions):
+        with phase("serialize"):
+            result = GenerateResponse(
+                user_transactions, UserTransactionResponseSchema
+            ).generate()
+        # Single dish requests get the transaction itself, as before.
+        if self.cart.dish_id is not None and len(self.cart.items) == 1:
+            return result[0]
+        return result
+
+    def make_body(self, user_transactions):
+        # Encoded once, the same bytes are stored for replays.
+        return dump_json(
+            {
+                "status": "success",
+                "result": self.make_result(user_transactions),
+            }
+        )
 
     def process(self):
+        # Only statements are timed as db, building the checkout query
+        # and encoding the response have phases of their own.
         with SessionLocal() as session:
-            restaurant = self.get_restaurant_by_id(
-                self.cart.restaurant_id, session
-            )
-            user = self.get_user_by_id(self.cart.user_id, session)
-            menu_item = self.get_menu_item_by_id(self.cart.dish_id, session)
-            user_transaction = UserTransaction(
-                user=user.id,
-                restaurant=restaurant.id,
-                menu_item=menu_item.id,
-                transaction_amount=menu_item.price,
-                transaction_date=datetime.utcnow(),
+            if self.idempotency_key is not None:
+                with phase("db"):
+                    claimed = session.execute(
+                        build_claim_query(
+                            self.idempotency_key, self.request_hash
+                        )
+                    ).first()
+                    if claimed is None:
+                        stored = session.execute(
+                            build_stored_query(self.idempotency_key)
+                        ).one()
+                if claimed is None:
+                    return replay(stored, self.request_hash)
+            with phase("build_query"):
+                query = self.build_checkout_query()
+            with phase("db"):
+                user_transactions = session.execute(query).all()
+                if not user_transactions:
+                    # Also releases the idempotency key.
+                    session.rollback()
+                    failure = session.execute(
+                        self.build_failure_query()
+                    ).first()
+            if not user_transactions:
+                self.raise_checkout_failure(failure)
+            body = self.make_body(user_transactions)
+            with phase("db"):
+                if self.idempotency_key is not None:
+                    session.execute(
+                        build_store_query(self.idempotency_key, body)
+                    )
+                session.commit()
+            return body
+
+
+class AsyncCart(Cart):
+    async def process(self):
+        async with AsyncSessionLocal() as session:
+            if self.idempotency_key is not None:
+                with phase("db"):
+                    result = await session.execute(
+                        build_claim_query(
+                            self.idempotency_key, self.request_hash
+                        )
+                    )
+                    claimed = result.first()
+                    if claimed is None:
+                        result = await session.execute(
+                            build_stored_query(self.idempotency_key)
+                        )
+                        stored = result.one()
+                if claimed is None:
+                    return replay(stored, self.request_hash)
+            with phase("build_query"):
+                query = self.build_checkout_query()
+            with phase("db"):
+                result = await session.execute(query)
+                user_transactions = result.all()
+                if not user_transactions:
+                    await session.rollback()
+                    result = await session.execute(self.build_failure_query())
+                    failure = result.first()
+            if not user_transactions:
+                self.raise_checkout_failure(failure)
+            body = self.make_body(user_transactions)
+            with phase("db"):
+                if self.idempotency_key is not None:
+                    await session.execute(
+                        build_store_query(self.idempotency_key, body)
+                    )
+                await session.commit()
+            return body
+
+
+class RestaurantBalance:
+    """
+    Current cash balance of a restaurant: what is settled in the
+    restaurant row plus the ledger transactions not folded into it yet,
+    read together in one statement.
+    """
+
+    def __init__(self, restaurant_id: int):
+        self.restaurant_id = restaurant_id
+
+    def make_result(self, row):
+        if row is None:
+            raise HTTPException(
+                status_code=404, detail="Restaurant not found."
             )
-            restaurant.cash_balance = Restaurant.cash_balance + menu_item.price
-            user.cash_balance = User.cash_balance - menu_item.price
+        return {
+            "restaurant": row.id,
+            "cash_balance": row.settled_balance + row.pending_balance,
+            "settled_balance": row.settled_balance,
+            "pending_balance": row.pending_balance,
+        }
+
+    def get(self):
+        with SessionLocal() as session:
+            row = session.execute(
+                build_balance_query(self.restaurant_id)
+            ).first()
+            return self.make_result(row)
 
-            session.add(user_transaction)
-            session.flush()
 
-            if user.cash_balance < 0:
-                raise HTTPException(
-                    status_code=402, detail="Wallet low on funds."
-                )
+class AsyncRestaurantBalance(RestaurantBalance):
+    async def get(self):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                build_balance_query(self.restaurant_id)
+            )
+            return self.make_result(result.first())
 
-            result = GenerateResponse(
-                user_transaction, UserTransactionResponseSchema
-            ).generate()
 
-            session.commit()
-            return result
+def get_schema_columns(schema, model):
+    # Columns of model read by schema, in the order of its fields.
+    return [
+        getattr(model, field.alias) for field in schema.__fields__.values()
+    ]
 
 
 class GenerateResponse:
@@ -257,3 +881,27 @@ class GenerateResponse:
         if isinstance(self.results, list):
             return list(map(self.apply_schema, self.results))
         return self.apply_schema(self.results)
+
+
+class ProjectedResponse(GenerateResponse):
+    """
+    Fast path of GenerateResponse for results that are already projected
+    to the schema's columns (see get_schema_columns), such as result rows.
+    Rows are turned into dicts with the keys from_orm would produce but
+    without validating them, so it must only be given trusted rows.
+    """
+
+    def __init__(self, results, schema):
+        super().__init__(results, schema)
+        # (response key, attribute read from the row) of every field.
+        self.fields = [
+            (name, field.alias) for name, field in schema.__fields__.items()
+        ]
+
+    def apply_schema(self, doc):
+        values = {}
+        for name, attribute in self.fields:
+            value = getattr(doc, attribute)
+            if value is not None:
+                values[name] = value
+        return values
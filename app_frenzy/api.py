@@ -1,35 +1,92 @@
 from datetime import datetime
+from decimal import Decimal
 from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Header, HTTPException, Query, Response
 from pydantic import ValidationError
 
-from app_frenzy.actions import Cart, GenerateResponse, RestaurantFilter, Search
+from app_frenzy.actions import (
+    AsyncCart,
+    AsyncCombinedSearch,
+    AsyncRestaurantBalance,
+    AsyncRestaurantFilter,
+    Cart,
+    CombinedSearch,
+    FuzzySearch,
+    ProjectedResponse,
+    RestaurantBalance,
+    RestaurantFilter,
+    Search,
+)
+from app_frenzy.cache import TTLLRUCache, search_cache
+from app_frenzy.config import get_app_frenzy_settings
+from app_frenzy.metrics import phase
 from app_frenzy.models import Restaurant, MenuItem
+from app_frenzy.responses import dump_json
 from app_frenzy.schemas import (
     ListMenuItemResponseSchema,
     ListRestaurantResponseSchema,
     ProcessCartRequestSchema,
 )
+from app_frenzy.shared_cache import restaurant_cache
+
+import inspect
 
 
 router = APIRouter()
+settings = get_app_frenzy_settings()
+
+if settings.ASYNC_DB:
+    RestaurantFilterAction = AsyncRestaurantFilter
+    CombinedSearchAction = AsyncCombinedSearch
+    CartAction = AsyncCart
+    RestaurantBalanceAction = AsyncRestaurantBalance
+else:
+    RestaurantFilterAction = RestaurantFilter
+    CombinedSearchAction = CombinedSearch
+    CartAction = Cart
+    RestaurantBalanceAction = RestaurantBalance
+
+# Search mode -> action and the field searched for every result set.
+SEARCH_MODES = {
+    "fulltext": (
+        Search,
+        {
+            "restaurants": Restaurant.name_search_vec,
+            "dishes": MenuItem.dish_name_search_vec,
+        },
+    ),
+    "fuzzy": (
+        FuzzySearch,
+        {"restaurants": Restaurant.name, "dishes": MenuItem.dish_name},
+    ),
+}
+
+
+async def resolve(result):
+    # Actions return coroutines on the async path and plain values on
+    # the blocking one.
+    if inspect.isawaitable(result):
+        return await result
+    return result
 
 
 @router.get("/restaurant")
 async def list_restaurant(
     filter_types: List[str] = Query(..., alias="filter"),
     open_at: Optional[int] = Query(None),
-    price_lower: Optional[float] = Query(None),
-    price_upper: Optional[float] = Query(None),
+    price_lower: Optional[Decimal] = Query(None),
+    price_upper: Optional[Decimal] = Query(None),
     ndish_gt: Optional[int] = Query(None),
     ndish_lt: Optional[int] = Query(None),
     limit: Optional[int] = Query(None),
+    sort: str = Query("id"),
+    cursor: Optional[str] = Query(None),
 ):
     if not RestaurantFilter.validate_filters(filter_types):
         raise HTTPException(status_code=422, detail="Invalid filters.")
     try:
-        restaurant_filter = RestaurantFilter(
+        restaurant_filter = RestaurantFilterAction(
             filter_types,
             open_at,
             price_lower,
@@ -37,53 +94,121 @@ async def list_restaurant(
             ndish_gt,
             ndish_lt,
             limit,
+            sort,
+            cursor,
+        )
+
+        async def get_page():
+            restaurants, next_cursor = await resolve(
+                restaurant_filter.get_filtered_restaurants()
+            )
+            with phase("serialize"):
+                results = ProjectedResponse(
+                    restaurants, ListRestaurantResponseSchema
+                ).generate()
+            return dump_json(
+                {
+                    "status": "success",
+                    "restaurants": results,
+                    "next_cursor": next_cursor,
+                }
+            )
+
+        # Pages are shared by all the workers, encoded.
+        body = await restaurant_cache.get_or_compute(
+            restaurant_filter.get_cache_params(), get_page
         )
-        restaurants = restaurant_filter.get_filtered_restaurants()
-        results = GenerateResponse(
-            restaurants, ListRestaurantResponseSchema
-        ).generate()
     except ValueError:
         raise HTTPException(
             status_code=422, detail="Invalid filters or query params."
         )
-    return {"status": "success", "restaurants": results}
+    return Response(body, media_type="application/json")
+
+
+@router.get("/restaurant/{restaurant_id}/balance")
+async def restaurant_balance(restaurant_id: int):
+    with phase("db"):
+        balance = await resolve(RestaurantBalanceAction(restaurant_id).get())
+    return {"status": "success", "result": balance}
 
 
 @router.get("/search")
 async def search(
     terms: str = Query(..., alias="s"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    prefix: bool = Query(False),
+    mode: str = Query("fulltext"),
 ):
+    # The normalized terms are what gets searched, so every search string
+    # sharing a cache key gets the same results.
+    terms = Search.normalize_terms(terms)
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=422, detail="Invalid search mode.")
+    # Catalog changes (ETL runs included) bump the version, every worker
+    # then misses its older entries. Without a shared cache store only the
+    # changes committed by this worker do.
+    version = await restaurant_cache.get_version()
+    cache_key = (version, terms, limit, cursor, prefix, mode)
+    cached = search_cache.get(cache_key)
+    # Responses are cached as encoded JSON, a hit is sent as is.
+    if cached is not TTLLRUCache.MISSING:
+        return Response(cached, media_type="application/json")
     try:
-        restaurants = Search(
-            terms, Restaurant, Restaurant.name_search_vec
-        ).search()
-        menu_items = Search(
-            terms, MenuItem, MenuItem.dish_name_search_vec
-        ).search()
-        restaurant_results = GenerateResponse(
-            restaurants, ListRestaurantResponseSchema
-        ).generate()
-        menu_item_results = GenerateResponse(
-            menu_items, ListMenuItemResponseSchema
-        ).generate()
+        positions = Search.decode_cursor(cursor)
+        search_action, fields = SEARCH_MODES[mode]
+        searches = {}
+        for result_set, model in (
+            ("restaurants", Restaurant),
+            ("dishes", MenuItem),
+        ):
+            if positions[result_set] is False or not terms:
+                continue
+            searches[result_set] = search_action(
+                terms,
+                model,
+                fields[result_set],
+                limit=limit,
+                after=positions[result_set],
+                prefix=prefix,
+            )
+        # Both result sets are fetched with a single query.
+        pages = await resolve(CombinedSearchAction(searches).search())
+        results = {}
+        for result_set, schema in (
+            ("restaurants", ListRestaurantResponseSchema),
+            ("dishes", ListMenuItemResponseSchema),
+        ):
+            docs, positions[result_set] = pages.get(result_set, ([], None))
+            with phase("serialize"):
+                results[result_set] = ProjectedResponse(
+                    docs, schema
+                ).generate()
     except ValueError:
         raise HTTPException(
             status_code=422, detail="Invalid filters or query params."
         )
-    return {
-        "status": "success",
-        "restaurants": restaurant_results,
-        "dishes": menu_item_results,
-    }
+    body = dump_json(
+        {
+            "status": "success",
+            "restaurants": results["restaurants"],
+            "dishes": results["dishes"],
+            "next_cursor": Search.encode_cursor(positions),
+        }
+    )
+    search_cache.set(cache_key, body)
+    return Response(body, media_type="application/json")
 
 
 @router.post("/cart/process")
 async def process_cart(
     cart: ProcessCartRequestSchema,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
 ):
     try:
-        cart_controller = Cart(cart)
-        result = cart_controller.process()
+        cart_controller = CartAction(cart, idempotency_key)
+        body = await resolve(cart_controller.process())
     except ValueError:
         raise HTTPException(status_code=422, detail="Invalid body structure.")
-    return {"status": "success", "result": result}
+    # Encoded by the action, replays send the stored bytes.
+    return Response(body, media_type="application/json")
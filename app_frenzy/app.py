@@ -1,12 +1,124 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from typing import Optional
 
 from app_frenzy import api
 
+# Registers the flush hook keeping restaurant_menu_stats current.
+import app_frenzy.menu_stats
+from app_frenzy.cache import search_cache
+from app_frenzy.config import get_app_frenzy_settings
+from app_frenzy.db import get_pool_stats, slow_query_log
+from app_frenzy.idempotency import purge_periodically
+from app_frenzy.ledger import settle_periodically
+from app_frenzy.metrics import (
+    MetricsMiddleware,
+    collect,
+    write_snapshot,
+    write_snapshots_periodically,
+)
+from app_frenzy.shared_cache import restaurant_cache
+
+import asyncio
+import os
+import secrets
+
+
+settings = get_app_frenzy_settings()
+
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(api.router, prefix="/api", tags=["api"])
 
 
+@app.on_event("startup")
+async def start_ledger_settlement():
+    # Every worker runs a settler, they take turns through a lock.
+    if settings.RESTAURANT_LEDGER:
+        app.state.ledger_task = asyncio.create_task(
+            settle_periodically(
+                settings.LEDGER_SETTLE_INTERVAL, settings.LEDGER_SETTLE_BATCH
+            )
+        )
+
+
+@app.on_event("startup")
+async def start_idempotency_key_purge():
+    app.state.idempotency_purge_task = asyncio.create_task(
+        purge_periodically(
+            settings.IDEMPOTENCY_PURGE_INTERVAL, settings.IDEMPOTENCY_KEY_TTL
+        )
+    )
+
+
+@app.on_event("startup")
+async def start_metrics_writer():
+    if settings.METRICS_DIR:
+        app.state.metrics_task = asyncio.create_task(
+            write_snapshots_periodically(
+                settings.METRICS_DIR, settings.METRICS_WRITE_INTERVAL
+            )
+        )
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for name in ("ledger_task", "idempotency_purge_task", "metrics_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    await restaurant_cache.close()
+    # The histograms of an exiting worker still count towards the totals.
+    if settings.METRICS_DIR:
+        write_snapshot(settings.METRICS_DIR)
+
+
 @app.get("/health")
 async def health():
     return {"message": "Alive!"}
+
+
+@app.get("/health/pool")
+async def pool_health():
+    # Stats are per worker process, the worker serving the request answers.
+    return {"status": "success", "pools": get_pool_stats()}
+
+
+@app.get("/health/cache")
+async def cache_health():
+    return {
+        "status": "success",
+        "search_cache": search_cache.get_stats(),
+        "restaurant_cache": restaurant_cache.get_stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        collect(settings.METRICS_DIR),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+def check_admin_token(x_admin_token: Optional[str] = Header(None)):
+    # Admin endpoints don't exist unless a token is configured.
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token, settings.ADMIN_TOKEN
+    ):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+@app.get("/admin/slow-queries", dependencies=[Depends(check_admin_token)])
+async def slow_queries(limit: int = Query(20, ge=1)):
+    # The log is per worker process, the worker serving the request
+    # answers (identified by pid).
+    return {
+        "status": "success",
+        "pid": os.getpid(),
+        "stats": slow_query_log.get_stats(),
+        "queries": slow_query_log.get_entries(limit),
+    }
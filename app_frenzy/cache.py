@@ -0,0 +1,68 @@
+from app_frenzy.config import get_app_frenzy_settings
+from collections import OrderedDict
+
+import threading
+import time
+
+
+settings = get_app_frenzy_settings()
+
+
+class TTLLRUCache:
+    """
+    Bounded in process cache. Entries expire ttl seconds after being set
+    and the least recently used entry is evicted once maxsize is reached.
+    """
+
+    MISSING = object()
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return self.MISSING
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Keys embed the shared catalog version (see app_frenzy.shared_cache), so
+# entries of every worker are bypassed once the catalog changes. Without a
+# shared store the version is per worker and changes made elsewhere (other
+# workers, the ETL scripts) only show up once entries expire.
+search_cache = TTLLRUCache(
+    settings.SEARCH_CACHE_SIZE, settings.SEARCH_CACHE_TTL
+)
@@ -1,10 +1,90 @@
 from functools import lru_cache
 from pydantic import BaseSettings
+from typing import Optional
 
 
 class AppFrenzySettings(BaseSettings):
     DATABASE_CONN_STR: str
     DEBUG: bool
+    # Serve API requests through the asyncio engine. Turning this off
+    # falls back to the blocking session which is mostly useful to
+    # benchmark the two against each other.
+    ASYNC_DB: bool = True
+
+    # Connection pool settings. These apply to every engine in every
+    # worker process, so the server holds up to
+    # WEB_WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections per engine.
+    WEB_WORKERS: int = 4
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_TIMEOUT: float = 30.0
+    # Optional budget of connections shared by all the workers and both
+    # of their engines. When set the pools are shrunk to fit in it.
+    DB_MAX_CONNECTIONS: Optional[int] = None
+
+    # Per worker cache of search results.
+    SEARCH_CACHE_SIZE: int = 1024
+    SEARCH_CACHE_TTL: float = 300.0
+    # Minimum pg_trgm word similarity for a fuzzy search match.
+    SEARCH_FUZZY_THRESHOLD: float = 0.5
+
+    # /api/restaurant pages cached for all the workers, see
+    # app_frenzy/shared_cache.py. Unset disables the cache.
+    RESTAURANT_CACHE_URL: Optional[str] = None
+    RESTAURANT_CACHE_TTL: float = 60.0
+    # Entries kept by the shm backend, Redis evicts on its own.
+    RESTAURANT_CACHE_SIZE: int = 10000
+    RESTAURANT_CACHE_TIMEOUT: float = 0.1
+    RESTAURANT_CACHE_LOCK_TTL: float = 10.0
+    RESTAURANT_CACHE_LOCK_WAIT: float = 2.0
+    # Seconds the cache is skipped after a backend failure, doubled on
+    # every further failure.
+    RESTAURANT_CACHE_RETRY_INTERVAL: float = 1.0
+
+    # Append checkout credits to a ledger settled in the background
+    # instead of updating the restaurant row on every checkout.
+    RESTAURANT_LEDGER: bool = False
+    LEDGER_SETTLE_INTERVAL: float = 1.0
+    LEDGER_SETTLE_BATCH: int = 10000
+
+    # Checkout results are replayed to retries sent with the same
+    # Idempotency-Key header for this many seconds.
+    IDEMPOTENCY_KEY_TTL: int = 24 * 60 * 60
+    IDEMPOTENCY_PURGE_INTERVAL: float = 60 * 60
+
+    # Directory the workers share their latency histograms through, see
+    # app_frenzy/metrics.py. Unset, /metrics only covers the worker
+    # serving the scrape.
+    METRICS_DIR: Optional[str] = None
+    METRICS_WRITE_INTERVAL: float = 5.0
+
+    # Statements taking this long are logged and kept for
+    # /admin/slow-queries, unset disables the slow query log. A share of
+    # the slow SELECTs can be explained (EXPLAIN ANALYZE runs them again,
+    # so it's off by default), see app_frenzy/slow_queries.py.
+    SLOW_QUERY_THRESHOLD_MS: Optional[float] = 200.0
+    SLOW_QUERY_LOG_SIZE: int = 100
+    SLOW_QUERY_EXPLAIN_RATE: float = 0.0
+    SLOW_QUERY_EXPLAIN_TIMEOUT_MS: int = 10000
+    # Token expected in the X-Admin-Token header by /admin endpoints,
+    # which are disabled while it's unset.
+    ADMIN_TOKEN: Optional[str] = None
+
+    def get_pool_size(self, serves_requests: bool):
+        # Every worker has two engines. Under a budget the one serving
+        # requests (see ASYNC_DB) gets the worker's share but one
+        # connection, left to the other one, which only runs background
+        # work (ledger settling, key purges, slow query plans) a statement
+        # at a time. A worker needs at least those two.
+        pool_size, max_overflow = self.DB_POOL_SIZE, self.DB_MAX_OVERFLOW
+        if self.DB_MAX_CONNECTIONS:
+            per_worker = max(self.DB_MAX_CONNECTIONS // self.WEB_WORKERS, 2)
+            budget = per_worker - 1 if serves_requests else 1
+            pool_size = min(pool_size, budget)
+            max_overflow = min(max_overflow, budget - pool_size)
+        return pool_size, max_overflow
 
 
 @lru_cache
@@ -1,14 +1,96 @@
 from app_frenzy.config import get_app_frenzy_settings
-from sqlalchemy import create_engine
+from app_frenzy.metrics import instrument_engine
+from app_frenzy.pool import (
+    InstrumentedAsyncAdaptedQueuePool,
+    InstrumentedQueuePool,
+)
+from app_frenzy.slow_queries import SlowQueryLog
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 
 settings = get_app_frenzy_settings()
 
-engine = create_engine(settings.DATABASE_CONN_STR, echo=settings.DEBUG)
+
+def make_async_conn_str(conn_str: str):
+    # The connection string is shared with the blocking engine (used by
+    # scripts), so swap in the asyncio driver for the async engine.
+    return make_url(conn_str).set(drivername="postgresql+asyncpg")
+
+
+def get_pool_options(serves_requests: bool):
+    pool_size, max_overflow = settings.get_pool_size(serves_requests)
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+
+
+def set_fuzzy_search_threshold(dbapi_connection, connection_record):
+    # SET takes no bind params, the value is a validated float. Committed
+    # so the pool's rollback on checkin doesn't revert it.
+    cursor = dbapi_connection.cursor()
+    cursor.execute(
+        "SET pg_trgm.word_similarity_threshold = %f"
+        % (settings.SEARCH_FUZZY_THRESHOLD)
+    )
+    cursor.close()
+    dbapi_connection.commit()
+
+
+engine = create_engine(
+    settings.DATABASE_CONN_STR,
+    echo=settings.DEBUG,
+    poolclass=InstrumentedQueuePool,
+    **get_pool_options(not settings.ASYNC_DB)
+)
 SessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine, future=True
 )
 
+async_engine = create_async_engine(
+    make_async_conn_str(settings.DATABASE_CONN_STR),
+    echo=settings.DEBUG,
+    poolclass=InstrumentedAsyncAdaptedQueuePool,
+    **get_pool_options(settings.ASYNC_DB)
+)
+event.listen(engine, "connect", set_fuzzy_search_threshold)
+event.listen(async_engine.sync_engine, "connect", set_fuzzy_search_threshold)
+instrument_engine(engine, "engine")
+instrument_engine(async_engine.sync_engine, "async_engine")
+
+# Plans are captured on the blocking engine for both engines.
+slow_query_log = SlowQueryLog(
+    settings.SLOW_QUERY_THRESHOLD_MS or 0,
+    settings.SLOW_QUERY_LOG_SIZE,
+    engine,
+    settings.SLOW_QUERY_EXPLAIN_RATE,
+    settings.SLOW_QUERY_EXPLAIN_TIMEOUT_MS,
+)
+if settings.SLOW_QUERY_THRESHOLD_MS is not None:
+    slow_query_log.watch(engine, "engine")
+    slow_query_log.watch(async_engine.sync_engine, "async_engine")
+
+AsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=async_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    future=True,
+)
+
 AppFrenzyBase = declarative_base()
+
+
+def get_pool_stats():
+    return {
+        "engine": engine.pool.get_stats(),
+        "async_engine": async_engine.sync_engine.pool.get_stats(),
+    }
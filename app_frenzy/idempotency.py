@@ -0,0 +1,93 @@
+"""
+Idempotency keys of cart checkouts. The key is claimed with an insert
+into idempotency_key in the checkout's own transaction and the encoded
+response is stored there before commit, so a key is either unused or
+holds the response of a completed checkout. Replays send the stored
+bytes, identical to the first response.
+
+A duplicate arriving while the first request is still running blocks on
+the unique key until that transaction ends: if it committed the stored
+result is replayed, if it rolled back (eg. low on funds) the duplicate
+claims the key and checks out itself.
+"""
+from datetime import datetime, timedelta
+
+from app_frenzy.db import AsyncSessionLocal
+from app_frenzy.models import IdempotencyKey
+from fastapi import HTTPException
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import asyncio
+import hashlib
+import logging
+
+
+def hash_request(body: str):
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def build_claim_query(key: str, request_hash: str):
+    # Returns a row if the key was free and is now claimed.
+    return (
+        insert(IdempotencyKey)
+        .values(
+            key=key, request_hash=request_hash, created_at=datetime.utcnow()
+        )
+        .on_conflict_do_nothing(index_elements=[IdempotencyKey.key])
+        .returning(IdempotencyKey.key)
+    )
+
+
+def build_stored_query(key: str):
+    return select(IdempotencyKey.request_hash, IdempotencyKey.response).where(
+        IdempotencyKey.key == key
+    )
+
+
+def build_store_query(key: str, body: bytes):
+    return (
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == key)
+        .values(response=body)
+    )
+
+
+def build_purge_query(ttl: int):
+    expired = datetime.utcnow() - timedelta(seconds=ttl)
+    return delete(IdempotencyKey).where(IdempotencyKey.created_at < expired)
+
+
+def replay(stored, request_hash: str):
+    if stored.request_hash != request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key already used for a different request.",
+        )
+    return bytes(stored.response)
+
+
+def purge_expired_keys(session: Session, ttl: int):
+    purged = session.execute(build_purge_query(ttl)).rowcount
+    session.commit()
+    return purged
+
+
+async def async_purge_expired_keys(session: AsyncSession, ttl: int):
+    result = await session.execute(build_purge_query(ttl))
+    await session.commit()
+    return result.rowcount
+
+
+async def purge_periodically(interval: float, ttl: int):
+    # Background task of every worker, purging twice is harmless.
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                purged = await async_purge_expired_keys(session, ttl)
+            logging.info("Purged %d expired idempotency keys.", purged)
+        except Exception:
+            logging.exception("Purging idempotency keys failed.")
+        await asyncio.sleep(interval)
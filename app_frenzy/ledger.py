@@ -0,0 +1,116 @@
+"""
+Deferred crediting of restaurants. In ledger mode (RESTAURANT_LEDGER) a
+checkout only appends its user_transactions rows, unsettled, instead of
+updating the restaurant row, which every checkout of a popular
+restaurant would otherwise queue on. Unsettled transactions are then
+periodically folded into restaurant.cash_balance in batches.
+
+The balance of a restaurant is its cash_balance plus its unsettled
+transactions. Settling flips the flag and credits the restaurant in one
+transaction, so reading both in one statement is always consistent.
+"""
+from app_frenzy.db import AsyncSessionLocal
+from app_frenzy.models import Restaurant, UserTransaction
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import asyncio
+import logging
+
+
+# Settling is serialized across processes with this advisory lock ("ledg"
+# in ASCII), so concurrent settlers never credit the same restaurants in
+# different orders and deadlock.
+LEDGER_LOCK_ID = 0x6C656467
+
+
+def build_balance_query(restaurant_id: int):
+    pending = (
+        select(func.coalesce(func.sum(UserTransaction.transaction_amount), 0))
+        .where(
+            UserTransaction.restaurant == Restaurant.id,
+            ~UserTransaction.settled,
+        )
+        .scalar_subquery()
+    )
+    return select(
+        Restaurant.id,
+        Restaurant.cash_balance.label("settled_balance"),
+        pending.label("pending_balance"),
+    ).where(Restaurant.id == restaurant_id)
+
+
+def build_lock_query():
+    return select(func.pg_try_advisory_xact_lock(LEDGER_LOCK_ID))
+
+
+def build_settle_query(batch_size: int):
+    # Returns the number of transactions settled.
+    pending = (
+        select(UserTransaction.id)
+        .where(~UserTransaction.settled)
+        .order_by(UserTransaction.id)
+        .limit(batch_size)
+    )
+    settled = (
+        update(UserTransaction)
+        .where(UserTransaction.id.in_(pending.scalar_subquery()))
+        .values(settled=True)
+        .returning(
+            UserTransaction.restaurant, UserTransaction.transaction_amount
+        )
+        .cte("settled")
+    )
+    totals = (
+        select(
+            settled.c.restaurant,
+            func.sum(settled.c.transaction_amount).label("amount"),
+            func.count().label("transactions"),
+        )
+        .group_by(settled.c.restaurant)
+        .cte("totals")
+    )
+    credit = (
+        update(Restaurant)
+        .where(Restaurant.id == totals.c.restaurant)
+        .values(cash_balance=Restaurant.cash_balance + totals.c.amount)
+        .returning(totals.c.transactions)
+        .cte("credit")
+    )
+    return select(func.coalesce(func.sum(credit.c.transactions), 0))
+
+
+def settle_ledger(session: Session, batch_size: int):
+    # Settles one batch. Returns 0 if another process is settling.
+    if not session.execute(build_lock_query()).scalar_one():
+        session.rollback()
+        return 0
+    settled = session.execute(build_settle_query(batch_size)).scalar_one()
+    session.commit()
+    return int(settled)
+
+
+async def async_settle_ledger(session: AsyncSession, batch_size: int):
+    result = await session.execute(build_lock_query())
+    if not result.scalar_one():
+        await session.rollback()
+        return 0
+    result = await session.execute(build_settle_query(batch_size))
+    settled = result.scalar_one()
+    await session.commit()
+    return int(settled)
+
+
+async def settle_periodically(interval: float, batch_size: int):
+    # Background task of every worker. Full batches are followed by
+    # another one straight away to catch up after a burst.
+    while True:
+        settled = 0
+        try:
+            async with AsyncSessionLocal() as session:
+                settled = await async_settle_ledger(session, batch_size)
+        except Exception:
+            logging.exception("Settling the restaurant ledger failed.")
+        if settled < batch_size:
+            await asyncio.sleep(interval)
@@ -0,0 +1,76 @@
+from app_frenzy.models import MenuItem, Restaurant, RestaurantMenuStats
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+# Set this key in Session.info to skip the refresh on flush, eg. in bulk
+# loads which refresh all the stats once at the end instead.
+SKIP_MENU_STATS_REFRESH = "skip_menu_stats_refresh"
+
+
+def build_refresh_statement(restaurant_ids=None):
+    stats = (
+        select(
+            Restaurant.id,
+            func.count(MenuItem.id),
+            func.min(MenuItem.price),
+            func.max(MenuItem.price),
+            func.percentile_cont(0.5).within_group(MenuItem.price),
+        )
+        .outerjoin(Restaurant.menu)
+        .group_by(Restaurant.id)
+    )
+    if restaurant_ids is not None:
+        stats = stats.where(Restaurant.id.in_(restaurant_ids))
+    statement = insert(RestaurantMenuStats).from_select(
+        [
+            RestaurantMenuStats.restaurant,
+            RestaurantMenuStats.dish_count,
+            RestaurantMenuStats.min_price,
+            RestaurantMenuStats.max_price,
+            RestaurantMenuStats.median_price,
+        ],
+        stats,
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[RestaurantMenuStats.restaurant],
+        set_={
+            "dish_count": statement.excluded.dish_count,
+            "min_price": statement.excluded.min_price,
+            "max_price": statement.excluded.max_price,
+            "median_price": statement.excluded.median_price,
+        },
+    )
+
+
+def refresh_restaurant_menu_stats(session: Session, restaurant_ids=None):
+    # Refreshes stats of the given restaurants, or all of them.
+    if restaurant_ids is not None and not restaurant_ids:
+        return
+    session.execute(build_refresh_statement(restaurant_ids))
+
+
+def get_changed_restaurant_ids(session: Session):
+    restaurant_ids = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, MenuItem):
+            # Pick up the old restaurant as well if the item was moved.
+            history = inspect(obj).attrs.restaurant.history
+            restaurant_ids.update(history.unchanged or ())
+            restaurant_ids.update(history.added or ())
+            restaurant_ids.update(history.deleted or ())
+        elif isinstance(obj, Restaurant) and obj in session.new:
+            restaurant_ids.add(obj.id)
+    restaurant_ids.discard(None)
+    return restaurant_ids
+
+
+@event.listens_for(Session, "after_flush")
+def keep_menu_stats_current(session, flush_context):
+    if session.info.get(SKIP_MENU_STATS_REFRESH):
+        return
+    restaurant_ids = get_changed_restaurant_ids(session)
+    if restaurant_ids:
+        session.connection().execute(
+            build_refresh_statement(sorted(restaurant_ids))
+        )
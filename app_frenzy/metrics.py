@@ -0,0 +1,318 @@
+"""
+Latency histograms of requests, of the phases of a request and of the
+SQL statements run, exported in the Prometheus text format at /metrics.
+
+Every gunicorn worker counts on its own. With METRICS_DIR set each
+worker periodically writes its histograms to <METRICS_DIR>/<pid>.json
+and /metrics adds up the files of all workers (including ones that have
+since exited, so counters never go backwards) with the live histograms
+of the worker serving the scrape. entrypoint.sh empties the directory
+before starting gunicorn.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+
+# Upper bounds in seconds, an implicit +Inf bucket follows.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+STATEMENT_KINDS = frozenset(
+    ("select", "insert", "update", "delete", "with", "begin", "commit")
+)
+
+
+class Histogram:
+    """
+    Prometheus style histogram with one series per combination of label
+    values. Counts are kept per bucket and made cumulative on export.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Tuple[str, ...],
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # Label values -> [bucket counts, sum, count].
+        self.series = {}
+
+    def observe(self, label_values: Tuple[str, ...], value: float):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.series[label_values] = series
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                [list(label_values), list(counts), total, count]
+                for label_values, (counts, total, count) in self.series.items()
+            ]
+
+
+REQUEST_DURATION = Histogram(
+    "app_frenzy_request_duration_seconds",
+    "Time from receiving a request to sending the last of its response.",
+    ("method", "route", "status"),
+)
+PHASE_DURATION = Histogram(
+    "app_frenzy_request_phase_duration_seconds",
+    "Time spent per request in each phase, framework is what is left of "
+    "the request (routing, parsing, validation, sending).",
+    ("route", "phase"),
+)
+STATEMENT_DURATION = Histogram(
+    "app_frenzy_db_statement_duration_seconds",
+    "Time spent executing a SQL statement on the cursor.",
+    ("engine", "kind"),
+)
+HISTOGRAMS = (REQUEST_DURATION, PHASE_DURATION, STATEMENT_DURATION)
+
+# Phase -> seconds spent in it by the current request. None outside of
+# requests, phases timed then (eg. by scripts) aren't recorded.
+request_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "request_phases", default=None
+)
+
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = request_phases.get()
+        if phases is not None:
+            phases[name] = phases.get(name, 0.0) + (
+                time.perf_counter() - start
+            )
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request. Requests are labelled with
+    the path of the route that served them (eg. /api/restaurant/{id}),
+    so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = None
+
+    def get_route(self, scope):
+        if self.route_paths is None:
+            self.route_paths = {
+                route.endpoint: route.path
+                for route in scope["app"].routes
+                if hasattr(route, "endpoint")
+            }
+        return self.route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        phases = {}
+        request_phases.set(phases)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = self.get_route(scope)
+            REQUEST_DURATION.observe(
+                (scope["method"], route, str(status)), elapsed
+            )
+            phases["framework"] = max(elapsed - sum(phases.values()), 0.0)
+            for name, spent in phases.items():
+                PHASE_DURATION.observe((route, name), spent)
+
+
+def get_statement_kind(statement: str):
+    words = statement.lstrip().split(None, 1)
+    kind = words[0].lower() if words else ""
+    return kind if kind in STATEMENT_KINDS else "other"
+
+
+def instrument_engine(engine, name: str):
+    # Times statements on the cursor, so for an async engine (pass its
+    # sync_engine) this includes awaiting the driver.
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("statement_start_times", []).append(
+            time.perf_counter()
+        )
+
+    def after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        start = conn.info["statement_start_times"].pop()
+        STATEMENT_DURATION.observe(
+            (name, get_statement_kind(statement)), time.perf_counter() - start
+        )
+
+    def handle_error(exception_context):
+        # A failed statement never reaches after_cursor_execute.
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("statement_start_times"):
+            conn.info["statement_start_times"].pop()
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def snapshot():
+    return {histogram.name: histogram.snapshot() for histogram in HISTOGRAMS}
+
+
+def merge_snapshots(snapshots: Iterable[Dict]):
+    # Adds up the series of every snapshot by histogram and label values.
+    merged = {histogram.name: {} for histogram in HISTOGRAMS}
+    for doc in snapshots:
+        for name, series_list in doc.items():
+            if name not in merged:
+                continue
+            for label_values, counts, total, count in series_list:
+                key = tuple(label_values)
+                series = merged[name].get(key)
+                if series is None:
+                    merged[name][key] = [list(counts), total, count]
+                    continue
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+    return merged
+
+
+def escape_label_value(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Iterable[str], values: Iterable[str]):
+    return ",".join(
+        '%s="%s"' % (name, escape_label_value(value))
+        for name, value in zip(names, values)
+    )
+
+
+def render_prometheus(merged: Dict):
+    lines: List[str] = []
+    for histogram in HISTOGRAMS:
+        lines.append(
+            "# HELP %s %s" % (histogram.name, histogram.documentation)
+        )
+        lines.append("# TYPE %s histogram" % (histogram.name))
+        bounds = [repr(bound) for bound in histogram.buckets] + ["+Inf"]
+        for label_values, (counts, total, count) in sorted(
+            merged[histogram.name].items()
+        ):
+            labels = format_labels(histogram.label_names, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append(
+                    '%s_bucket{%s%sle="%s"} %d'
+                    % (
+                        histogram.name,
+                        labels,
+                        "," if labels else "",
+                        bound,
+                        cumulative,
+                    )
+                )
+            lines.append("%s_sum{%s} %r" % (histogram.name, labels, total))
+            lines.append("%s_count{%s} %d" % (histogram.name, labels, count))
+    return "\n".join(lines) + "\n"
+
+
+def get_snapshot_path(metrics_dir: str, pid: int):
+    return os.path.join(metrics_dir, "%d.json" % (pid))
+
+
+def write_snapshot(metrics_dir: str):
+    # Written to a temporary file and renamed, so readers never see a
+    # partial snapshot.
+    path = get_snapshot_path(metrics_dir, os.getpid())
+    os.makedirs(metrics_dir, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def read_snapshots(metrics_dir: str):
+    # Yields the snapshots of the other workers.
+    own_path = get_snapshot_path(metrics_dir, os.getpid())
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        if path == own_path:
+            continue
+        try:
+            with open(path) as f:
+                yield json.load(f)
+        except (OSError, ValueError):
+            logging.exception("Skipping unreadable metrics: %s", path)
+
+
+def collect(metrics_dir: Optional[str]):
+    # Prometheus text of every worker's histograms, or only this worker's
+    # without a metrics dir.
+    snapshots = [snapshot()]
+    if metrics_dir:
+        snapshots.extend(read_snapshots(metrics_dir))
+    return render_prometheus(merge_snapshots(snapshots))
+
+
+async def write_snapshots_periodically(metrics_dir: str, interval: float):
+    # Background task of every worker.
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            write_snapshot(metrics_dir)
+        except Exception:
+            logging.exception("Writing metrics failed.")
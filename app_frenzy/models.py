@@ -1,16 +1,22 @@
 from app_frenzy.db import AppFrenzyBase
 
 from sqlalchemy import (
+    DDL,
+    BigInteger,
     Boolean,
     Column,
     DateTime,
     Enum,
-    Float,
     ForeignKey,
     Integer,
+    LargeBinary,
     String,
     Time,
     Computed,
+    UniqueConstraint,
+    event,
+    text,
+    true,
 )
 from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
@@ -18,13 +24,56 @@ from sqlalchemy.schema import Index
 from sqlalchemy.types import TypeDecorator
 
 
+from datetime import time
+from decimal import ROUND_HALF_UP, Decimal
+
 import enum
 
 
+# Trigram indexes used by fuzzy search need the pg_trgm extension.
+event.listen(
+    AppFrenzyBase.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"),
+)
+
+
 class TSVector(TypeDecorator):
     impl = TSVECTOR
 
 
+CENT = Decimal("0.01")
+
+
+def to_cents(amount):
+    # Half a cent rounds away from zero.
+    amount = Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+    return int(amount * 100)
+
+
+class Money(TypeDecorator):
+    # Decimal amounts in Python stored as whole cents, so balance
+    # arithmetic, sums and price comparisons in the database are exact.
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return to_cents(value)
+
+    def process_literal_param(self, value, dialect):
+        if value is None:
+            return "NULL"
+        return str(to_cents(value))
+
+    def process_result_value(self, value, dialect):
+        # Aggregates (sums, medians) may come back as numeric or float.
+        if value is None:
+            return None
+        return (Decimal(str(value)) / 100).quantize(CENT, ROUND_HALF_UP)
+
+
 class Days(enum.Enum):
     mon = 0
     tues = 1
@@ -35,6 +84,14 @@ class Days(enum.Enum):
     sun = 6
 
 
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def minute_of_week(day: Days, at: time):
+    return day.value * MINUTES_PER_DAY + at.hour * 60 + at.minute
+
+
 class Restaurant(AppFrenzyBase):
     __tablename__ = "restaurant"
     __table_args__ = (
@@ -43,12 +100,25 @@ class Restaurant(AppFrenzyBase):
             "name_search_vec",
             postgresql_using="gin",
         ),
+        # Keyset pagination when sorting by name.
+        Index("restaurant_name_id_idx", "name", "id"),
+        Index(
+            "restaurant_name_trgm_idx",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
     )
     id = Column(Integer, primary_key=True)
-    name = Column(String, index=True)
-    cash_balance = Column(Float)
+    # The name is the natural key of restaurants in the source data.
+    name = Column(String, index=True, unique=True)
+    cash_balance = Column(Money)
+    # Hash of the source record, lets a re-sync skip unchanged records.
+    source_hash = Column(String)
     menu = relationship("MenuItem")
     timings = relationship("RestaurantTiming")
+    open_intervals = relationship("RestaurantOpenInterval")
+    menu_stats = relationship("RestaurantMenuStats", uselist=False)
     name_search_vec = Column(
         TSVector(), Computed("to_tsvector('english', name)", persisted=True)
     )
@@ -60,17 +130,38 @@ class MenuItem(AppFrenzyBase):
         Index(
             "dish_name_gin_idx", "dish_name_search_vec", postgresql_using="gin"
         ),
+        Index("menu_item_restaurant_price_idx", "restaurant", "price"),
+        Index(
+            "dish_name_trgm_idx",
+            "dish_name",
+            postgresql_using="gin",
+            postgresql_ops={"dish_name": "gin_trgm_ops"},
+        ),
+        UniqueConstraint(
+            "restaurant", "dish_name", name="menu_item_restaurant_dish_key"
+        ),
     )
     id = Column(Integer, primary_key=True)
     restaurant = Column(Integer, ForeignKey("restaurant.id"))
     dish_name = Column(String, index=True)
-    price = Column(Float, index=True)
+    price = Column(Money, index=True)
     dish_name_search_vec = Column(
         TSVector(),
         Computed("to_tsvector('english', dish_name)", persisted=True),
     )
 
 
+class RestaurantMenuStats(AppFrenzyBase):
+    # Per restaurant summary of the menu, maintained by
+    # app_frenzy.menu_stats so filters don't need to aggregate menu_item.
+    __tablename__ = "restaurant_menu_stats"
+    restaurant = Column(Integer, ForeignKey("restaurant.id"), primary_key=True)
+    dish_count = Column(Integer, index=True)
+    min_price = Column(Money, index=True)
+    max_price = Column(Money, index=True)
+    median_price = Column(Money)
+
+
 class RestaurantTiming(AppFrenzyBase):
     __tablename__ = "restaurant_timing"
     __table_args__ = (
@@ -83,20 +174,65 @@ class RestaurantTiming(AppFrenzyBase):
     closes = Column(Time)
 
 
+class RestaurantOpenInterval(AppFrenzyBase):
+    # Opening hours as half open [opens_at, closes_at) ranges of minutes
+    # in the week (0 is monday 00:00). Bands crossing midnight are split
+    # so an interval never spans more than MINUTES_PER_DAY.
+    __tablename__ = "restaurant_open_interval"
+    __table_args__ = (
+        Index(
+            "restaurant_open_interval_idx",
+            "opens_at",
+            "closes_at",
+            "restaurant",
+        ),
+    )
+    id = Column(Integer, primary_key=True)
+    restaurant = Column(Integer, ForeignKey("restaurant.id"))
+    opens_at = Column(Integer)
+    closes_at = Column(Integer)
+
+
 class User(AppFrenzyBase):
     __tablename__ = "user"
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, index=True)
+    user_id = Column(Integer, index=True, unique=True)
     name = Column(String)
-    cash_balance = Column(Float)
+    cash_balance = Column(Money)
+    source_hash = Column(String)
     purchase_history = relationship("UserTransaction")
 
 
 class UserTransaction(AppFrenzyBase):
     __tablename__ = "user_transactions"
+    __table_args__ = (
+        # Unsettled transactions of the restaurant ledger, see
+        # app_frenzy.ledger.
+        Index(
+            "user_transactions_unsettled_idx",
+            "restaurant",
+            "id",
+            postgresql_where=text("NOT settled"),
+        ),
+    )
     id = Column(Integer, primary_key=True)
     user = Column(Integer, ForeignKey("user.id"))
     restaurant = Column(Integer, ForeignKey("restaurant.id"))
     menu_item = Column(Integer, ForeignKey("menu_item.id"))
-    transaction_amount = Column(Float)
+    quantity = Column(Integer, nullable=False, server_default="1")
+    # Price of the dish times the quantity.
+    transaction_amount = Column(Money)
     transaction_date = Column(DateTime)
+    # False until the amount is credited to the restaurant's cash_balance.
+    settled = Column(Boolean, nullable=False, server_default=true())
+
+
+class IdempotencyKey(AppFrenzyBase):
+    # Results of checkouts sent with an Idempotency-Key header, replayed
+    # to retries of the request. See app_frenzy.idempotency.
+    __tablename__ = "idempotency_key"
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    # Encoded response body, sent again as is.
+    response = Column(LargeBinary)
+    created_at = Column(DateTime, nullable=False, index=True)
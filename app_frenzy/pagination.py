@@ -0,0 +1,95 @@
+from decimal import Decimal, InvalidOperation
+
+from fastapi import HTTPException
+from sqlalchemy import and_, literal, or_, tuple_
+
+import base64
+import binascii
+import json
+import math
+
+
+# Bounds of the integer columns and of amounts stored as bigint cents.
+INT_LIMIT = 2**31
+MONEY_LIMIT = Decimal(2**63) / 100
+
+
+def invalid_cursor():
+    # Tampered or stale cursors are the client's fault, never a 500.
+    return HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def encode_cursor(doc: dict):
+    # Money values (Decimal) are encoded as strings.
+    raw = json.dumps(doc, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    # Raises a 400 for anything that isn't a cursor we handed out.
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        doc = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise invalid_cursor()
+    if not isinstance(doc, dict):
+        raise invalid_cursor()
+    return doc
+
+
+def parse_cursor_int(value):
+    # bool is an int in Python but never a cursor value.
+    if (
+        isinstance(value, bool)
+        or not isinstance(value, int)
+        or not -INT_LIMIT <= value < INT_LIMIT
+    ):
+        raise invalid_cursor()
+    return value
+
+
+def parse_cursor_float(value):
+    if (
+        isinstance(value, bool)
+        or not isinstance(value, (int, float))
+        or not math.isfinite(value)
+    ):
+        raise invalid_cursor()
+    return float(value)
+
+
+def parse_cursor_str(value):
+    if not isinstance(value, str):
+        raise invalid_cursor()
+    return value
+
+
+def parse_cursor_money(value):
+    # Encoded as a string, see encode_cursor.
+    if not isinstance(value, str):
+        raise invalid_cursor()
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        raise invalid_cursor()
+    if not amount.is_finite() or abs(amount) >= MONEY_LIMIT:
+        raise invalid_cursor()
+    return amount
+
+
+def keyset_after(sort_key, id_column, last_value, last_id):
+    """
+    Predicate selecting the rows that come after (last_value, last_id)
+    when ordering by sort_key ASC, id_column ASC. Postgres sorts NULLs
+    last in ascending order so those rows come after every value.
+    """
+    if sort_key is id_column:
+        return id_column > last_id
+    if last_value is None:
+        return and_(sort_key.is_(None), id_column > last_id)
+    # The value is bound with the sort key's type, eg. money as cents.
+    last_value = literal(last_value, sort_key.type)
+    return or_(
+        tuple_(sort_key, id_column) > tuple_(last_value, last_id),
+        sort_key.is_(None),
+    )
@@ -0,0 +1,98 @@
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+import threading
+import time
+
+
+class PoolStats:
+    """
+    Counters gathered while handing out connections from a pool.
+    Wait time is measured around the whole checkout so it includes
+    waiting on an exhausted pool, connecting and the pre-ping.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.overflow_hits = 0
+        self.timeouts = 0
+
+    def record_checkout(self, wait_time: float):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def record_overflow_hit(self):
+        with self.lock:
+            self.overflow_hits += 1
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_time_total_s": round(self.wait_time_total, 6),
+                "wait_time_avg_ms": round(
+                    self.wait_time_total * 1000 / self.checkouts, 3
+                )
+                if self.checkouts
+                else 0.0,
+                "wait_time_max_ms": round(self.wait_time_max * 1000, 3),
+                "overflow_hits": self.overflow_hits,
+                "timeouts": self.timeouts,
+            }
+
+
+class InstrumentedPoolMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            conn = super().connect()
+        except exc.TimeoutError:
+            self.stats.record_timeout()
+            raise
+        self.stats.record_checkout(time.perf_counter() - start)
+        return conn
+
+    def _inc_overflow(self):
+        # Overflow starts at -pool_size, so only connections opened beyond
+        # pool_size take it above zero.
+        created = super()._inc_overflow()
+        if created and self._overflow > 0:
+            self.stats.record_overflow_hit()
+        return created
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        stats.update(
+            {
+                "size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "timeout_s": self.timeout(),
+            }
+        )
+        return stats
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(
+    InstrumentedPoolMixin, AsyncAdaptedQueuePool
+):
+    pass
@@ -0,0 +1,18 @@
+from decimal import Decimal
+
+from app_frenzy.metrics import phase
+
+import orjson
+
+
+def encode_default(value):
+    # Types orjson doesn't encode natively, encoded as FastAPI's
+    # jsonable_encoder would so responses keep their shape.
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def dump_json(content):
+    with phase("encode"):
+        return orjson.dumps(content, default=encode_default)
@@ -1,20 +1,22 @@
 from app_frenzy.models import Days
+from app_frenzy.pagination import INT_LIMIT, MONEY_LIMIT
 from datetime import datetime, time
+from decimal import Decimal
 
 from fastapi import HTTPException
 from pydantic import BaseModel, Field, validator
-from typing import Optional
+from typing import List, Optional
 
 
 class RestaurantSchema(BaseModel):
     name: str = Field(alias="restaurantName")
-    cash_balance: float = Field(alias="cashBalance")
+    cash_balance: Decimal = Field(alias="cashBalance")
 
 
 class MenuItemSchema(BaseModel):
     restaurant: Optional[int]
     dish_name: str = Field(alias="dishName")
-    price: float
+    price: Decimal
 
 
 class RestaurantTimingSchema(BaseModel):
@@ -27,24 +29,26 @@ class RestaurantTimingSchema(BaseModel):
 class UserSchema(BaseModel):
     user_id: int = Field(alias="id")
     name: str
-    cash_balance: float = Field(alias="cashBalance")
+    cash_balance: Decimal = Field(alias="cashBalance")
 
 
 class UserTransactionSchema(BaseModel):
     user: Optional[int]
     restaurant: Optional[int]
     menu_item: Optional[int]
-    transaction_amount: float = Field(alias="transactionAmount")
+    transaction_amount: Decimal = Field(alias="transactionAmount")
     transaction_date: datetime = Field(alias="transactionDate")
 
 
 class RestaurantFilterQueryParamsSchema(BaseModel):
     open_at: Optional[datetime]
-    price_lower: Optional[float]
-    price_upper: Optional[float]
+    price_lower: Optional[Decimal]
+    price_upper: Optional[Decimal]
     ndish_gt: Optional[int]
     ndish_lt: Optional[int]
     limit: Optional[int]
+    sort: str
+    cursor: Optional[str]
 
     @validator("open_at", pre=True)
     def validate_transform_open_at(cls, value):
@@ -59,6 +63,27 @@ class RestaurantFilterQueryParamsSchema(BaseModel):
             )
         return dt
 
+    @validator("price_lower", "price_upper")
+    def validate_price(cls, value, field):
+        # Compared as bigint cents, larger amounts can't be bound.
+        if value is not None and (
+            not value.is_finite() or abs(value) >= MONEY_LIMIT
+        ):
+            raise HTTPException(
+                status_code=422,
+                detail="Price out of range: %s." % (field.name),
+            )
+        return value
+
+    @validator("ndish_gt", "ndish_lt")
+    def validate_ndish(cls, value, field):
+        if value is not None and not -INT_LIMIT <= value < INT_LIMIT:
+            raise HTTPException(
+                status_code=422,
+                detail="Dish count out of range: %s." % (field.name),
+            )
+        return value
+
 
 class ListRestaurantResponseSchema(BaseModel):
     id: int
@@ -72,23 +97,40 @@ class ListMenuItemResponseSchema(BaseModel):
     id: int
     restaurant_id: int = Field(alias="restaurant")
     dish_name: str
-    price: float
+    price: Decimal
 
     class Config:
         orm_mode = True
 
 
+class CartItemSchema(BaseModel):
+    dish_id: int
+    # Bounded so that quantity times price fits the amount columns.
+    quantity: int = Field(1, ge=1, le=1000)
+
+
 class ProcessCartRequestSchema(BaseModel):
     restaurant_id: int
-    dish_id: int
     user_id: int
+    # A single dish, kept for clients predating items.
+    dish_id: Optional[int]
+    items: List[CartItemSchema] = Field([], max_items=100)
+
+    @validator("items", always=True)
+    def validate_items(cls, items, values):
+        if values.get("dish_id") is not None:
+            items = [CartItemSchema(dish_id=values["dish_id"]), *items]
+        if not items:
+            raise ValueError("Cart has no items.")
+        return items
 
 
 class UserTransactionResponseSchema(BaseModel):
     id: int
     restaurant: int
     menu_item: int
-    transaction_amount: float
+    quantity: int
+    transaction_amount: Decimal
     transaction_date: datetime
 
     class Config:
@@ -0,0 +1,584 @@
+"""
+Result cache shared by every worker, used for /api/restaurant pages.
+
+The backend is picked by RESTAURANT_CACHE_URL:
+
+    shm:///dev/shm/app_frenzy_cache   files in a directory, on /dev/shm
+                                      (shared memory) for a single host
+    redis://localhost:6379/0          any server speaking the Redis
+                                      protocol, shared across hosts
+
+Keys embed a catalog version. Catalog changes bump the version (ORM
+commits touching restaurants, dishes or opening hours do so here, the
+ETL scripts once they are done), so entries of older versions are never
+read again and age out. Entries also expire after RESTAURANT_CACHE_TTL.
+The per worker search cache keys on the same version. Without a backend
+each worker keeps its own version, bumped only by the changes it commits.
+
+On a miss one caller per key computes the value under a lock entry in
+the backend while the others, in any worker, poll for its result for up
+to RESTAURANT_CACHE_LOCK_WAIT seconds before computing it themselves.
+
+The backend is a cache: when it fails the value is computed as if it
+missed, the error is logged and the backend is left alone for a while
+(RESTAURANT_CACHE_RETRY_INTERVAL, doubling while it keeps failing).
+Backends are called from the event loop, what may block (network, file
+locks, directory scans) is awaited or run in the default executor.
+"""
+from typing import Awaitable, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from app_frenzy.config import get_app_frenzy_settings
+from app_frenzy.models import (
+    MenuItem,
+    Restaurant,
+    RestaurantMenuStats,
+    RestaurantOpenInterval,
+    RestaurantTiming,
+)
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+import weakref
+
+
+settings = get_app_frenzy_settings()
+
+CATALOG_MODELS = (
+    Restaurant,
+    MenuItem,
+    RestaurantTiming,
+    RestaurantOpenInterval,
+    RestaurantMenuStats,
+)
+# Session.info key set once a flush touched the catalog.
+CATALOG_CHANGED = "catalog_changed"
+# Bumped on every catalog change, keys of cached results embed it.
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+class ShmBackend:
+    """
+    Every entry is a file named by the hash of its key, holding its expiry
+    time followed by the value. Files are written whole under a temporary
+    name first and then renamed (set) or linked (add) into place, so
+    readers never see a partial entry. Reads and writes of files on tmpfs
+    never wait on a disk and run inline, counter increments (which wait on
+    a file lock) and pruning run in the default executor. Pruning of the
+    oldest entries past maxsize runs at most every PRUNE_INTERVAL seconds
+    per worker.
+    """
+
+    HEADER = struct.Struct(">d")
+    PRUNE_INTERVAL = 60.0
+    # Entries too short to hold a header can only be left by a crashed
+    # writer, they count as present (eg. as a taken lock) for this long.
+    PARTIAL_TTL = 10.0
+
+    def __init__(self, path: str, maxsize: int):
+        self.path = path
+        self.maxsize = maxsize
+        self.prune_at = time.monotonic() + self.PRUNE_INTERVAL
+        os.makedirs(path, exist_ok=True)
+
+    def get_entry_path(self, key: str):
+        return os.path.join(
+            self.path, hashlib.sha1(key.encode("utf-8")).hexdigest()
+        )
+
+    def get_counter_path(self, key: str):
+        return self.get_entry_path(key) + ".counter"
+
+    def read(self, path: str):
+        # Returns the entry's value, b"" for a partial entry, or None when
+        # there is no live entry. Expired entries are removed.
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < self.HEADER.size:
+            expires_at = stat.st_mtime + self.PARTIAL_TTL
+        else:
+            (expires_at,) = self.HEADER.unpack_from(data)
+        if expires_at < time.time():
+            self.remove_expired(path, stat.st_ino)
+            return None
+        return data[self.HEADER.size :]
+
+    def write_temp(self, value: bytes, ttl: float):
+        # Expiry is wall clock time, it's compared across processes.
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.HEADER.pack(time.time() + ttl))
+            f.write(value)
+        return tmp_path
+
+    def remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def remove_expired(self, path: str, inode: int):
+        # Another worker may have replaced the expired entry since it was
+        # read (eg. taken an expired lock), its file is left alone.
+        try:
+            if os.stat(path).st_ino == inode:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def get(self, key: str):
+        # Partial entries are misses.
+        return self.read(self.get_entry_path(key)) or None
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        os.replace(self.write_temp(value, ttl), self.get_entry_path(key))
+        if time.monotonic() >= self.prune_at:
+            self.prune_at = time.monotonic() + self.PRUNE_INTERVAL
+            asyncio.get_running_loop().run_in_executor(None, self.prune)
+
+    async def add(self, key: str, value: bytes, ttl: float):
+        # Sets the key only if it's absent (or expired), returns whether
+        # it did. Linking fails if the name exists, so exactly one worker
+        # creates the entry, already complete.
+        path = self.get_entry_path(key)
+        tmp_path = self.write_temp(value, ttl)
+        try:
+            for _ in range(2):
+                try:
+                    os.link(tmp_path, path)
+                    return True
+                except FileExistsError:
+                    # Expired entries are removed by read, then retried.
+                    if self.read(path) is not None:
+                        return False
+            return False
+        finally:
+            self.remove(tmp_path)
+
+    async def delete(self, key: str):
+        self.remove(self.get_entry_path(key))
+
+    def read_counter(self, key: str):
+        try:
+            with open(self.get_counter_path(key), "rb") as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    async def get_counter(self, key: str):
+        return self.read_counter(key)
+
+    def incr_locked(self, key: str):
+        # Serialized across processes by a lock on a file next to it.
+        path = self.get_counter_path(key)
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            tmp_path = self.write_counter_temp(self.read_counter(key) + 1)
+            os.replace(tmp_path, path)
+        return self.read_counter(key)
+
+    def write_counter_temp(self, value: int):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(str(value).encode())
+        return tmp_path
+
+    async def incr(self, key: str):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.incr_locked, key
+        )
+
+    def prune(self):
+        # Counters and temporary files have a suffix, entries don't.
+        try:
+            entries = []
+            for entry in os.scandir(self.path):
+                if "." not in entry.name:
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        pass
+            if len(entries) <= self.maxsize:
+                return
+            entries.sort()
+            for _, path in entries[: len(entries) - self.maxsize]:
+                self.remove(path)
+        except Exception:
+            logging.exception("Pruning the result cache failed.")
+
+    async def close(self):
+        pass
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnectionClosed(RedisError):
+    pass
+
+
+class RedisBackend:
+    """
+    Minimal asyncio client of the Redis protocol (RESP). Connections are
+    pooled per event loop and every command, connecting included, is
+    given timeout seconds. A pooled connection the server has closed
+    meanwhile (eg. idle timeout, restart) is dropped and the command is
+    retried once on a new one. Only the handful of commands the cache needs
+    are used, so any server implementing them can stand in for Redis (see
+    scripts/resp_server.py).
+    """
+
+    MAX_IDLE_CONNECTIONS = 16
+
+    def __init__(self, host: str, port: int, db: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        # Event loop -> idle (reader, writer) pairs, streams are bound to
+        # the loop they were opened in.
+        self.idle = weakref.WeakKeyDictionary()
+
+    async def connect(self):
+        conn = await asyncio.open_connection(self.host, self.port)
+        if self.db:
+            await self.execute(conn, ("SELECT", self.db))
+        return conn
+
+    @staticmethod
+    def encode_command(args):
+        parts = [b"*%d\r\n" % (len(args))]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def read_reply(self, reader):
+        line = await reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise RedisConnectionClosed("Connection closed.")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self.read_reply(reader) for _ in range(length)]
+        raise RedisError("Unexpected reply: %r" % (line))
+
+    async def execute(self, conn, args):
+        reader, writer = conn
+        writer.write(self.encode_command(args))
+        await writer.drain()
+        return await self.read_reply(reader)
+
+    async def command(self, *args):
+        idle = self.idle.setdefault(asyncio.get_running_loop(), [])
+        conn = idle.pop() if idle else None
+
+        async def run():
+            nonlocal conn
+            if conn is not None:
+                try:
+                    return await self.execute(conn, args)
+                except (RedisConnectionClosed, ConnectionError):
+                    # Closed while idle, retried once on a new connection.
+                    conn[1].close()
+                    conn = None
+            conn = await self.connect()
+            return await self.execute(conn, args)
+
+        try:
+            reply = await asyncio.wait_for(run(), self.timeout)
+        except BaseException:
+            # The connection may be out of step with the server.
+            if conn is not None:
+                conn[1].close()
+            raise
+        if len(idle) < self.MAX_IDLE_CONNECTIONS:
+            idle.append(conn)
+        else:
+            conn[1].close()
+        return reply
+
+    async def close(self):
+        idle = self.idle.pop(asyncio.get_running_loop(), [])
+        for _, writer in idle:
+            writer.close()
+            await writer.wait_closed()
+
+    async def get(self, key: str):
+        return await self.command("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.command("SET", key, value, "PX", int(ttl * 1000))
+
+    async def add(self, key: str, value: bytes, ttl: float):
+        reply = await self.command(
+            "SET", key, value, "PX", int(ttl * 1000), "NX"
+        )
+        return reply is not None
+
+    async def delete(self, key: str):
+        await self.command("DEL", key)
+
+    async def get_counter(self, key: str):
+        return int(await self.command("GET", key) or 0)
+
+    async def incr(self, key: str):
+        return await self.command("INCR", key)
+
+
+def make_backend(url: Optional[str], maxsize: int, timeout: float):
+    # None disables the cache.
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "shm":
+        return ShmBackend(parsed.path, maxsize)
+    if parsed.scheme == "redis":
+        return RedisBackend(
+            parsed.hostname or "localhost",
+            parsed.port or 6379,
+            int(parsed.path.lstrip("/") or 0),
+            timeout,
+        )
+    raise ValueError("Unsupported cache url: %s" % (url))
+
+
+class CacheUnavailable(Exception):
+    pass
+
+
+class SharedResultCache:
+    POLL_INTERVAL = 0.005
+    MAX_POLL_INTERVAL = 0.05
+    MAX_RETRY_INTERVAL = 30.0
+
+    def __init__(
+        self,
+        backend,
+        namespace: str,
+        ttl: float,
+        lock_ttl: float,
+        lock_wait: float,
+        retry_interval: float,
+    ):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.retry_interval = retry_interval
+        # Consecutive failures and when the backend is next tried.
+        self.failures = 0
+        self.retry_at = 0.0
+        # Version bumps scheduled from synchronous code.
+        self.tasks = set()
+        # Catalog version without a backend, only bumped by the changes
+        # committed in this worker.
+        self.local_version = 0
+        # Per worker counters.
+        self.hits = 0
+        self.misses = 0
+        self.waited_hits = 0
+        self.lock_timeouts = 0
+        self.errors = 0
+        self.skipped = 0
+
+    async def call_backend(self, method: str, *args):
+        # Raises CacheUnavailable when the backend fails, after which it's
+        # left alone for retry_interval seconds, doubling on every further
+        # failure, so an unreachable server doesn't cost every request a
+        # timeout.
+        if time.monotonic() < self.retry_at:
+            self.skipped += 1
+            raise CacheUnavailable()
+        try:
+            result = await getattr(self.backend, method)(*args)
+        except Exception as e:
+            self.errors += 1
+            self.failures += 1
+            backoff = min(
+                self.retry_interval * 2 ** (self.failures - 1),
+                self.MAX_RETRY_INTERVAL,
+            )
+            self.retry_at = time.monotonic() + backoff
+            logging.warning(
+                "Result cache %s failed, retrying in %.1fs: %r",
+                method,
+                backoff,
+                e,
+            )
+            raise CacheUnavailable() from e
+        self.failures = 0
+        return result
+
+    async def try_backend(self, method: str, *args):
+        try:
+            return await self.call_backend(method, *args)
+        except CacheUnavailable:
+            return None
+
+    def make_key(self, params: Dict, version: int):
+        digest = hashlib.sha1(
+            json.dumps(params, sort_keys=True, separators=(",", ":")).encode()
+        ).hexdigest()
+        return "%s:%d:%s" % (self.namespace, version, digest)
+
+    async def get_version(self):
+        # Catalog version, the worker's own without a backend, None while
+        # the backend is unavailable.
+        if self.backend is None:
+            return self.local_version
+        return await self.try_backend("get_counter", CATALOG_VERSION_KEY)
+
+    async def get_or_compute(
+        self, params: Dict, compute: Callable[[], Awaitable[bytes]]
+    ):
+        if self.backend is None:
+            return await compute()
+        version = await self.get_version()
+        if version is None:
+            return await compute()
+        key = self.make_key(params, version)
+        lock_key = key + ":lock"
+        try:
+            value = await self.call_backend("get", key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            locked = await self.call_backend(
+                "add", lock_key, b"1", self.lock_ttl
+            )
+        except CacheUnavailable:
+            return await compute()
+        if locked:
+            try:
+                value = await compute()
+                await self.try_backend("set", key, value, self.ttl)
+            finally:
+                await self.try_backend("delete", lock_key)
+            return value
+        # Another caller is computing it, wait for its result.
+        deadline = time.monotonic() + self.lock_wait
+        interval = self.POLL_INTERVAL
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+                value = await self.call_backend("get", key)
+                if value is not None:
+                    self.waited_hits += 1
+                    return value
+            self.lock_timeouts += 1
+        except CacheUnavailable:
+            pass
+        return await compute()
+
+    async def async_bump_version(self):
+        # Entries cached so far are never read again.
+        self.local_version += 1
+        if self.backend is not None:
+            await self.try_backend("incr", CATALOG_VERSION_KEY)
+
+    def bump_version(self):
+        # For synchronous code: scheduled on the running event loop (eg.
+        # from session events in a request), else run to completion (eg.
+        # by scripts).
+        if self.backend is None:
+            self.local_version += 1
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.bump_version_and_close())
+            return
+        task = loop.create_task(self.async_bump_version())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def bump_version_and_close(self):
+        try:
+            await self.async_bump_version()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self.backend is not None:
+            await self.backend.close()
+
+    def get_stats(self):
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "waited_hits": self.waited_hits,
+            "lock_timeouts": self.lock_timeouts,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "retry_in_s": max(self.retry_at - time.monotonic(), 0.0),
+        }
+
+
+restaurant_cache = SharedResultCache(
+    make_backend(
+        settings.RESTAURANT_CACHE_URL,
+        settings.RESTAURANT_CACHE_SIZE,
+        settings.RESTAURANT_CACHE_TIMEOUT,
+    ),
+    "restaurants",
+    settings.RESTAURANT_CACHE_TTL,
+    settings.RESTAURANT_CACHE_LOCK_TTL,
+    settings.RESTAURANT_CACHE_LOCK_WAIT,
+    settings.RESTAURANT_CACHE_RETRY_INTERVAL,
+)
+
+
+@event.listens_for(Session, "after_flush")
+def track_catalog_changes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CATALOG_MODELS):
+            session.info[CATALOG_CHANGED] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_restaurant_cache(session):
+    # Bumped once committed, so a page computed meanwhile from the old
+    # data isn't cached under the new version.
+    if session.info.pop(CATALOG_CHANGED, False):
+        restaurant_cache.bump_version()
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_catalog_changes(session):
+    session.info.pop(CATALOG_CHANGED, None)
@@ -0,0 +1,149 @@
+"""
+Slow query log. Statements taking at least SLOW_QUERY_THRESHOLD_MS are
+logged with their bound parameters and kept in a bounded in memory ring
+buffer, served by GET /admin/slow-queries.
+
+A sample (SLOW_QUERY_EXPLAIN_RATE, none by default) of the slow plain
+SELECTs is run again under EXPLAIN (ANALYZE, BUFFERS) and the plan is attached to the
+entry. Plans are captured off the request path, one at a time per
+worker, on a connection of the blocking engine inside a transaction
+that is rolled back. Statements that write (including SELECTs of data
+modifying CTEs, which start with WITH) are never explained since
+ANALYZE executes them.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import event
+
+import logging
+import random
+import threading
+import time
+
+
+MAX_LOGGED_PARAMETERS_LENGTH = 2000
+
+
+class SlowQueryLog:
+    def __init__(
+        self,
+        threshold_ms: float,
+        size: int,
+        explain_engine,
+        explain_rate: float,
+        explain_timeout_ms: int,
+    ):
+        self.threshold = threshold_ms / 1000
+        self.explain_engine = explain_engine
+        self.explain_rate = explain_rate
+        self.explain_timeout_ms = explain_timeout_ms
+        self.lock = threading.Lock()
+        self.entries = deque(maxlen=size)
+        self.recorded = 0
+        self.explaining = False
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def should_explain(self, statement: str, executemany: bool):
+        if executemany or statement.lstrip()[:6].lower() != "select":
+            return False
+        return random.random() < self.explain_rate
+
+    def record(self, engine_name, statement, parameters, duration, explain):
+        entry = {
+            "recorded_at": datetime.utcnow().isoformat(),
+            "engine": engine_name,
+            "duration_ms": round(duration * 1000, 3),
+            "statement": statement,
+            "parameters": repr(parameters)[:MAX_LOGGED_PARAMETERS_LENGTH],
+            "plan": None,
+        }
+        logging.warning(
+            "Slow query (%.1f ms): %s parameters: %s",
+            entry["duration_ms"],
+            statement,
+            entry["parameters"],
+        )
+        with self.lock:
+            self.entries.append(entry)
+            self.recorded += 1
+            # Only one plan is captured at a time, the other slow queries
+            # arriving meanwhile go without.
+            explain = explain and not self.explaining
+            if explain:
+                self.explaining = True
+        if explain:
+            self.executor.submit(self.explain, entry, statement, parameters)
+
+    def explain(self, entry, statement, parameters):
+        try:
+            with self.explain_engine.connect() as conn:
+                transaction = conn.begin()
+                try:
+                    conn.exec_driver_sql(
+                        "SET LOCAL statement_timeout = %d"
+                        % (self.explain_timeout_ms)
+                    )
+                    rows = conn.exec_driver_sql(
+                        "EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters
+                    )
+                    entry["plan"] = [row[0] for row in rows]
+                finally:
+                    transaction.rollback()
+        except Exception as e:
+            entry["plan_error"] = str(e)
+            logging.exception("Capturing a slow query plan failed.")
+        finally:
+            with self.lock:
+                self.explaining = False
+
+    def watch(self, engine, name: str):
+        # Slow statements of engine are recorded under name.
+        def before_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            conn.info.setdefault("slow_query_start_times", []).append(
+                time.perf_counter()
+            )
+
+        def after_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            duration = (
+                time.perf_counter() - conn.info["slow_query_start_times"].pop()
+            )
+            # Captured plans take as long as the query, they aren't logged.
+            if duration >= self.threshold and not statement.startswith(
+                "EXPLAIN"
+            ):
+                self.record(
+                    name,
+                    statement,
+                    parameters,
+                    duration,
+                    self.should_explain(statement, executemany),
+                )
+
+        def handle_error(exception_context):
+            conn = exception_context.connection
+            if conn is not None and conn.info.get("slow_query_start_times"):
+                conn.info["slow_query_start_times"].pop()
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(engine, "handle_error", handle_error)
+
+    def get_entries(self, limit: int):
+        # Most recent first. Copies, plans may still be filled in.
+        with self.lock:
+            return [dict(entry) for entry in reversed(self.entries)][:limit]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "threshold_ms": self.threshold * 1000,
+                "explain_rate": self.explain_rate,
+                "size": len(self.entries),
+                "maxsize": self.entries.maxlen,
+                "recorded": self.recorded,
+            }
@@ -4,7 +4,17 @@ set -e
 if $INIT_DB
 then
   python scripts/init-db.py
-  python scripts/populate-db.py
+  python scripts/populate-db.py --sync
 fi
 
-gunicorn app_frenzy.app:app -w 4 --bind 0.0.0.0:8000 -k uvicorn.workers.UvicornWorker --access-logfile -
\ No newline at end of file
+# Workers share their metrics through this directory, the counts of a
+# previous run are dropped.
+export METRICS_DIR=${METRICS_DIR:-/tmp/app_frenzy_metrics}
+rm -rf "$METRICS_DIR"
+mkdir -p "$METRICS_DIR"
+
+# Workers share /api/restaurant pages through files in shared memory,
+# unless pointed at a Redis server (redis://host:6379/0).
+export RESTAURANT_CACHE_URL=${RESTAURANT_CACHE_URL:-shm:///dev/shm/app_frenzy_cache}
+
+gunicorn app_frenzy.app:app -w ${WEB_WORKERS:-4} --bind 0.0.0.0:8000 -k uvicorn.workers.UvicornWorker --access-logfile -
\ No newline at end of file
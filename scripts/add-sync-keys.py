@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+"""
+Add the source hash columns and natural key constraints used by
+populate-db.py --sync to a database created before they existed. Fails
+if the natural keys are already duplicated (eg. after populating twice),
+such a database has to be rebuilt.
+"""
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import engine
+
+import logging
+
+
+STATEMENTS = [
+    "ALTER TABLE restaurant ADD COLUMN IF NOT EXISTS source_hash varchar",
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS source_hash varchar',
+    "DROP INDEX IF EXISTS ix_restaurant_name",
+    "CREATE UNIQUE INDEX ix_restaurant_name ON restaurant (name)",
+    "DROP INDEX IF EXISTS ix_user_user_id",
+    'CREATE UNIQUE INDEX ix_user_user_id ON "user" (user_id)',
+    "ALTER TABLE menu_item "
+    "DROP CONSTRAINT IF EXISTS menu_item_restaurant_dish_key",
+    "ALTER TABLE menu_item ADD CONSTRAINT menu_item_restaurant_dish_key "
+    "UNIQUE (restaurant, dish_name)",
+]
+
+
+if __name__ == "__main__":
+    logging.info("Adding sync keys.")
+    with engine.begin() as conn:
+        for statement in STATEMENTS:
+            conn.exec_driver_sql(statement)
+    logging.info("Adding sync keys complete.")
@@ -0,0 +1,25 @@
+#!/usr/bin/python3
+"""
+Add the quantity column of multi item carts to the user_transactions
+table of a database created before it existed. Existing transactions
+are for a single dish.
+"""
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import engine
+
+import logging
+
+
+if __name__ == "__main__":
+    logging.info("Adding user transaction quantity.")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "ALTER TABLE user_transactions ADD COLUMN IF NOT EXISTS "
+            "quantity integer NOT NULL DEFAULT 1"
+        )
+    logging.info("Adding user transaction quantity complete.")
@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+"""
+Add the settled flag and index of the restaurant ledger to the
+user_transactions table of a database created before they existed.
+Existing transactions are already credited to their restaurants.
+"""
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import engine
+
+import logging
+
+
+STATEMENTS = [
+    "ALTER TABLE user_transactions ADD COLUMN IF NOT EXISTS "
+    "settled boolean NOT NULL DEFAULT true",
+    "CREATE INDEX IF NOT EXISTS user_transactions_unsettled_idx "
+    "ON user_transactions (restaurant, id) WHERE NOT settled",
+]
+
+
+if __name__ == "__main__":
+    logging.info("Adding user transaction settled flag.")
+    with engine.begin() as conn:
+        for statement in STATEMENTS:
+            conn.exec_driver_sql(statement)
+    logging.info("Adding user transaction settled flag complete.")
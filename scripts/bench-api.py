@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+"""
+Load test the API endpoints under concurrency and report requests/sec
+along with latency percentiles.
+
+Start the server with ASYNC_DB=true and ASYNC_DB=false in turn and run
+this script against each to compare the asyncio and blocking data layers.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from scripts.benchmarks import run_concurrent, save_results
+
+import json
+import logging
+import requests
+
+
+ENDPOINTS = {
+    "restaurant": ("GET", "/api/restaurant?filter=open_at&limit=20", None),
+    "search": ("GET", "/api/search?s=chicken", None),
+    "cart": (
+        "POST",
+        "/api/cart/process",
+        {"restaurant_id": 1, "dish_id": 1, "user_id": 1},
+    ),
+}
+
+
+def make_request_func(base_url: str, endpoint: str):
+    method, path, body = ENDPOINTS[endpoint]
+    session = requests.Session()
+    url = base_url.rstrip("/") + path
+
+    def call():
+        # Non 2xx responses (eg. wallet low on funds) still exercise the
+        # full request path and count towards latency.
+        resp = session.request(method, url, json=body)
+        if resp.status_code >= 500:
+            raise Exception("Server error: %s" % (resp.status_code))
+
+    return call
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument(
+        "--endpoint",
+        action="append",
+        choices=list(ENDPOINTS),
+        help="Endpoint to benchmark. Can be repeated, defaults to all.",
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--label", default="default")
+    parser.add_argument("--output", help="Write results as JSON to path.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = {"label": args.label, "endpoints": {}}
+    for endpoint in args.endpoint or list(ENDPOINTS):
+        logging.info("Benchmarking endpoint: %s", endpoint)
+        results["endpoints"][endpoint] = run_concurrent(
+            make_request_func(args.base_url, endpoint),
+            args.requests,
+            args.concurrency,
+        )
+    print(json.dumps(results, indent=2))
+    if args.output:
+        save_results(args.output, results)
@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+"""
+Measure latency percentiles of every endpoint and restaurant filter
+combination against a running server and save them as JSON, so runs on
+different commits or datasets can be compared with --compare.
+
+Load the database with a dataset from generate-dataset.py first and pass
+its directory as --dataset-dir to record its manifest with the results.
+Each scenario repeats the same request, so start the server with
+SEARCH_CACHE_SIZE=0 and without RESTAURANT_CACHE_URL to time queries
+rather than the caches.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from datetime import datetime, timezone
+from itertools import combinations
+from scripts.benchmarks import run_concurrent, save_results
+
+import json
+import logging
+import requests
+import subprocess
+
+
+# A wednesday at noon UTC, fixed so every run filters the same way.
+OPEN_AT = 1621425600
+FILTER_PARAMS = {
+    "open_at": {"open_at": OPEN_AT},
+    "price": {"price_lower": 10, "price_upper": 30},
+    "ndish": {"ndish_gt": 5},
+}
+SORTS = ("id", "name", "ndish", "price")
+SEARCHES = {
+    "search_fulltext": {"s": "chicken"},
+    "search_fulltext_words": {"s": "spicy chicken tikka"},
+    "search_prefix": {"s": "chick tik", "prefix": "true"},
+    "search_fuzzy": {"s": "chiken tika", "mode": "fuzzy"},
+}
+
+
+def restaurant_scenarios(limit: int):
+    # Every combination of filters sorted by id, then every sort with all
+    # the filters. The last one has no limit, for large responses.
+    scenarios = {}
+    for count in range(1, len(FILTER_PARAMS) + 1):
+        for filters in combinations(FILTER_PARAMS, count):
+            for sort in SORTS if count == len(FILTER_PARAMS) else ("id",):
+                params = [("filter", name) for name in filters]
+                for filter_type in filters:
+                    params.extend(FILTER_PARAMS[filter_type].items())
+                params.extend([("sort", sort), ("limit", limit)])
+                name = "restaurant_%s_by_%s" % ("_".join(filters), sort)
+                scenarios[name] = ("GET", "/api/restaurant", params, None)
+    scenarios["restaurant_ndish_unlimited"] = (
+        "GET",
+        "/api/restaurant",
+        [("filter", "ndish"), ("ndish_gt", 0)],
+        None,
+    )
+    return scenarios
+
+
+def build_scenarios(args):
+    scenarios = restaurant_scenarios(args.limit)
+    for name, params in SEARCHES.items():
+        params = dict(params, limit=args.limit)
+        scenarios[name] = ("GET", "/api/search", params, None)
+    scenarios["restaurant_balance"] = (
+        "GET",
+        "/api/restaurant/%d/balance" % (args.restaurant_id),
+        None,
+        None,
+    )
+    if args.include_cart:
+        scenarios["cart"] = (
+            "POST",
+            "/api/cart/process",
+            None,
+            {
+                "restaurant_id": args.restaurant_id,
+                "user_id": args.user_id,
+                "items": [{"dish_id": args.dish_id}],
+            },
+        )
+    return scenarios
+
+
+def make_request_func(base_url: str, scenario):
+    method, path, params, body = scenario
+    session = requests.Session()
+    url = base_url.rstrip("/") + path
+
+    def call():
+        # Client errors (eg. a wallet low on funds) still exercise the full
+        # request path and count towards latency.
+        resp = session.request(method, url, params=params, json=body)
+        if resp.status_code >= 500:
+            raise Exception("Server error: %s" % (resp.status_code))
+
+    return call
+
+
+def current_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=APP_FRENZY_PATH,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_manifest(dataset_dir: str):
+    if not dataset_dir:
+        return None
+    with open(os.path.join(dataset_dir, "manifest.json")) as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, results: dict):
+    # Relative change of p50 and p99 per scenario run in both, negative
+    # is faster.
+    changes = {}
+    for name, result in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        changes[name] = {}
+        for key in ("p50_ms", "p99_ms"):
+            if before[key] and result[key] is not None:
+                changes[name][key] = "%+.1f%%" % (
+                    (result[key] - before[key]) / before[key] * 100
+                )
+    return changes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="Scenario to run, can be repeated. Defaults to all.",
+    )
+    parser.add_argument("--list", action="store_true", help="List scenarios.")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--restaurant-id", type=int, default=1)
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--dish-id", type=int, default=1)
+    parser.add_argument(
+        "--include-cart",
+        action="store_true",
+        help="Also time checkouts, which charge the user. Only use it "
+        "against a development database.",
+    )
+    parser.add_argument("--dataset-dir", help="Dataset the server serves.")
+    parser.add_argument("--label", default="default")
+    parser.add_argument("--output", help="Write results as JSON to path.")
+    parser.add_argument(
+        "--compare", help="Results of an earlier run to compare against."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    scenarios = build_scenarios(args)
+    if args.list:
+        print("\n".join(scenarios))
+        sys.exit(0)
+    unknown = set(args.scenario or []) - set(scenarios)
+    if unknown:
+        sys.exit("Unknown scenarios: %s" % (", ".join(sorted(unknown))))
+    results = {
+        "label": args.label,
+        "commit": current_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "dataset": read_manifest(args.dataset_dir),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "scenarios": {},
+    }
+    for name in args.scenario or list(scenarios):
+        logging.info("Benchmarking scenario: %s", name)
+        func = make_request_func(args.base_url, scenarios[name])
+        if args.warmup:
+            run_concurrent(func, args.warmup, args.concurrency)
+        results["scenarios"][name] = run_concurrent(
+            func, args.requests, args.concurrency
+        )
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        results["compared_to"] = {
+            "label": baseline["label"],
+            "commit": baseline.get("commit"),
+        }
+        results["changes"] = compare(baseline, results)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        save_results(args.output, results)
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+"""
+Measure ETL throughput for a range of --workers values on the datasets
+already downloaded to data/ by populate-db.py.
+
+Loading for real needs empty tables, so every run drops and recreates
+all the tables first: only pass --reset-db against a scratch database.
+Without it only the transform stage is measured.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import engine
+from app_frenzy.models import AppFrenzyBase
+from scripts.bulk_loader import (
+    bulk_load_restaurants,
+    bulk_load_users,
+    stage_restaurants,
+    stage_users,
+)
+from scripts.streaming import JSONArrayReader, batched, unique_by_field
+from scripts.benchmarks import save_results
+
+import json
+import logging
+import multiprocessing
+import time
+
+
+DATA_PATH = os.path.join(APP_FRENZY_PATH, "data")
+RESTAURANT_FILE_PATH = os.path.join(DATA_PATH, "restaurant_db.json")
+USER_FILE_PATH = os.path.join(DATA_PATH, "user.json")
+
+
+def read_restaurants():
+    return unique_by_field(
+        JSONArrayReader(RESTAURANT_FILE_PATH), "restaurantName"
+    )
+
+
+def bench_transform(workers: int, batch_size: int):
+    result = {}
+    for name, docs, stage_func in (
+        ("restaurants", read_restaurants(), stage_restaurants),
+        ("users", JSONArrayReader(USER_FILE_PATH), stage_users),
+    ):
+        start = time.perf_counter()
+        with multiprocessing.Pool(workers) as pool:
+            rows = sum(
+                sum(map(len, staged.values()))
+                for staged in pool.imap_unordered(
+                    stage_func, batched(docs, batch_size)
+                )
+            )
+        result[name] = throughput(rows, time.perf_counter() - start)
+    return result
+
+
+def bench_load(workers: int, batch_size: int):
+    AppFrenzyBase.metadata.drop_all(bind=engine)
+    AppFrenzyBase.metadata.create_all(bind=engine)
+    rows, elapsed = bulk_load_restaurants(
+        read_restaurants(), batch_size, workers
+    )
+    result = {"restaurants": throughput(rows, elapsed)}
+    rows, elapsed = bulk_load_users(
+        JSONArrayReader(USER_FILE_PATH), batch_size, workers
+    )
+    result["users"] = throughput(rows, elapsed)
+    return result
+
+
+def throughput(rows: int, elapsed: float):
+    return {
+        "rows": rows,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else None,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--reset-db",
+        action="store_true",
+        help="Drop, recreate and load all the tables for every run.",
+    )
+    parser.add_argument("--output", help="Write results as JSON to path.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    bench = bench_load if args.reset_db else bench_transform
+    results = {"mode": bench.__name__, "runs": {}}
+    for workers in args.workers:
+        logging.info("Running ETL benchmark with %d workers.", workers)
+        results["runs"][workers] = bench(workers, args.batch_size)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        save_results(args.output, results)
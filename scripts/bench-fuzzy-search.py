@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+"""
+Check that fuzzy search is served by the pg_trgm GIN index on a large
+catalog. Generates a scratch table of synthetic dish names (1M rows by
+default) shaped like menu_item, then times misspelled lookups with the
+trigram index and with a sequential scan and prints the query plans.
+The scratch table is dropped at the end unless --keep is given.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.config import get_app_frenzy_settings
+from app_frenzy.db import engine
+from scripts.benchmarks import summarise, timed
+from sqlalchemy import text
+
+import json
+import logging
+
+
+TABLE = "bench_fuzzy_dish"
+WORDS = [
+    "chicken",
+    "tikka",
+    "masala",
+    "butter",
+    "garlic",
+    "naan",
+    "steak",
+    "salmon",
+    "teriyaki",
+    "burger",
+    "cheese",
+    "pepperoni",
+    "pizza",
+    "noodle",
+    "soup",
+    "dumpling",
+    "spicy",
+    "grilled",
+    "roasted",
+    "sourdough",
+    "chocolate",
+    "vanilla",
+    "pudding",
+    "lemon",
+    "shrimp",
+    "tempura",
+    "curry",
+    "lamb",
+    "kebab",
+    "falafel",
+]
+MISSPELLINGS = ["chiken tika", "buter chiken", "peperoni piza", "tempra"]
+
+
+def create_dataset(conn, rows: int):
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text("DROP TABLE IF EXISTS %s" % (TABLE)))
+    conn.execute(
+        text("CREATE TABLE %s (id serial PRIMARY KEY, dish_name text)" % TABLE)
+    )
+    # Every dish name is three words picked from WORDS plus a number so
+    # names don't repeat.
+    conn.execute(
+        text(
+            "INSERT INTO %s (dish_name) "
+            "SELECT initcap(w[1 + (i * 7) %% :n]) || ' ' || "
+            "w[1 + (i * 13 / 3) %% :n] || ' ' || w[1 + (i / 11) %% :n] "
+            "|| ' ' || i "
+            "FROM generate_series(1, :rows) AS i, "
+            "(SELECT CAST(:words AS text[]) AS w) AS words" % (TABLE)
+        ),
+        {"rows": rows, "n": len(WORDS), "words": WORDS},
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX %s_trgm_idx ON %s USING gin "
+            "(dish_name gin_trgm_ops)" % (TABLE, TABLE)
+        )
+    )
+    conn.execute(text("ANALYZE %s" % (TABLE)))
+
+
+def fuzzy_query(limit: int):
+    return text(
+        "SELECT id, dish_name, word_similarity(:terms, dish_name) AS rank "
+        "FROM %s WHERE dish_name %%> :terms "
+        "ORDER BY rank DESC, id LIMIT %d" % (TABLE, limit)
+    )
+
+
+def bench(conn, limit: int, rounds: int, use_index: bool):
+    conn.execute(
+        text("SET enable_bitmapscan = %s" % (use_index and "on" or "off"))
+    )
+    conn.execute(
+        text("SET enable_indexscan = %s" % (use_index and "on" or "off"))
+    )
+    query = fuzzy_query(limit)
+    samples = []
+    for _ in range(rounds):
+        for terms in MISSPELLINGS:
+            samples.append(
+                timed(lambda: conn.execute(query, {"terms": terms}).all())
+            )
+    plan = conn.execute(
+        text("EXPLAIN (ANALYZE, BUFFERS) " + query.text),
+        {"terms": MISSPELLINGS[0]},
+    )
+    result = summarise(samples, sum(samples))
+    result["plan"] = [row[0] for row in plan]
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--keep", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    settings = get_app_frenzy_settings()
+    results = {"rows": args.rows}
+    with engine.begin() as conn:
+        logging.info("Generating %d dishes.", args.rows)
+        create_dataset(conn, args.rows)
+    with engine.connect() as conn:
+        conn.execute(
+            text(
+                "SET pg_trgm.word_similarity_threshold = %f"
+                % (settings.SEARCH_FUZZY_THRESHOLD)
+            )
+        )
+        results["trgm_index"] = bench(conn, args.limit, args.rounds, True)
+        results["seq_scan"] = bench(conn, args.limit, args.rounds, False)
+    if not args.keep:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE %s" % (TABLE)))
+    print(json.dumps(results, indent=2))
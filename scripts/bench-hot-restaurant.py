@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""
+Measure checkout throughput of a single popular restaurant: many users
+order the same dish at increasing concurrency. Run it against a server
+with RESTAURANT_LEDGER=false and then true to compare updating the
+restaurant row on every checkout with the deferred ledger.
+
+This tops up the balances of the users taking part, only run it against
+a development database.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import SessionLocal
+from app_frenzy.models import User
+from scripts.benchmarks import run_concurrent, save_results
+from sqlalchemy import select, update
+
+import itertools
+import json
+import logging
+import requests
+import threading
+
+
+def prepare_users(count: int, balance: float):
+    with SessionLocal() as session:
+        user_ids = (
+            session.execute(
+                select(User.user_id).order_by(User.id).limit(count)
+            )
+            .scalars()
+            .all()
+        )
+        session.execute(
+            update(User)
+            .where(User.user_id.in_(user_ids))
+            .values(cash_balance=balance)
+        )
+        session.commit()
+    return user_ids
+
+
+def make_checkout_func(args, user_ids):
+    session = requests.Session()
+    url = args.base_url.rstrip("/") + "/api/cart/process"
+    # Round robin over the users, so orders don't queue on a user's row.
+    users = itertools.cycle(user_ids)
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            user_id = next(users)
+        resp = session.post(
+            url,
+            json={
+                "restaurant_id": args.restaurant_id,
+                "user_id": user_id,
+                "items": [{"dish_id": args.dish_id}],
+            },
+        )
+        if resp.status_code != 200:
+            raise Exception("Checkout failed: %s" % (resp.status_code))
+
+    return call
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--restaurant-id", type=int, default=1)
+    parser.add_argument("--dish-id", type=int, default=1)
+    parser.add_argument("--users", type=int, default=256)
+    parser.add_argument("--balance", type=float, default=1000000.0)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 8, 32, 64, 128]
+    )
+    parser.add_argument("--label", default="default")
+    parser.add_argument("--output", help="Write results as JSON to path.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    user_ids = prepare_users(args.users, args.balance)
+    results = {"label": args.label, "concurrency": {}}
+    for concurrency in args.concurrency:
+        logging.info("Checking out at concurrency %d.", concurrency)
+        results["concurrency"][concurrency] = run_concurrent(
+            make_checkout_func(args, user_ids), args.requests, concurrency
+        )
+    print(json.dumps(results, indent=2))
+    if args.output:
+        save_results(args.output, results)
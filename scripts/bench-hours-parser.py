@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""
+Check that scripts.hours_parser gives the same days and times as the
+previous regex and dateutil based parser on every opening hours string of
+the restaurant dataset downloaded by populate-db.py, then time both.
+Exits with status 1 on any mismatch.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from dateutil.parser import parse
+from scripts.benchmarks import summarise, timed
+from scripts.hours_parser import extract_days_list, parse_opening_hours
+from scripts.streaming import JSONArrayReader
+
+import json
+import re
+
+
+RESTAURANT_FILE_PATH = os.path.join(
+    APP_FRENZY_PATH, "data", "restaurant_db.json"
+)
+
+LEGACY_TIMING_RE = re.compile(
+    "(?P<first>([a-zA-Z]+\s*,?-?\s*)*[a-zA-Z]+)\s*(?P<second>\d*:?\d+\s*[a-zA-Z]+\s*-\s*\d*:?\d+\s*[a-zA-Z]+)"
+)
+
+
+def legacy_parse_opening_hours(timings: str):
+    parsed = []
+    for timing in timings.split("/"):
+        matches = LEGACY_TIMING_RE.match(timing.strip())
+        open_closes = matches.group("second").split("-")
+        opens = parse(open_closes[0]).time()
+        closes = parse(open_closes[1]).time()
+        for day in extract_days_list(matches.group("first")):
+            parsed.append((day, opens, closes))
+    return tuple(parsed)
+
+
+def outcome(parser, timings: str):
+    try:
+        return parser(timings)
+    except Exception:
+        # Both reject malformed strings, with different exceptions.
+        return "error"
+
+
+def check_corpus(corpus):
+    mismatches = []
+    for timings in set(corpus):
+        expected = outcome(legacy_parse_opening_hours, timings)
+        got = outcome(parse_opening_hours, timings)
+        if expected != got:
+            mismatches.append(
+                {"timings": timings, "legacy": str(expected), "new": str(got)}
+            )
+    return mismatches
+
+
+def bench(parser, corpus, rounds, clear_cache=False):
+    samples = []
+    for _ in range(rounds):
+        if clear_cache:
+            parse_opening_hours.cache_clear()
+        samples.append(timed(lambda: [outcome(parser, t) for t in corpus]))
+    result = summarise(samples, sum(samples))
+    result["per_string_us"] = round(min(samples) / len(corpus) * 1000000, 3)
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--file", default=RESTAURANT_FILE_PATH)
+    parser.add_argument("--rounds", type=int, default=5)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    corpus = [
+        restaurant["openingHours"] for restaurant in JSONArrayReader(args.file)
+    ]
+    mismatches = check_corpus(corpus)
+    results = {
+        "strings": len(corpus),
+        "distinct_strings": len(set(corpus)),
+        "mismatches": mismatches,
+        "legacy": bench(legacy_parse_opening_hours, corpus, args.rounds),
+        "new_uncached": bench(
+            parse_opening_hours.__wrapped__, corpus, args.rounds
+        ),
+        "new_cold_cache": bench(
+            parse_opening_hours, corpus, args.rounds, clear_cache=True
+        ),
+        "new_warm_cache": bench(parse_opening_hours, corpus, args.rounds),
+    }
+    print(json.dumps(results, indent=2))
+    if mismatches:
+        sys.exit(1)
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+Compare the open_at filter over restaurant_open_interval against the
+previous day/opens/closes probe on restaurant_timing (restaurant_timing_idx)
+for a spread of times over the week.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.actions import RestaurantFilter
+from app_frenzy.db import SessionLocal
+from app_frenzy.models import Days, Restaurant, RestaurantTiming
+from datetime import datetime, timedelta
+from scripts.benchmarks import summarise, timed
+from sqlalchemy import select
+
+import json
+
+
+def timing_index_query(open_at: datetime):
+    open_at_time = open_at.time()
+    return (
+        select(Restaurant)
+        .join(Restaurant.timings)
+        .filter(
+            RestaurantTiming.day == Days(open_at.weekday()),
+            RestaurantTiming.opens < open_at_time,
+            RestaurantTiming.closes > open_at_time,
+        )
+    )
+
+
+def interval_index_query(open_at: datetime):
+    restaurant_filter = RestaurantFilter(
+        ["open_at"], open_at, None, None, None, None, None
+    )
+    return restaurant_filter.build_query()
+
+
+def sample_times(count: int):
+    # Spread samples over a week starting on a monday.
+    start = datetime(2021, 5, 17)
+    step = timedelta(minutes=7 * 24 * 60 // count)
+    return [start + step * i for i in range(count)]
+
+
+def explain(session, query):
+    compiled = query.compile(session.get_bind())
+    rows = session.connection().exec_driver_sql(
+        "EXPLAIN (ANALYZE, BUFFERS) " + str(compiled), compiled.params
+    )
+    return [row[0] for row in rows]
+
+
+def bench(session, make_query, times, rounds):
+    samples = []
+    matches = 0
+    for _ in range(rounds):
+        for open_at in times:
+            query = make_query(open_at)
+            samples.append(
+                timed(lambda: session.execute(query).scalars().all())
+            )
+    for open_at in times:
+        matches += len(set(session.execute(make_query(open_at)).scalars()))
+    result = summarise(samples, sum(samples))
+    result["restaurants_matched"] = matches
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=48)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--explain", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    times = sample_times(args.samples)
+    results = {}
+    with SessionLocal() as session:
+        for name, make_query in (
+            ("restaurant_timing_idx", timing_index_query),
+            ("restaurant_open_interval_idx", interval_index_query),
+        ):
+            results[name] = bench(session, make_query, times, args.rounds)
+            if args.explain:
+                results[name]["plan"] = explain(session, make_query(times[0]))
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""
+Compare the per row cost of building /api/restaurant and /api/search
+responses the previous way (ORM objects through GenerateResponse, then
+FastAPI's jsonable_encoder and json) with the projected path (rows of the
+schema's columns through ProjectedResponse, then orjson).
+
+Rows are synthesized, so this runs without a database. Pass --db to also
+time fetching --rows restaurants both ways from the configured database,
+which adds the cost of hydrating ORM objects.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.actions import (
+    GenerateResponse,
+    ProjectedResponse,
+    get_schema_columns,
+)
+from app_frenzy.db import SessionLocal
+from app_frenzy.models import MenuItem, Restaurant
+from app_frenzy.responses import dump_json
+from app_frenzy.schemas import (
+    ListMenuItemResponseSchema,
+    ListRestaurantResponseSchema,
+)
+from collections import namedtuple
+from decimal import Decimal
+from fastapi.encoders import jsonable_encoder
+from scripts.benchmarks import summarise, timed
+from sqlalchemy import select
+
+import json
+
+
+RestaurantRow = namedtuple("RestaurantRow", ("id", "name", "sort_key"))
+MenuItemRow = namedtuple(
+    "MenuItemRow", ("id", "restaurant", "dish_name", "price")
+)
+
+
+def make_restaurants(count: int):
+    objects = [
+        Restaurant(
+            id=i,
+            name="Restaurant %d" % i,
+            cash_balance=Decimal("1234.56"),
+        )
+        for i in range(1, count + 1)
+    ]
+    rows = [
+        RestaurantRow(i, "Restaurant %d" % i, i) for i in range(1, count + 1)
+    ]
+    return objects, rows
+
+
+def make_dishes(count: int):
+    objects = [
+        MenuItem(
+            id=i,
+            restaurant=i % 100 + 1,
+            dish_name="Dish %d" % i,
+            price=Decimal("12.34"),
+        )
+        for i in range(1, count + 1)
+    ]
+    rows = [
+        MenuItemRow(i, i % 100 + 1, "Dish %d" % i, Decimal("12.34"))
+        for i in range(1, count + 1)
+    ]
+    return objects, rows
+
+
+def previous_path(objects, schema):
+    results = GenerateResponse(objects, schema).generate()
+    content = jsonable_encoder({"status": "success", "results": results})
+    return json.dumps(content).encode()
+
+
+def projected_path(rows, schema):
+    results = ProjectedResponse(rows, schema).generate()
+    return dump_json({"status": "success", "results": results})
+
+
+def bench(func, rounds: int, count: int):
+    samples = [timed(func) for _ in range(rounds)]
+    result = summarise(samples, sum(samples))
+    result["per_row_us"] = round(min(samples) / count * 1000000, 3)
+    return result
+
+
+def bench_serialization(args):
+    results = {}
+    for name, make, schema in (
+        ("restaurants", make_restaurants, ListRestaurantResponseSchema),
+        ("dishes", make_dishes, ListMenuItemResponseSchema),
+    ):
+        objects, rows = make(args.rows)
+        if json.loads(previous_path(objects, schema)) != json.loads(
+            projected_path(rows, schema)
+        ):
+            raise Exception("Responses of the two paths differ: %s" % name)
+        results[name] = {
+            "previous": bench(
+                lambda: previous_path(objects, schema), args.rounds, args.rows
+            ),
+            "projected": bench(
+                lambda: projected_path(rows, schema), args.rounds, args.rows
+            ),
+        }
+    return results
+
+
+def bench_db(args):
+    schema = ListRestaurantResponseSchema
+    orm_query = select(Restaurant).order_by(Restaurant.id).limit(args.rows)
+    row_query = (
+        select(*get_schema_columns(schema, Restaurant))
+        .order_by(Restaurant.id)
+        .limit(args.rows)
+    )
+
+    def previous():
+        # A fresh session each time, as every request gets one.
+        with SessionLocal() as session:
+            previous_path(session.execute(orm_query).scalars().all(), schema)
+
+    def projected():
+        with SessionLocal() as session:
+            projected_path(session.execute(row_query).all(), schema)
+
+    return {
+        "previous": bench(previous, args.rounds, args.rows),
+        "projected": bench(projected, args.rounds, args.rows),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--db", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = {"rows": args.rows, "serialization": bench_serialization(args)}
+    if args.db:
+        results["restaurants_from_db"] = bench_db(args)
+    print(json.dumps(results, indent=2))
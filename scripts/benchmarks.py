@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import json
+import math
+import time
+
+
+def percentile(samples: List[float], pct: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[rank]
+
+
+def summarise(samples: List[float], elapsed: float, errors: int = 0):
+    # Latencies are collected in seconds and reported in milliseconds.
+    return {
+        "requests": len(samples) + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "p50_ms": _ms(percentile(samples, 50)),
+        "p90_ms": _ms(percentile(samples, 90)),
+        "p99_ms": _ms(percentile(samples, 99)),
+        "max_ms": _ms(max(samples) if samples else None),
+    }
+
+
+def _ms(value):
+    if value is None:
+        return None
+    return round(value * 1000, 3)
+
+
+def timed(func: Callable):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def run_concurrent(func: Callable, total: int, concurrency: int):
+    # Calls func total times spread over concurrency threads and returns
+    # the latency summary. Any exception raised by func counts as an error.
+    samples = []
+    errors = 0
+
+    def call(_):
+        try:
+            return timed(func)
+        except Exception:
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency in executor.map(call, range(total)):
+            if latency is None:
+                errors += 1
+            else:
+                samples.append(latency)
+    return summarise(samples, time.perf_counter() - start, errors)
+
+
+def save_results(path: str, results: Dict):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
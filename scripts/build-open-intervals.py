@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+"""
+Rebuild restaurant_open_interval from the restaurant_timing rows of an
+already populated database. New loads fill it in populate-db.py.
+"""
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import SessionLocal
+from app_frenzy.models import RestaurantOpenInterval, RestaurantTiming
+from app_frenzy.shared_cache import restaurant_cache
+from scripts.transformers import split_into_open_intervals
+from sqlalchemy import delete, select
+
+import logging
+
+
+def build_open_intervals(session):
+    session.execute(delete(RestaurantOpenInterval))
+    timings = session.execute(select(RestaurantTiming)).scalars()
+    intervals = []
+    for timing in timings:
+        for opens_at, closes_at in split_into_open_intervals(
+            timing.day, timing.opens, timing.closes
+        ):
+            intervals.append(
+                {
+                    "restaurant": timing.restaurant,
+                    "opens_at": opens_at,
+                    "closes_at": closes_at,
+                }
+            )
+    if intervals:
+        session.execute(RestaurantOpenInterval.__table__.insert(), intervals)
+    session.commit()
+    return len(intervals)
+
+
+if __name__ == "__main__":
+    logging.info("Rebuilding restaurant open intervals.")
+    with SessionLocal() as session:
+        count = build_open_intervals(session)
+    restaurant_cache.bump_version()
+    logging.info("Created %d restaurant open intervals.", count)
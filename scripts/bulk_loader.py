@@ -0,0 +1,399 @@
+"""
+Bulk load mode of populate-db.py. Transformed rows are streamed into
+temporary staging tables with COPY and moved to the real tables with set
+based INSERT ... SELECT statements, which also assign the foreign keys.
+Every batch is committed once. Money is staged as whole cents, the way
+the tables store it.
+
+Staged parents are numbered (seq) within the batch, children refer to
+that number and real ids are drawn from the table's sequence up front.
+Batches are independent of each other, so with workers > 1 they are
+transformed in a process pool and written by concurrent connections.
+"""
+from datetime import datetime
+from dateutil.parser import parse
+from typing import Dict, Iterable, List
+
+from app_frenzy.db import engine
+from app_frenzy.menu_stats import build_refresh_statement
+from app_frenzy.models import RestaurantTiming, to_cents
+from app_frenzy.schemas import UserTransactionSchema
+from scripts.streaming import batched
+from scripts.transformers import (
+    transform_into_menu_objs,
+    transform_into_restaurant_obj,
+    transform_into_restaurant_open_interval_objs,
+    transform_into_restaurant_timing_objs,
+    transform_into_user_obj,
+)
+
+import io
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+
+DAYS_ENUM = RestaurantTiming.__table__.c.day.type.name
+
+STAGING_TABLES = {
+    "stage_restaurant": (
+        "seq int, id int, name text, cash_balance bigint, source_hash text"
+    ),
+    "stage_menu_item": "restaurant_seq int, dish_name text, price bigint",
+    "stage_restaurant_timing": (
+        "restaurant_seq int, day text, opens time, closes time"
+    ),
+    "stage_open_interval": ("restaurant_seq int, opens_at int, closes_at int"),
+    "stage_user": (
+        "seq int, id int, user_id int, name text, cash_balance bigint, "
+        "source_hash text"
+    ),
+    "stage_purchase": (
+        "user_seq int, restaurant_name text, dish_name text, "
+        "transaction_amount bigint, transaction_date timestamp"
+    ),
+}
+
+RESTAURANT_TIMING_STATEMENTS = [
+    "INSERT INTO restaurant_timing (restaurant, day, opens, closes) "
+    "SELECT r.id, CAST(t.day AS %s), t.opens, t.closes "
+    "FROM stage_restaurant_timing t "
+    "JOIN stage_restaurant r ON r.seq = t.restaurant_seq" % (DAYS_ENUM),
+    "INSERT INTO restaurant_open_interval (restaurant, opens_at, closes_at) "
+    "SELECT r.id, i.opens_at, i.closes_at FROM stage_open_interval i "
+    "JOIN stage_restaurant r ON r.seq = i.restaurant_seq",
+]
+
+RESTAURANT_STATEMENTS = [
+    "UPDATE stage_restaurant "
+    "SET id = nextval(pg_get_serial_sequence('restaurant', 'id'))",
+    "INSERT INTO restaurant (id, name, cash_balance, source_hash) "
+    "SELECT id, name, cash_balance, source_hash FROM stage_restaurant",
+    "INSERT INTO menu_item (restaurant, dish_name, price) "
+    "SELECT r.id, m.dish_name, m.price FROM stage_menu_item m "
+    "JOIN stage_restaurant r ON r.seq = m.restaurant_seq",
+    *RESTAURANT_TIMING_STATEMENTS,
+]
+
+# Name lookups for purchases, built once before loading users. Restaurant
+# names are unique in the source data, dishes are looked up within the
+# restaurant.
+USER_SETUP_STATEMENTS = [
+    "DROP TABLE IF EXISTS lookup_restaurant, lookup_menu_item",
+    "CREATE TEMP TABLE lookup_restaurant AS "
+    "SELECT max(id) AS id, name FROM restaurant GROUP BY name",
+    "CREATE INDEX ON lookup_restaurant (name)",
+    "CREATE TEMP TABLE lookup_menu_item AS "
+    "SELECT min(id) AS id, restaurant, dish_name FROM menu_item "
+    "GROUP BY restaurant, dish_name",
+    "CREATE INDEX ON lookup_menu_item (restaurant, dish_name)",
+]
+
+USER_STATEMENTS = [
+    "UPDATE stage_user "
+    "SET id = nextval(pg_get_serial_sequence('\"user\"', 'id'))",
+    'INSERT INTO "user" (id, user_id, name, cash_balance, source_hash) '
+    "SELECT id, user_id, name, cash_balance, source_hash FROM stage_user",
+    # Purchases that don't resolve to a dish are dropped.
+    "INSERT INTO user_transactions "
+    '("user", restaurant, menu_item, transaction_amount, transaction_date) '
+    "SELECT u.id, r.id, m.id, p.transaction_amount, p.transaction_date "
+    "FROM stage_purchase p "
+    "JOIN stage_user u ON u.seq = p.user_seq "
+    "JOIN lookup_restaurant r ON r.name = p.restaurant_name "
+    "JOIN lookup_menu_item m "
+    "ON m.restaurant = r.id AND m.dish_name = p.dish_name",
+]
+
+
+def format_copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(cursor, table: str, rows: List[tuple]):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(map(format_copy_value, row)))
+        buf.write("\n")
+    buf.seek(0)
+    cursor.copy_expert("COPY %s FROM STDIN" % (table), buf)
+    return len(rows)
+
+
+def create_staging_tables(cursor):
+    for table, columns in STAGING_TABLES.items():
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS %s (%s) ON COMMIT DELETE ROWS"
+            % (table, columns)
+        )
+
+
+def stage_restaurants(restaurants: List[Dict]):
+    staged = {name: [] for name in STAGING_TABLES}
+    for seq, restaurant in enumerate(restaurants):
+        restaurant_obj = transform_into_restaurant_obj(restaurant)
+        # The staging number stands in for the id until the batch is
+        # inserted.
+        restaurant_obj.id = seq
+        staged["stage_restaurant"].append(
+            (
+                seq,
+                None,
+                restaurant_obj.name,
+                to_cents(restaurant_obj.cash_balance),
+                restaurant_obj.source_hash,
+            )
+        )
+        for menu_item in transform_into_menu_objs(
+            restaurant["menu"], restaurant_obj
+        ):
+            staged["stage_menu_item"].append(
+                (seq, menu_item.dish_name, to_cents(menu_item.price))
+            )
+        timing_objs = transform_into_restaurant_timing_objs(
+            restaurant["openingHours"], restaurant_obj
+        )
+        for timing in timing_objs:
+            staged["stage_restaurant_timing"].append(
+                (seq, timing.day.name, timing.opens, timing.closes)
+            )
+        for interval in transform_into_restaurant_open_interval_objs(
+            timing_objs, restaurant_obj
+        ):
+            staged["stage_open_interval"].append(
+                (seq, interval.opens_at, interval.closes_at)
+            )
+    return staged
+
+
+def stage_users(users: List[Dict]):
+    staged = {name: [] for name in STAGING_TABLES}
+    for seq, user in enumerate(users):
+        user_obj = transform_into_user_obj(user)
+        staged["stage_user"].append(
+            (
+                seq,
+                None,
+                user_obj.user_id,
+                user_obj.name,
+                to_cents(user_obj.cash_balance),
+                user_obj.source_hash,
+            )
+        )
+        for purchase in user["purchaseHistory"]:
+            transaction = UserTransactionSchema(
+                transactionAmount=purchase["transactionAmount"],
+                transactionDate=parse(purchase["transactionDate"].strip()),
+            )
+            staged["stage_purchase"].append(
+                (
+                    seq,
+                    purchase["restaurantName"],
+                    purchase["dishName"],
+                    to_cents(transaction.transaction_amount),
+                    transaction.transaction_date,
+                )
+            )
+    return staged
+
+
+class BatchWriter:
+    """
+    Writes staged batches through its own connection, which holds the
+    temporary staging tables. Every batch is committed once.
+    """
+
+    def __init__(self, statements: List[str], setup_statements: List[str]):
+        self.statements = statements
+        self.connection = engine.raw_connection()
+        self.cursor = self.connection.cursor()
+        create_staging_tables(self.cursor)
+        for statement in setup_statements:
+            self.cursor.execute(statement)
+        self.connection.commit()
+
+    def write(self, staged: Dict[str, List[tuple]]):
+        rows = 0
+        try:
+            for table, staged_rows in staged.items():
+                if staged_rows:
+                    rows += copy_rows(self.cursor, table, staged_rows)
+            for statement in self.statements:
+                self.cursor.execute(statement)
+            # Staging tables are emptied on commit.
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        return rows
+
+    def close(self):
+        self.cursor.close()
+        self.connection.close()
+
+
+def load_batches(
+    docs: Iterable[Dict],
+    stage_func,
+    statements: List[str],
+    batch_size: int,
+    setup_statements: List[str] = (),
+):
+    # Returns the number of rows staged along with the time it took.
+    start = time.perf_counter()
+    rows = 0
+    writer = BatchWriter(statements, setup_statements)
+    try:
+        for batch in batched(docs, batch_size):
+            rows += writer.write(stage_func(batch))
+    finally:
+        writer.close()
+    return rows, time.perf_counter() - start
+
+
+def write_batches(
+    batches: queue.Queue,
+    statements: List[str],
+    setup_statements: List[str],
+    result: Dict,
+):
+    # Writer thread. Consumes staged batches until it gets None. After a
+    # failure it keeps draining the queue so the producer never blocks.
+    writer = None
+    try:
+        writer = BatchWriter(statements, setup_statements)
+    except Exception as e:
+        result["errors"].append(e)
+    while True:
+        staged = batches.get()
+        if staged is None:
+            break
+        if writer is None or result["errors"]:
+            continue
+        try:
+            rows = writer.write(staged)
+            with result["lock"]:
+                result["rows"] += rows
+        except Exception as e:
+            result["errors"].append(e)
+    if writer is not None:
+        writer.close()
+
+
+def parallel_load_batches(
+    docs: Iterable[Dict],
+    stage_func,
+    statements: List[str],
+    batch_size: int,
+    workers: int,
+    setup_statements: List[str] = (),
+):
+    """
+    Transforms batches in a pool of worker processes (the CPU bound part)
+    and hands the staged batches over a bounded queue to as many writer
+    threads, each with its own connection. At most 2 * workers batches
+    are in flight, so memory stays bounded whatever the input size.
+    """
+    start = time.perf_counter()
+    result = {"rows": 0, "errors": [], "lock": threading.Lock()}
+    staged_batches = queue.Queue(maxsize=workers * 2)
+    in_flight = threading.Semaphore(workers * 2)
+    stop = threading.Event()
+
+    def feed():
+        for batch in batched(docs, batch_size):
+            in_flight.acquire()
+            if stop.is_set():
+                return
+            yield batch
+
+    # Forked workers must not share the parent's pooled connections.
+    engine.dispose()
+    with multiprocessing.Pool(workers) as pool:
+        writers = [
+            threading.Thread(
+                target=write_batches,
+                args=(staged_batches, statements, setup_statements, result),
+            )
+            for _ in range(workers)
+        ]
+        for writer in writers:
+            writer.start()
+        try:
+            for staged in pool.imap_unordered(stage_func, feed()):
+                in_flight.release()
+                staged_batches.put(staged)
+                if result["errors"]:
+                    break
+        finally:
+            # Unblock the feeder in case we stopped early.
+            stop.set()
+            for _ in range(workers * 2):
+                in_flight.release()
+            for _ in writers:
+                staged_batches.put(None)
+            for writer in writers:
+                writer.join()
+    if result["errors"]:
+        raise result["errors"][0]
+    return result["rows"], time.perf_counter() - start
+
+
+def log_throughput(name: str, rows: int, elapsed: float):
+    logging.info(
+        "Loaded %d %s rows in %.2fs (%.0f rows/sec).",
+        rows,
+        name,
+        elapsed,
+        rows / elapsed if elapsed else 0,
+    )
+
+
+def load(docs, stage_func, statements, batch_size, workers, **kwargs):
+    if workers > 1:
+        return parallel_load_batches(
+            docs, stage_func, statements, batch_size, workers, **kwargs
+        )
+    return load_batches(docs, stage_func, statements, batch_size, **kwargs)
+
+
+def bulk_load_restaurants(
+    restaurants: Iterable[Dict], batch_size: int, workers: int = 1
+):
+    rows, elapsed = load(
+        restaurants,
+        stage_restaurants,
+        RESTAURANT_STATEMENTS,
+        batch_size,
+        workers,
+    )
+    log_throughput("restaurant", rows, elapsed)
+    with engine.begin() as conn:
+        conn.execute(build_refresh_statement())
+    return rows, elapsed
+
+
+def bulk_load_users(users: Iterable[Dict], batch_size: int, workers: int = 1):
+    # Purchases resolve against the restaurants, which must be loaded.
+    rows, elapsed = load(
+        users,
+        stage_users,
+        USER_STATEMENTS,
+        batch_size,
+        workers,
+        setup_statements=USER_SETUP_STATEMENTS,
+    )
+    log_throughput("user", rows, elapsed)
+    return rows, elapsed
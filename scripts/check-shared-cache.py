@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+"""
+Check the backends of the shared result cache: get/set/add/delete/incr
+and expiry, then single-flight (within a process and across worker
+processes), version bumps and failure handling of SharedResultCache on
+top of them. The redis:// backend is checked against the stand-in of
+scripts/resp_server.py unless --redis-url points at a server (use a
+scratch database, keys are written), the stand-in is also restarted to
+check pooled connections are replaced.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.shared_cache import SharedResultCache, make_backend
+from scripts.resp_server import RespServer
+
+import asyncio
+import json
+import socket
+import tempfile
+import uuid
+
+
+async def check_backend(backend):
+    prefix = "check:%s:" % (uuid.uuid4().hex)
+    key, counter = prefix + "key", prefix + "counter"
+    checks = {"get_missing": await backend.get(key) is None}
+    await backend.set(key, b"value", 5)
+    checks["set_get"] = await backend.get(key) == b"value"
+    checks["add_existing"] = not await backend.add(key, b"other", 5)
+    checks["add_kept_value"] = await backend.get(key) == b"value"
+    await backend.delete(key)
+    checks["delete"] = await backend.get(key) is None
+    checks["add_missing"] = await backend.add(key, b"new", 5)
+    checks["add_set_value"] = await backend.get(key) == b"new"
+    checks["counter_missing"] = await backend.get_counter(counter) == 0
+    checks["incr"] = [await backend.incr(counter) for _ in range(3)] == [
+        1,
+        2,
+        3,
+    ]
+    checks["counter"] = await backend.get_counter(counter) == 3
+    await backend.set(prefix + "expiring", b"value", 0.05)
+    await asyncio.sleep(0.1)
+    checks["expiry"] = await backend.get(prefix + "expiring") is None
+    await backend.delete(key)
+    return checks
+
+
+def make_cache(backend, retry_interval: float = 1.0, namespace=None):
+    return SharedResultCache(
+        backend,
+        namespace or "check:%s" % (uuid.uuid4().hex),
+        ttl=5,
+        lock_ttl=5,
+        lock_wait=2,
+        retry_interval=retry_interval,
+    )
+
+
+async def check_cache(backend, callers: int):
+    cache = make_cache(backend)
+    computed = 0
+
+    async def compute():
+        nonlocal computed
+        computed += 1
+        await asyncio.sleep(0.05)
+        return b"page"
+
+    values = await asyncio.gather(
+        *[cache.get_or_compute({"page": 1}, compute) for _ in range(callers)]
+    )
+    checks = {
+        "single_flight": computed == 1 and set(values) == {b"page"},
+        "waiters_got_result": cache.waited_hits == callers - 1,
+    }
+    await cache.get_or_compute({"page": 1}, compute)
+    checks["hit"] = computed == 1
+    await cache.async_bump_version()
+    await cache.get_or_compute({"page": 1}, compute)
+    checks["version_bump_recomputes"] = computed == 2
+
+    async def fail():
+        raise ValueError()
+
+    try:
+        await cache.get_or_compute({"page": 2}, fail)
+    except ValueError:
+        pass
+    await cache.get_or_compute({"page": 2}, compute)
+    checks["failed_compute_releases_lock"] = (
+        computed == 3 and cache.lock_timeouts == 0
+    )
+    checks["no_errors"] = cache.errors == 0
+    return checks
+
+
+async def run_worker(url: str, namespace: str, callers: int):
+    # Worker process of check_processes, prints how often it computed.
+    backend = make_backend(url, 1000, 1.0)
+    cache = make_cache(backend, namespace=namespace)
+    computed = 0
+
+    async def compute():
+        nonlocal computed
+        computed += 1
+        await asyncio.sleep(0.2)
+        return b"page"
+
+    values = await asyncio.gather(
+        *[cache.get_or_compute({"page": 1}, compute) for _ in range(callers)]
+    )
+    await backend.close()
+    ok = set(values) == {b"page"} and cache.errors == 0
+    print(json.dumps({"computed": computed, "ok": ok}))
+
+
+async def check_processes(url: str, processes: int, callers: int):
+    namespace = "check:%s" % (uuid.uuid4().hex)
+    workers = [
+        await asyncio.create_subprocess_exec(
+            sys.executable,
+            os.path.abspath(__file__),
+            "--worker",
+            url,
+            namespace,
+            "--callers",
+            str(callers),
+            stdout=asyncio.subprocess.PIPE,
+        )
+        for _ in range(processes)
+    ]
+    outputs = [(await worker.communicate())[0] for worker in workers]
+    try:
+        results = [json.loads(output) for output in outputs]
+    except ValueError:
+        return {"processes_single_flight": False}
+    return {
+        "processes_single_flight": (
+            sum(result["computed"] for result in results) == 1
+            and all(result["ok"] for result in results)
+        )
+    }
+
+
+async def check_restart(stand_in: RespServer, backend, port: int):
+    # Pooled connections are closed by the restart, the next command
+    # should go through on a new one.
+    cache = make_cache(backend)
+    await backend.set("check:restart", b"value", 5)
+    await stand_in.stop()
+    await stand_in.start(port=port)
+    await cache.get_version()
+    return {"restart_reconnects": cache.errors == 0}
+
+
+def get_closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def check_unavailable():
+    # Nothing listens on the port: pages are computed and, after the
+    # first failure, the backend is skipped instead of retried.
+    backend = make_backend(
+        "redis://127.0.0.1:%d/0" % (get_closed_port()), 0, 0.1
+    )
+    cache = make_cache(backend, retry_interval=60)
+
+    async def compute():
+        return b"page"
+
+    values = [await cache.get_or_compute({}, compute) for _ in range(5)]
+    await cache.async_bump_version()
+    return {
+        "computed_when_down": values == [b"page"] * 5,
+        "failed_once": cache.errors == 1,
+        "skipped_while_down": cache.skipped == 5,
+    }
+
+
+async def run_checks(args):
+    if args.worker:
+        return await run_worker(*args.worker, args.callers)
+    stand_in = None
+    redis_url = args.redis_url
+    if redis_url is None:
+        stand_in = RespServer()
+        port = await stand_in.start()
+        redis_url = "redis://127.0.0.1:%d/0" % (port)
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        for name, url in (("shm", "shm://" + path), ("redis", redis_url)):
+            backend = make_backend(url, 1000, 1.0)
+            results[name] = await check_backend(backend)
+            results[name].update(await check_cache(backend, args.callers))
+            results[name].update(
+                await check_processes(url, args.processes, args.callers)
+            )
+            if name == "redis" and stand_in is not None:
+                results[name].update(
+                    await check_restart(stand_in, backend, port)
+                )
+            await backend.close()
+    results["unavailable"] = await check_unavailable()
+    if stand_in is not None:
+        await stand_in.stop()
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--redis-url", help="Server to check, defaults to a local stand-in."
+    )
+    parser.add_argument("--callers", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument(
+        "--worker", nargs=2, metavar=("URL", "NAMESPACE"), help="Internal."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(run_checks(args))
+    if args.worker:
+        sys.exit(0)
+    print(json.dumps(results, indent=2))
+    if not all(ok for checks in results.values() for ok in checks.values()):
+        sys.exit(1)
@@ -0,0 +1,397 @@
+#!/usr/bin/python3
+"""
+Generate a synthetic restaurant and user dataset shaped like the files
+populate-db.py downloads, at any scale. The output directory gets
+restaurant_db.json, user.json and manifest.json (the parameters used and
+the resulting counts), and is loaded with
+
+    python scripts/populate-db.py --data-dir <output dir> --bulk
+
+The same --seed and parameters always give the same files. Records are
+written one at a time, so memory stays flat however large the scale.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from datetime import datetime, timedelta
+from functools import lru_cache
+from scripts.hours_parser import parse_opening_hours
+
+import json
+import logging
+import random
+
+
+DEFAULT_OUTPUT_PATH = os.path.join(APP_FRENZY_PATH, "data", "synthetic")
+
+# Counts at --scale 1, roughly the size of the downloaded dataset.
+BASE_RESTAURANTS = 2200
+BASE_USERS = 1000
+
+ADJECTIVES = [
+    "Golden",
+    "Urban",
+    "Rustic",
+    "Little",
+    "Blue",
+    "Royal",
+    "Happy",
+    "Hidden",
+    "Spicy",
+    "Green",
+    "Silver",
+    "Lucky",
+]
+NOUNS = [
+    "Ember",
+    "Garden",
+    "Dragon",
+    "Olive",
+    "Harbor",
+    "Lotus",
+    "Oak",
+    "Pepper",
+    "Saffron",
+    "Bamboo",
+    "Fig",
+    "Maple",
+]
+KINDS = [
+    "Eatery",
+    "Kitchen",
+    "Bistro",
+    "Grill",
+    "Diner",
+    "Cafe",
+    "Tavern",
+    "Noodle Bar",
+    "Trattoria",
+    "Steakhouse",
+]
+DISH_STYLES = [
+    "Grilled",
+    "Roasted",
+    "Spicy",
+    "Crispy",
+    "Braised",
+    "Smoked",
+    "Garlic",
+    "Butter",
+    "Lemon",
+    "Teriyaki",
+    "Tandoori",
+    "Sweet and Sour",
+]
+DISH_BASES = [
+    "Chicken",
+    "Salmon",
+    "Lamb",
+    "Shrimp",
+    "Tofu",
+    "Beef",
+    "Pork",
+    "Duck",
+    "Mushroom",
+    "Eggplant",
+    "Halibut",
+    "Squid",
+]
+DISH_KINDS = [
+    "Tikka",
+    "Curry",
+    "Burger",
+    "Pizza",
+    "Noodle Soup",
+    "Dumplings",
+    "Salad",
+    "Tacos",
+    "Risotto",
+    "Sandwich",
+    "Skewers",
+    "Fried Rice",
+]
+FIRST_NAMES = [
+    "Edith",
+    "Jose",
+    "Mei",
+    "Arjun",
+    "Fatima",
+    "Lars",
+    "Amara",
+    "Kenji",
+    "Sofia",
+    "Noah",
+]
+LAST_NAMES = [
+    "Johnson",
+    "Garcia",
+    "Tan",
+    "Patel",
+    "Okafor",
+    "Nielsen",
+    "Sato",
+    "Rossi",
+    "Cohen",
+    "Smith",
+]
+
+# Day names as they appear in the source data, monday first.
+DAY_NAMES = ["Mon", "Tues", "Weds", "Thurs", "Fri", "Sat", "Sun"]
+TRANSACTION_DATE_FORMAT = "%m/%d/%Y %I:%M %p"
+FIRST_TRANSACTION_DATE = datetime(2018, 1, 1)
+TRANSACTION_DATE_RANGE_MINUTES = 3 * 365 * 24 * 60
+
+
+def format_time(minutes: int):
+    # Minutes past midnight as "h[:mm] am/pm".
+    hour, minute = divmod(minutes % (24 * 60), 60)
+    meridiem = "am" if hour < 12 else "pm"
+    hour = hour % 12 or 12
+    if minute:
+        return "%d:%02d %s" % (hour, minute, meridiem)
+    return "%d %s" % (hour, meridiem)
+
+
+def format_days(days):
+    # A run of consecutive days is written as a range, others as a list.
+    names = [DAY_NAMES[day] for day in days]
+    if len(days) > 2 and days == list(range(days[0], days[-1] + 1)):
+        return "%s-%s" % (names[0], names[-1])
+    return ", ".join(names)
+
+
+def make_opening_hours(rng: random.Random):
+    # The week is split into one to three bands of days, each with its own
+    # hours. Some bands close after midnight.
+    days = list(range(7))
+    rng.shuffle(days)
+    days = sorted(days[: rng.randint(4, 7)])
+    cuts = sorted(rng.sample(range(1, len(days)), rng.randint(0, 2)))
+    bands = []
+    for start, end in zip([0] + cuts, cuts + [len(days)]):
+        opens = rng.randrange(6 * 60, 14 * 60, 15)
+        closes = opens + rng.randrange(4 * 60, 16 * 60, 15)
+        bands.append(
+            "%s %s - %s"
+            % (
+                format_days(days[start:end]),
+                format_time(opens),
+                format_time(closes),
+            )
+        )
+    return " / ".join(bands)
+
+
+def make_timing_pool(seed: int, variety: int):
+    # Restaurants share a limited number of distinct opening hours, as in
+    # the source data. Every string is checked against the ETL's parser.
+    rng = random.Random("%d-timings" % (seed))
+    pool = []
+    for _ in range(variety):
+        timings = make_opening_hours(rng)
+        parse_opening_hours(timings)
+        pool.append(timings)
+    return pool
+
+
+def make_price(rng: random.Random):
+    return round(rng.uniform(2, 60), 2)
+
+
+class DatasetGenerator:
+    """
+    Every restaurant is derived from the seed and its index alone, so the
+    purchases of a user can look up any restaurant's menu again without
+    the whole catalog being held in memory.
+    """
+
+    def __init__(
+        self,
+        seed: int,
+        restaurants: int,
+        dishes_per_restaurant: int,
+        timing_variety: int,
+        users: int,
+        transactions_per_user: int,
+    ):
+        self.seed = seed
+        self.restaurants = restaurants
+        self.dishes_per_restaurant = dishes_per_restaurant
+        self.users = users
+        self.transactions_per_user = transactions_per_user
+        self.timing_pool = make_timing_pool(seed, timing_variety)
+
+    def rng(self, kind: str, index: int):
+        return random.Random("%d-%s-%d" % (self.seed, kind, index))
+
+    @lru_cache(maxsize=4096)
+    def make_restaurant(self, index: int):
+        rng = self.rng("restaurant", index)
+        # Menu sizes vary from a single dish to twice the average.
+        dish_count = rng.randint(1, max(2 * self.dishes_per_restaurant - 1, 1))
+        menu = []
+        for dish in range(dish_count):
+            name = "%s %s %s" % (
+                rng.choice(DISH_STYLES),
+                rng.choice(DISH_BASES),
+                rng.choice(DISH_KINDS),
+            )
+            # Numbered past the first dish so names are unique per menu.
+            if dish:
+                name = "%s %d" % (name, dish + 1)
+            menu.append({"dishName": name, "price": make_price(rng)})
+        return {
+            "cashBalance": round(rng.uniform(0, 5000), 2),
+            "menu": menu,
+            "openingHours": rng.choice(self.timing_pool),
+            "restaurantName": "%s %s %s %d"
+            % (
+                rng.choice(ADJECTIVES),
+                rng.choice(NOUNS),
+                rng.choice(KINDS),
+                index + 1,
+            ),
+        }
+
+    def make_purchase(self, rng: random.Random):
+        restaurant = self.make_restaurant(rng.randrange(self.restaurants))
+        dish = rng.choice(restaurant["menu"])
+        date = FIRST_TRANSACTION_DATE + timedelta(
+            minutes=rng.randrange(TRANSACTION_DATE_RANGE_MINUTES)
+        )
+        return {
+            "dishName": dish["dishName"],
+            "restaurantName": restaurant["restaurantName"],
+            "transactionAmount": dish["price"],
+            "transactionDate": date.strftime(TRANSACTION_DATE_FORMAT),
+        }
+
+    def make_user(self, index: int):
+        rng = self.rng("user", index)
+        purchases = rng.randint(0, 2 * self.transactions_per_user)
+        return {
+            "cashBalance": round(rng.uniform(0, 1000), 2),
+            "id": index,
+            "name": "%s %s"
+            % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)),
+            "purchaseHistory": [
+                self.make_purchase(rng) for _ in range(purchases)
+            ],
+        }
+
+
+def write_json_array(path: str, docs):
+    # Returns the number of docs written.
+    count = 0
+    with open(path, "w") as f:
+        f.write("[")
+        for doc in docs:
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(doc))
+            count += 1
+        f.write("\n]\n")
+    return count
+
+
+def generate(args):
+    generator = DatasetGenerator(
+        args.seed,
+        args.restaurants,
+        args.dishes_per_restaurant,
+        args.timing_variety,
+        args.users,
+        args.transactions_per_user,
+    )
+    counts = {"dishes": 0, "transactions": 0}
+
+    def restaurants():
+        for index in range(args.restaurants):
+            restaurant = generator.make_restaurant(index)
+            counts["dishes"] += len(restaurant["menu"])
+            yield restaurant
+
+    def users():
+        for index in range(args.users):
+            user = generator.make_user(index)
+            counts["transactions"] += len(user["purchaseHistory"])
+            yield user
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    counts["restaurants"] = write_json_array(
+        os.path.join(args.output_dir, "restaurant_db.json"), restaurants()
+    )
+    counts["users"] = write_json_array(
+        os.path.join(args.output_dir, "user.json"), users()
+    )
+    counts["distinct_opening_hours"] = len(set(generator.timing_pool))
+    return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_PATH)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiplies the number of restaurants and users.",
+    )
+    parser.add_argument(
+        "--restaurants",
+        type=int,
+        help="Overrides the number derived from --scale.",
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        help="Overrides the number derived from --scale.",
+    )
+    parser.add_argument(
+        "--dishes-per-restaurant",
+        type=int,
+        default=10,
+        help="Average menu size.",
+    )
+    parser.add_argument(
+        "--timing-variety",
+        type=int,
+        default=200,
+        help="Number of distinct opening hours strings.",
+    )
+    parser.add_argument(
+        "--transactions-per-user",
+        type=int,
+        default=10,
+        help="Average purchase history length.",
+    )
+    args = parser.parse_args()
+    if args.restaurants is None:
+        args.restaurants = max(int(BASE_RESTAURANTS * args.scale), 1)
+    if args.users is None:
+        args.users = max(int(BASE_USERS * args.scale), 1)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.info("Generating dataset in: %s", args.output_dir)
+    manifest = {
+        "seed": args.seed,
+        "scale": args.scale,
+        "parameters": {
+            "restaurants": args.restaurants,
+            "users": args.users,
+            "dishes_per_restaurant": args.dishes_per_restaurant,
+            "timing_variety": args.timing_variety,
+            "transactions_per_user": args.transactions_per_user,
+        },
+        "counts": generate(args),
+    }
+    with open(os.path.join(args.output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(json.dumps(manifest, indent=2))
@@ -0,0 +1,103 @@
+"""
+Parser of the raw opening hours strings, eg.
+
+    "Mon-Thurs 11 am - 10:30 pm / Fri, Sat 11:30 am - 1 am / Sun 5 pm - 9 pm"
+
+Bands are separated by "/", each is a day list or range followed by an
+"h[:mm] am/pm - h[:mm] am/pm" time band. Strings are tokenized by hand
+and results are memoized on the raw string since most restaurants share
+a handful of distinct opening hours.
+"""
+from datetime import time
+from functools import lru_cache
+from typing import List, Tuple
+
+from app_frenzy.models import Days
+
+
+HOURS_CACHE_SIZE = 4096
+
+DAYS_MAP = {
+    "mon": Days.mon,
+    "tue": Days.tues,
+    "wed": Days.weds,
+    "thu": Days.thurs,
+    "fri": Days.fri,
+    "sat": Days.sat,
+    "sun": Days.sun,
+}
+
+
+def find_days_enum_value(day: str):
+    for _day, v in DAYS_MAP.items():
+        if day.lower().startswith(_day):
+            return v
+    raise Exception("Day lookup failed in map for day: %s" % (day))
+
+
+def extract_days_list(days: str):
+    days = days.strip()
+    if "-" in days:
+        days_list = list(
+            map(lambda x: find_days_enum_value(x.strip()), days.split("-"))
+        )
+        start = days_list[0].value
+        end = start + (days_list[1].value - start + 7) % 7
+        return [Days(i % 7) for i in range(start, end + 1)]
+    elif "," in days:
+        return list(
+            map(lambda x: find_days_enum_value(x.strip()), days.split(","))
+        )
+
+    return [find_days_enum_value(days)]
+
+
+def parse_time(value: str):
+    # "11 am", "11:30pm", "12 am" (midnight) or "12 pm" (noon).
+    value = value.strip()
+    end = 0
+    while end < len(value) and (value[end].isdigit() or value[end] == ":"):
+        end += 1
+    clock, rest = value[:end], value[end:].lstrip()
+    # Only the word right after the clock counts, trailing text is ignored.
+    meridiem = rest.split(None, 1)[0].lower() if rest else ""
+    hour, _, minute = clock.partition(":")
+    if (
+        not hour.isdigit()
+        or (minute and not minute.isdigit())
+        or meridiem not in ("am", "pm")
+    ):
+        raise ValueError("Invalid time: %s" % (value))
+    hour, minute = int(hour), int(minute or 0)
+    if hour > 23 or minute > 59:
+        raise ValueError("Invalid time: %s" % (value))
+    if hour > 12:
+        # 24 hour clock, the meridiem is redundant.
+        return time(hour, minute)
+    return time(hour % 12 + (12 if meridiem == "pm" else 0), minute)
+
+
+def parse_band(band: str):
+    band = band.strip()
+    # The days run up to the first digit, the time band follows.
+    start = 0
+    while start < len(band) and not band[start].isdigit():
+        start += 1
+    days, times = band[:start], band[start:]
+    opens, sep, closes = times.partition("-")
+    if not days.strip() or not sep:
+        raise ValueError("Invalid opening hours: %s" % (band))
+    return extract_days_list(days), parse_time(opens), parse_time(closes)
+
+
+@lru_cache(maxsize=HOURS_CACHE_SIZE)
+def parse_opening_hours(timings: str) -> Tuple[Tuple[Days, time, time]]:
+    """
+    Returns a (day, opens, closes) tuple for every day of every band, in
+    order. The result is cached and shared, so it is immutable.
+    """
+    parsed: List[Tuple[Days, time, time]] = []
+    for band in timings.split("/"):
+        days, opens, closes = parse_band(band)
+        parsed.extend((day, opens, closes) for day in days)
+    return tuple(parsed)
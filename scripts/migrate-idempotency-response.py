@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+"""
+Convert the response column of idempotency_key, created as jsonb, to the
+encoded response bytes (bytea). Stored responses are kept as their jsonb
+text, so their keys are still replayed. Safe to run again.
+"""
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import engine
+
+import logging
+
+
+STATEMENT = (
+    "ALTER TABLE idempotency_key ALTER COLUMN response TYPE bytea "
+    "USING convert_to(response::text, 'UTF8')"
+)
+
+
+def get_column_type(conn):
+    return conn.exec_driver_sql(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'idempotency_key' AND column_name = 'response'"
+    ).scalar()
+
+
+if __name__ == "__main__":
+    logging.info("Migrating idempotency key responses to bytes.")
+    with engine.begin() as conn:
+        if get_column_type(conn) == "jsonb":
+            conn.exec_driver_sql(STATEMENT)
+    logging.info("Migrating idempotency key responses to bytes complete.")
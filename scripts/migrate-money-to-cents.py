@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+"""
+Convert the money columns of a database created when they were floats to
+whole cents (bigint), rounding half a cent away from zero like
+app_frenzy.models.Money. Columns already converted are skipped, so it is
+safe to run again.
+"""
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import engine
+from app_frenzy.models import AppFrenzyBase, Money
+
+import logging
+
+
+def get_money_columns():
+    for table in AppFrenzyBase.metadata.sorted_tables:
+        for column in table.columns:
+            if isinstance(column.type, Money):
+                yield table.name, column.name
+
+
+def get_column_type(conn, table: str, column: str):
+    return conn.exec_driver_sql(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = %(table)s AND column_name = %(column)s",
+        {"table": table, "column": column},
+    ).scalar()
+
+
+if __name__ == "__main__":
+    logging.info("Migrating money columns to cents.")
+    # One transaction, a failure leaves every column as it was.
+    with engine.begin() as conn:
+        for table, column in get_money_columns():
+            if get_column_type(conn, table, column) != "double precision":
+                continue
+            logging.info("Converting %s.%s to cents.", table, column)
+            conn.exec_driver_sql(
+                'ALTER TABLE "%s" ALTER COLUMN %s TYPE bigint '
+                "USING round((%s * 100)::numeric)" % (table, column, column)
+            )
+    logging.info("Migrating money columns to cents complete.")
@@ -1,5 +1,5 @@
 #!/usr/bin/python3
-from typing import Dict, List
+from typing import Dict, Iterable, List
 import os
 import sys
 
@@ -7,18 +7,33 @@ APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(APP_FRENZY_PATH)
 
 from app_frenzy.db import SessionLocal
+from app_frenzy.menu_stats import (
+    SKIP_MENU_STATS_REFRESH,
+    refresh_restaurant_menu_stats,
+)
 from app_frenzy.models import Restaurant, User
+from app_frenzy.shared_cache import restaurant_cache
 from scripts.transformers import (
+    PurchaseLookup,
     transform_into_menu_objs,
     transform_into_purchase_history_objs,
+    transform_into_restaurant_open_interval_objs,
     transform_into_restaurant_obj,
     transform_into_restaurant_timing_objs,
     transform_into_user_obj,
 )
+from scripts.bulk_loader import bulk_load_restaurants, bulk_load_users
+from scripts.sync import sync_restaurants, sync_users
+from scripts.streaming import (
+    CHUNK_SIZE,
+    JSONArrayReader,
+    batched,
+    unique_by_field,
+)
 from sqlalchemy.orm import Session
 
+import argparse
 import logging
-import json
 import requests
 
 
@@ -26,8 +41,10 @@ RESTAURANT_DATA_URI = "https://gist.githubusercontent.com/seahyc/b9ebbe264f8633a
 USER_DATA_URI = "https://gist.githubusercontent.com/seahyc/de33162db680c3d595e955752178d57d/raw/785007bc91c543f847b87d705499e86e16961379/users_with_purchase_history.json"
 
 DATA_PATH = os.path.join(APP_FRENZY_PATH, "data")
-RESTAURANT_FILE_PATH = os.path.join(DATA_PATH, "restaurant_db.json")
-USER_FILE_PATH = os.path.join(DATA_PATH, "user.json")
+RESTAURANT_FILE = "restaurant_db.json"
+USER_FILE = "user.json"
+RESTAURANT_FILE_PATH = os.path.join(DATA_PATH, RESTAURANT_FILE)
+USER_FILE_PATH = os.path.join(DATA_PATH, USER_FILE)
 
 
 def create_data_dir_if_not_exists():
@@ -36,29 +53,32 @@ def create_data_dir_if_not_exists():
 
 
 def fetch_and_save(url: str, path: str):
-    with open(path, "w") as f:
-        resp = requests.get(url)
-        f.write(resp.text)
+    # Streamed to disk chunk by chunk, the response is never held whole.
+    with requests.get(url, stream=True) as resp:
+        resp.raise_for_status()
+        with open(path, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
 
 
 def read_json(file_path: str):
-    with open(file_path, "r") as f:
-        return json.loads(f.read())
+    # Yields the elements of the JSON array in the file one by one.
+    return JSONArrayReader(file_path)
+
+
+def read_restaurants(file_path: str):
+    # Restaurants are keyed by name, the last of duplicates wins.
+    return unique_by_field(read_json(file_path), "restaurantName")
 
 
-def generate_field_map_from_list_dict(lst: List[Dict], dict_field_name: str):
-    mapping = {}
-    for ele in lst:
-        mapping[ele[dict_field_name]] = ele
-    return mapping
+def read_users(file_path: str):
+    return unique_by_field(read_json(file_path), "id")
 
 
 def populate_menu_items(
     menu_items: List[Dict], restaurant: Restaurant, session: Session
 ):
-    menu_item_objs = transform_into_menu_objs(menu_items, restaurant)
-    session.add_all(menu_item_objs)
-    session.flush()
+    session.add_all(transform_into_menu_objs(menu_items, restaurant))
 
 
 def populate_restaurant_timing(
@@ -70,65 +90,165 @@ def populate_restaurant_timing(
         restaurant_timings, restaurant
     )
     session.add_all(restaurant_timing_objs)
-    session.flush()
+    session.add_all(
+        transform_into_restaurant_open_interval_objs(
+            restaurant_timing_objs, restaurant
+        )
+    )
 
 
-def _populate_restaurants(restaurants: Dict[str, Dict], session: Session):
-    for _, restaurant in restaurants.items():
-        restaurant_obj = transform_into_restaurant_obj(restaurant)
-        session.add(restaurant_obj)
+def _populate_restaurants(
+    restaurants: Iterable[Dict], session: Session, batch_size: int
+):
+    for batch in batched(restaurants, batch_size):
+        restaurant_objs = list(map(transform_into_restaurant_obj, batch))
+        session.add_all(restaurant_objs)
         session.flush()
 
-        populate_menu_items(restaurant["menu"], restaurant_obj, session)
-        populate_restaurant_timing(
-            restaurant["openingHours"], restaurant_obj, session
-        )
+        for restaurant, restaurant_obj in zip(batch, restaurant_objs):
+            populate_menu_items(restaurant["menu"], restaurant_obj, session)
+            populate_restaurant_timing(
+                restaurant["openingHours"], restaurant_obj, session
+            )
         session.commit()
+        # Keep the identity map from growing with the dataset.
+        session.expunge_all()
 
 
-def populate_restaurants(file_path: str):
-    restaurants = read_json(file_path)
-    restaurant_map = generate_field_map_from_list_dict(
-        restaurants, "restaurantName"
-    )
+def populate_restaurants(file_path: str, batch_size: int):
+    restaurants = read_restaurants(file_path)
     with SessionLocal() as session:
-        _populate_restaurants(restaurant_map, session)
+        # Menu stats are refreshed for all restaurants in one go at the end.
+        session.info[SKIP_MENU_STATS_REFRESH] = True
+        _populate_restaurants(restaurants, session, batch_size)
+        refresh_restaurant_menu_stats(session)
+        session.commit()
 
 
 def populate_user_purchase_history(
-    purchase_history: List[Dict], user: User, session: Session
+    purchase_history: List[Dict],
+    user: User,
+    lookup: PurchaseLookup,
+    session: Session,
 ):
-    purchase_history_objs = transform_into_purchase_history_objs(
-        purchase_history, user
+    session.add_all(
+        transform_into_purchase_history_objs(purchase_history, user, lookup)
     )
-    session.add_all(purchase_history_objs)
-    session.flush()
 
 
-def _populate_users(users: List[Dict], session: Session):
-    for user in users:
-        user_obj = transform_into_user_obj(user)
-        session.add(user_obj)
+def _populate_users(users: Iterable[Dict], session: Session, batch_size: int):
+    lookup = PurchaseLookup(session)
+    for batch in batched(users, batch_size):
+        user_objs = list(map(transform_into_user_obj, batch))
+        session.add_all(user_objs)
         session.flush()
 
-        populate_user_purchase_history(
-            user["purchaseHistory"], user_obj, session
-        )
+        for user, user_obj in zip(batch, user_objs):
+            populate_user_purchase_history(
+                user["purchaseHistory"], user_obj, lookup, session
+            )
         session.commit()
+        session.expunge_all()
 
 
-def populate_users(file_path: str):
-    users = read_json(file_path)
+def populate_users(file_path: str, batch_size: int):
     with SessionLocal() as session:
-        _populate_users(users, session)
+        _populate_users(read_users(file_path), session, batch_size)
 
 
-if __name__ == "__main__":
-    create_data_dir_if_not_exists()
+def bulk_populate(
+    batch_size: int,
+    workers: int = 1,
+    restaurant_file_path: str = RESTAURANT_FILE_PATH,
+    user_file_path: str = USER_FILE_PATH,
+):
+    # Users are only loaded once every restaurant is in, since purchases
+    # refer to them.
+    bulk_load_restaurants(
+        read_restaurants(restaurant_file_path), batch_size, workers
+    )
+    bulk_load_users(read_users(user_file_path), batch_size, workers)
+
 
-    logging.info("Starting Fetch and populate database. Slow operation.")
-    fetch_and_save(RESTAURANT_DATA_URI, RESTAURANT_FILE_PATH)
-    fetch_and_save(USER_DATA_URI, USER_FILE_PATH)
-    populate_restaurants(RESTAURANT_FILE_PATH)
-    populate_users(USER_FILE_PATH)
+def sync_populate(
+    batch_size: int,
+    workers: int = 1,
+    restaurant_file_path: str = RESTAURANT_FILE_PATH,
+    user_file_path: str = USER_FILE_PATH,
+):
+    sync_restaurants(
+        read_restaurants(restaurant_file_path), batch_size, workers
+    )
+    sync_users(read_users(user_file_path), batch_size, workers)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fetch the raw datasets and populate the database."
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Load through staging tables with COPY, one commit per batch.",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only write what changed since the last run and delete what "
+        "is gone. Safe to run repeatedly.",
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="Load restaurant_db.json and user.json from this directory "
+        "(eg. made by generate-dataset.py) instead of downloading them.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Records (restaurants or users) committed at once.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Transform batches in as many processes and write them over "
+        "as many connections. Implies --bulk when above 1.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Progress and the rows/sec of bulk loads are logged at INFO.
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    if args.data_dir:
+        restaurant_file_path = os.path.join(args.data_dir, RESTAURANT_FILE)
+        user_file_path = os.path.join(args.data_dir, USER_FILE)
+    else:
+        restaurant_file_path = RESTAURANT_FILE_PATH
+        user_file_path = USER_FILE_PATH
+        create_data_dir_if_not_exists()
+        logging.info("Starting Fetch and populate database. Slow operation.")
+        fetch_and_save(RESTAURANT_DATA_URI, restaurant_file_path)
+        fetch_and_save(USER_DATA_URI, user_file_path)
+    if args.sync:
+        sync_populate(
+            args.batch_size,
+            args.workers,
+            restaurant_file_path,
+            user_file_path,
+        )
+    elif args.bulk or args.workers > 1:
+        bulk_populate(
+            args.batch_size,
+            args.workers,
+            restaurant_file_path,
+            user_file_path,
+        )
+    else:
+        populate_restaurants(restaurant_file_path, args.batch_size)
+        populate_users(user_file_path, args.batch_size)
+    # Bulk loads and syncs bypass the ORM, cached pages are dropped here.
+    restaurant_cache.bump_version()
     logging.info("Database population complete. Server will start now.")
@@ -0,0 +1,25 @@
+#!/usr/bin/python3
+"""
+Delete idempotency keys older than IDEMPOTENCY_KEY_TTL. Server workers
+do this every IDEMPOTENCY_PURGE_INTERVAL, this is for running it from
+cron instead or on demand.
+"""
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.config import get_app_frenzy_settings
+from app_frenzy.db import SessionLocal
+from app_frenzy.idempotency import purge_expired_keys
+
+import logging
+
+
+if __name__ == "__main__":
+    settings = get_app_frenzy_settings()
+    logging.info("Purging expired idempotency keys.")
+    with SessionLocal() as session:
+        purged = purge_expired_keys(session, settings.IDEMPOTENCY_KEY_TTL)
+    logging.info("Purged %d expired idempotency keys.", purged)
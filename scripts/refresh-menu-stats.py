@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+"""
+Recompute restaurant_menu_stats for every restaurant. The ETL and menu
+changes through the ORM keep it current, this is for databases populated
+before the table existed or changed behind the ORM's back.
+"""
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import SessionLocal
+from app_frenzy.menu_stats import refresh_restaurant_menu_stats
+from app_frenzy.shared_cache import restaurant_cache
+
+import logging
+
+
+if __name__ == "__main__":
+    logging.info("Refreshing restaurant menu stats.")
+    with SessionLocal() as session:
+        refresh_restaurant_menu_stats(session)
+        session.commit()
+    restaurant_cache.bump_version()
+    logging.info("Refreshing restaurant menu stats complete.")
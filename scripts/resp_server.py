@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+"""
+Local stand-in for Redis: an in memory server speaking the Redis
+protocol (RESP) with the commands the shared result cache uses (GET, SET
+with PX/EX/NX, DEL, INCR, SELECT and PING), so the redis:// backend can
+be checked without a Redis server.
+
+    python scripts/resp_server.py --port 6380
+    RESTAURANT_CACHE_URL=redis://localhost:6380/0 python main.py
+
+It's single process and keeps nothing on disk, only use it locally.
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+
+class RespError(Exception):
+    pass
+
+
+class RespServer:
+    def __init__(self):
+        # Key -> (value, expiry time or None).
+        self.data = {}
+        self.server = None
+        self.writers = set()
+
+    def get_live(self, key: bytes):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None:
+            if entry[1] <= time.monotonic():
+                del self.data[key]
+                return None
+        return entry
+
+    def cmd_ping(self, args):
+        return "PONG"
+
+    def cmd_select(self, args):
+        # Every database is the same one.
+        return "OK"
+
+    def cmd_get(self, args):
+        entry = self.get_live(args[0])
+        return None if entry is None else entry[0]
+
+    def cmd_set(self, args):
+        key, value, options = args[0], args[1], args[2:]
+        expires_at = None
+        only_new = False
+        i = 0
+        while i < len(options):
+            option = options[i].upper()
+            if option == b"NX":
+                only_new = True
+            elif option in (b"PX", b"EX"):
+                i += 1
+                ttl = int(options[i]) / (1000 if option == b"PX" else 1)
+                expires_at = time.monotonic() + ttl
+            else:
+                raise RespError("ERR syntax error")
+            i += 1
+        if only_new and self.get_live(key) is not None:
+            return None
+        self.data[key] = (value, expires_at)
+        return "OK"
+
+    def cmd_del(self, args):
+        deleted = 0
+        for key in args:
+            if self.get_live(key) is not None:
+                del self.data[key]
+                deleted += 1
+        return deleted
+
+    def cmd_incr(self, args):
+        entry = self.get_live(args[0])
+        try:
+            value = int(entry[0]) + 1 if entry else 1
+        except ValueError:
+            raise RespError("ERR value is not an integer or out of range")
+        self.data[args[0]] = (
+            str(value).encode(),
+            entry[1] if entry else None,
+        )
+        return value
+
+    def execute(self, args):
+        handler = getattr(self, "cmd_%s" % (args[0].decode().lower()), None)
+        if handler is None:
+            raise RespError("ERR unknown command '%s'" % (args[0].decode()))
+        try:
+            return handler(args[1:])
+        except IndexError:
+            raise RespError("ERR wrong number of arguments")
+
+    @staticmethod
+    def encode_reply(reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % (reply)
+        if isinstance(reply, str):
+            return b"+%s\r\n" % (reply.encode())
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+    @staticmethod
+    async def read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, eg. typed in telnet.
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def handle(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                args = await self.read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                try:
+                    reply = self.encode_reply(self.execute(args))
+                except RespError as e:
+                    reply = b"-%s\r\n" % (str(e).encode())
+                writer.write(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        # Returns the port listened on, port 0 picks a free one.
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        # Client connections are closed too, as by a restarting server.
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+
+
+async def serve(host: str, port: int):
+    server = RespServer()
+    port = await server.start(host, port)
+    logging.info("Serving RESP on %s:%d.", host, port)
+    await server.server.serve_forever()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    asyncio.run(serve(args.host, args.port))
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+"""
+Fold every unsettled ledger transaction into its restaurant's
+cash_balance. The server does this in the background when
+RESTAURANT_LEDGER is on, run this before turning it off.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import SessionLocal
+from app_frenzy.ledger import settle_ledger
+from app_frenzy.models import UserTransaction
+from sqlalchemy import exists, select
+
+import logging
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    return parser.parse_args()
+
+
+def has_unsettled(session):
+    query = select(exists().where(~UserTransaction.settled))
+    return session.execute(query).scalar_one()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.info("Settling the restaurant ledger.")
+    total = 0
+    with SessionLocal() as session:
+        while True:
+            settled = settle_ledger(session, args.batch_size)
+            total += settled
+            if settled:
+                continue
+            if not has_unsettled(session):
+                break
+            # A server worker holds the lock, let it finish its batch.
+            time.sleep(0.1)
+    logging.info("Settled %d transactions.", total)
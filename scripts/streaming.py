@@ -0,0 +1,104 @@
+from typing import Dict, Iterable
+
+import json
+import re
+
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE_RE = re.compile(r"\s*")
+ELEMENT_END = frozenset(" \t\n\r,]")
+
+
+class JSONArrayReader:
+    """
+    Iterates over the elements of a top level JSON array in a file while
+    only holding the current chunk of the file and one element in memory.
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = CHUNK_SIZE):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+
+    def __iter__(self):
+        with open(self.file_path, "r") as f:
+            self.file = f
+            self.buf, self.pos, self.eof = "", 0, False
+            yield from self.iter_elements()
+
+    def read_more(self):
+        chunk = self.file.read(self.chunk_size)
+        # Drop the consumed part of the buffer.
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        self.eof = not chunk
+
+    def next_char(self):
+        # Skips whitespace and returns the next character, None at EOF.
+        while True:
+            self.pos = WHITESPACE_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return None
+            self.read_more()
+
+    def decode_element(self):
+        self.next_char()
+        while True:
+            try:
+                doc, end = self.decoder.raw_decode(self.buf, self.pos)
+                # An element is followed by a separator, anything else means
+                # a number was cut short by the end of the chunk.
+                if self.eof or (
+                    end < len(self.buf) and self.buf[end] in ELEMENT_END
+                ):
+                    self.pos = end
+                    return doc
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read_more()
+
+    def iter_elements(self):
+        if self.next_char() != "[":
+            raise ValueError("Expected a JSON array in: %s" % (self.file_path))
+        self.pos += 1
+        if self.next_char() == "]":
+            return
+        while True:
+            yield self.decode_element()
+            char = self.next_char()
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(
+                    "Malformed JSON array in: %s" % (self.file_path)
+                )
+            self.pos += 1
+
+
+def batched(iterable: Iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def unique_by_field(docs: Iterable[Dict], field_name: str):
+    # Keeps the last of the docs sharing a value of field_name, as loading
+    # them into a dict did. docs is read twice (eg. a JSONArrayReader), to
+    # find the position of the last doc of every value and then to yield
+    # those, so only the values and positions are kept in memory.
+    if iter(docs) is docs:
+        raise TypeError("unique_by_field reads docs twice, not an iterator.")
+    last_positions = {}
+    for position, doc in enumerate(docs):
+        last_positions[doc[field_name]] = position
+    for position, doc in enumerate(docs):
+        if last_positions[doc[field_name]] == position:
+            yield doc
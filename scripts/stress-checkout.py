@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+"""
+Fire concurrent checkouts of one dish for one user at a running server and
+check that the user is never overdrawn. The user's balance is first set
+to cover exactly --affordable orders, so every order beyond that must be
+refused with 402 and the books must still balance afterwards.
+
+This overwrites the user's cash balance, only run it against a
+development database.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import SessionLocal
+from app_frenzy.ledger import build_balance_query
+from app_frenzy.models import MenuItem, User, UserTransaction
+from collections import Counter
+from scripts.benchmarks import run_concurrent
+from sqlalchemy import func, select, update
+
+import json
+import requests
+import threading
+
+
+def read_books(session, args):
+    user_id, balance = session.execute(
+        select(User.id, User.cash_balance).where(User.user_id == args.user_id)
+    ).one()
+    # Settled plus pending, as served by /api/restaurant/{id}/balance, so
+    # the check holds whether the server runs the ledger or not.
+    restaurant = session.execute(build_balance_query(args.restaurant_id)).one()
+    return {
+        "user_balance": balance,
+        "restaurant_balance": (
+            restaurant.settled_balance + restaurant.pending_balance
+        ),
+        "transactions": session.execute(
+            select(func.count(UserTransaction.id)).where(
+                UserTransaction.user == user_id
+            )
+        ).scalar_one(),
+    }
+
+
+def prepare(session, args):
+    price = session.execute(
+        select(MenuItem.price).where(
+            MenuItem.id == args.dish_id,
+            MenuItem.restaurant == args.restaurant_id,
+        )
+    ).scalar_one()
+    # Money is exact, the last affordable order leaves exactly 0.
+    session.execute(
+        update(User)
+        .where(User.user_id == args.user_id)
+        .values(cash_balance=price * args.affordable)
+    )
+    session.commit()
+    return price
+
+
+def make_checkout_func(args, statuses: Counter):
+    session = requests.Session()
+    url = args.base_url.rstrip("/") + "/api/cart/process"
+    body = {
+        "restaurant_id": args.restaurant_id,
+        "dish_id": args.dish_id,
+        "user_id": args.user_id,
+    }
+    lock = threading.Lock()
+
+    def call():
+        resp = session.post(url, json=body)
+        with lock:
+            statuses[resp.status_code] += 1
+        if resp.status_code not in (200, 402):
+            raise Exception("Unexpected status: %s" % (resp.status_code))
+
+    return call
+
+
+def check(price, before, after, statuses, args):
+    succeeded = statuses[200]
+    return {
+        "no_overdraft": after["user_balance"] >= 0,
+        "balance_used_up": after["user_balance"] == 0,
+        "all_affordable_orders_succeeded": succeeded == args.affordable,
+        "user_debited_once_per_order": (
+            before["user_balance"] - after["user_balance"] == succeeded * price
+        ),
+        "restaurant_credited_once_per_order": (
+            after["restaurant_balance"] - before["restaurant_balance"]
+            == succeeded * price
+        ),
+        "one_transaction_per_order": (
+            after["transactions"] - before["transactions"] == succeeded
+        ),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--restaurant-id", type=int, default=1)
+    parser.add_argument("--dish-id", type=int, default=1)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--affordable", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    statuses = Counter()
+    with SessionLocal() as session:
+        price = prepare(session, args)
+        before = read_books(session, args)
+    result = run_concurrent(
+        make_checkout_func(args, statuses), args.orders, args.concurrency
+    )
+    with SessionLocal() as session:
+        after = read_books(session, args)
+    result["statuses"] = dict(statuses)
+    result["checks"] = check(price, before, after, statuses, args)
+    print(json.dumps(result, indent=2))
+    if not all(result["checks"].values()):
+        sys.exit(1)
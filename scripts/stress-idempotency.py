@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+"""
+Send the same checkout concurrently under one Idempotency-Key, as
+retrying clients would, and check that the user was charged once and
+every duplicate got the same result back. Repeated for --rounds fresh
+keys.
+
+This tops up the user's cash balance, only run it against a development
+database.
+"""
+import argparse
+import os
+import sys
+
+APP_FRENZY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_FRENZY_PATH)
+
+from app_frenzy.db import SessionLocal
+from app_frenzy.models import User, UserTransaction
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, select, update
+
+import json
+import requests
+import uuid
+
+
+def top_up(user_id: int, balance: float):
+    with SessionLocal() as session:
+        session.execute(
+            update(User)
+            .where(User.user_id == user_id)
+            .values(cash_balance=balance)
+        )
+        session.commit()
+
+
+def count_transactions(user_id: int):
+    with SessionLocal() as session:
+        return session.execute(
+            select(func.count(UserTransaction.id))
+            .join(User, User.id == UserTransaction.user)
+            .where(User.user_id == user_id)
+        ).scalar_one()
+
+
+def send_duplicates(args, executor):
+    url = args.base_url.rstrip("/") + "/api/cart/process"
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    body = {
+        "restaurant_id": args.restaurant_id,
+        "user_id": args.user_id,
+        "items": [{"dish_id": args.dish_id}],
+    }
+
+    def call(_):
+        resp = requests.post(url, json=body, headers=headers)
+        return resp.status_code, resp.text
+
+    return list(executor.map(call, range(args.duplicates)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--restaurant-id", type=int, default=1)
+    parser.add_argument("--dish-id", type=int, default=1)
+    parser.add_argument("--duplicates", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--balance", type=float, default=1000000.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    top_up(args.user_id, args.balance)
+    before = count_transactions(args.user_id)
+    failed_rounds = []
+    with ThreadPoolExecutor(max_workers=args.duplicates) as executor:
+        for i in range(args.rounds):
+            responses = send_duplicates(args, executor)
+            statuses = {status for status, _ in responses}
+            bodies = {body for _, body in responses}
+            if statuses != {200} or len(bodies) != 1:
+                failed_rounds.append(
+                    {"round": i, "statuses": sorted(statuses)}
+                )
+    charged = count_transactions(args.user_id) - before
+    checks = {
+        "charged_once_per_key": charged == args.rounds,
+        "duplicates_got_same_result": not failed_rounds,
+    }
+    print(
+        json.dumps(
+            {
+                "rounds": args.rounds,
+                "duplicates_per_round": args.duplicates,
+                "transactions_created": charged,
+                "failed_rounds": failed_rounds,
+                "checks": checks,
+            },
+            indent=2,
+        )
+    )
+    if not all(checks.values()):
+        sys.exit(1)
@@ -0,0 +1,211 @@
+"""
+Incremental sync mode of populate-db.py. Every restaurant and user keeps
+a hash of its source record, only records whose hash changed are staged
+and they are upserted on their natural keys (restaurant name, user id
+and dish name within the restaurant) through the bulk loader's staging
+tables. Records gone from the source are deleted at the end, so a sync
+writes in proportion to the diff and running it twice changes nothing.
+
+Rows the app itself references are kept: dishes, restaurants and users
+that appear in a purchase are not deleted, and purchases are only ever
+added. Cash balances are only taken from the source when a restaurant or
+user is first inserted, afterwards checkouts (and the ledger) own them.
+"""
+from typing import Dict, Iterable, Set
+
+from app_frenzy.db import engine
+from app_frenzy.menu_stats import build_refresh_statement
+from app_frenzy.models import (
+    MenuItem,
+    Restaurant,
+    RestaurantMenuStats,
+    RestaurantOpenInterval,
+    RestaurantTiming,
+    User,
+    UserTransaction,
+)
+from scripts.bulk_loader import (
+    RESTAURANT_TIMING_STATEMENTS,
+    USER_SETUP_STATEMENTS,
+    load,
+    log_throughput,
+    stage_restaurants,
+    stage_users,
+)
+from scripts.transformers import source_hash
+from sqlalchemy import column, delete, exists, select, table
+
+import logging
+
+
+def compile_statement(statement):
+    # Batches are written over raw DBAPI connections, which need SQL text.
+    return str(
+        statement.compile(
+            dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+STAGED_RESTAURANT_IDS = select(column("id")).select_from(
+    table("stage_restaurant")
+)
+
+SYNC_RESTAURANT_STATEMENTS = [
+    "UPDATE stage_restaurant s SET id = r.id "
+    "FROM restaurant r WHERE r.name = s.name",
+    "UPDATE stage_restaurant "
+    "SET id = nextval(pg_get_serial_sequence('restaurant', 'id')) "
+    "WHERE id IS NULL",
+    "INSERT INTO restaurant (id, name, cash_balance, source_hash) "
+    "SELECT id, name, cash_balance, source_hash FROM stage_restaurant "
+    "ON CONFLICT (id) DO UPDATE SET source_hash = EXCLUDED.source_hash",
+    "INSERT INTO menu_item (restaurant, dish_name, price) "
+    "SELECT r.id, m.dish_name, m.price FROM stage_menu_item m "
+    "JOIN stage_restaurant r ON r.seq = m.restaurant_seq "
+    "ON CONFLICT (restaurant, dish_name) DO UPDATE "
+    "SET price = EXCLUDED.price "
+    "WHERE menu_item.price IS DISTINCT FROM EXCLUDED.price",
+    "DELETE FROM menu_item m USING stage_restaurant r "
+    "WHERE m.restaurant = r.id AND NOT EXISTS ("
+    "SELECT 1 FROM stage_menu_item s "
+    "WHERE s.restaurant_seq = r.seq AND s.dish_name = m.dish_name) "
+    "AND NOT EXISTS ("
+    "SELECT 1 FROM user_transactions t WHERE t.menu_item = m.id)",
+    # Opening hours have no natural key, they are replaced as a whole.
+    "DELETE FROM restaurant_timing t USING stage_restaurant r "
+    "WHERE t.restaurant = r.id",
+    "DELETE FROM restaurant_open_interval i USING stage_restaurant r "
+    "WHERE i.restaurant = r.id",
+    *RESTAURANT_TIMING_STATEMENTS,
+    compile_statement(build_refresh_statement(STAGED_RESTAURANT_IDS)),
+]
+
+SYNC_USER_STATEMENTS = [
+    'UPDATE stage_user s SET id = u.id FROM "user" u '
+    "WHERE u.user_id = s.user_id",
+    "UPDATE stage_user "
+    "SET id = nextval(pg_get_serial_sequence('\"user\"', 'id')) "
+    "WHERE id IS NULL",
+    'INSERT INTO "user" (id, user_id, name, cash_balance, source_hash) '
+    "SELECT id, user_id, name, cash_balance, source_hash FROM stage_user "
+    "ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, "
+    "source_hash = EXCLUDED.source_hash",
+    "INSERT INTO user_transactions "
+    '("user", restaurant, menu_item, transaction_amount, transaction_date) '
+    "SELECT u.id, r.id, m.id, p.transaction_amount, p.transaction_date "
+    "FROM stage_purchase p "
+    "JOIN stage_user u ON u.seq = p.user_seq "
+    "JOIN lookup_restaurant r ON r.name = p.restaurant_name "
+    "JOIN lookup_menu_item m "
+    "ON m.restaurant = r.id AND m.dish_name = p.dish_name "
+    "WHERE NOT EXISTS ("
+    "SELECT 1 FROM user_transactions t "
+    'WHERE t."user" = u.id AND t.menu_item = m.id '
+    "AND t.transaction_date = p.transaction_date "
+    "AND t.transaction_amount = p.transaction_amount)",
+]
+
+
+def get_stored_hashes(key_column, hash_column):
+    with engine.connect() as conn:
+        return dict(conn.execute(select(key_column, hash_column)).all())
+
+
+def select_changed(
+    docs: Iterable[Dict], key_field: str, stored: Dict, seen: Set
+):
+    # Yields the docs that are new or changed since the last sync and
+    # records every key seen along the way.
+    for doc in docs:
+        key = doc[key_field]
+        seen.add(key)
+        if stored.get(key) != source_hash(doc):
+            yield doc
+
+
+def delete_gone_restaurants(names: Set[str]):
+    if not names:
+        return 0
+    with engine.begin() as conn:
+        query = select(Restaurant.id).where(
+            Restaurant.name.in_(names),
+            ~exists().where(UserTransaction.restaurant == Restaurant.id),
+        )
+        restaurant_ids = conn.execute(query).scalars().all()
+        for model_column in (
+            MenuItem.restaurant,
+            RestaurantTiming.restaurant,
+            RestaurantOpenInterval.restaurant,
+            RestaurantMenuStats.restaurant,
+        ):
+            conn.execute(
+                delete(model_column.class_).where(
+                    model_column.in_(restaurant_ids)
+                )
+            )
+        conn.execute(
+            delete(Restaurant).where(Restaurant.id.in_(restaurant_ids))
+        )
+    if len(restaurant_ids) < len(names):
+        logging.info(
+            "Kept %d removed restaurants that have purchases.",
+            len(names) - len(restaurant_ids),
+        )
+    return len(restaurant_ids)
+
+
+def delete_gone_users(user_ids: Set[int]):
+    if not user_ids:
+        return 0
+    with engine.begin() as conn:
+        deleted = conn.execute(
+            delete(User).where(
+                User.user_id.in_(user_ids),
+                ~exists().where(UserTransaction.user == User.id),
+            )
+        ).rowcount
+    if deleted < len(user_ids):
+        logging.info(
+            "Kept %d removed users that have purchases.",
+            len(user_ids) - deleted,
+        )
+    return deleted
+
+
+def sync_restaurants(
+    restaurants: Iterable[Dict], batch_size: int, workers: int = 1
+):
+    stored = get_stored_hashes(Restaurant.name, Restaurant.source_hash)
+    seen = set()
+    changed = select_changed(restaurants, "restaurantName", stored, seen)
+    rows, elapsed = load(
+        changed,
+        stage_restaurants,
+        SYNC_RESTAURANT_STATEMENTS,
+        batch_size,
+        workers,
+    )
+    log_throughput("changed restaurant", rows, elapsed)
+    deleted = delete_gone_restaurants(stored.keys() - seen)
+    logging.info("Deleted %d restaurants gone from the source.", deleted)
+    return rows, elapsed
+
+
+def sync_users(users: Iterable[Dict], batch_size: int, workers: int = 1):
+    # Purchases resolve against the restaurants, which must be synced.
+    stored = get_stored_hashes(User.user_id, User.source_hash)
+    seen = set()
+    changed = select_changed(users, "id", stored, seen)
+    rows, elapsed = load(
+        changed,
+        stage_users,
+        SYNC_USER_STATEMENTS,
+        batch_size,
+        workers,
+        setup_statements=USER_SETUP_STATEMENTS,
+    )
+    log_throughput("changed user", rows, elapsed)
+    deleted = delete_gone_users(stored.keys() - seen)
+    logging.info("Deleted %d users gone from the source.", deleted)
+    return rows, elapsed
@@ -1,16 +1,19 @@
+from datetime import time
 from dateutil.parser import parse
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 from typing import Dict, List
 
-from app_frenzy.db import SessionLocal
 from app_frenzy.models import (
+    MINUTES_PER_DAY,
     Days,
     MenuItem,
     Restaurant,
+    RestaurantOpenInterval,
     RestaurantTiming,
     User,
     UserTransaction,
+    minute_of_week,
 )
 from app_frenzy.schemas import (
     MenuItemSchema,
@@ -19,125 +22,152 @@ from app_frenzy.schemas import (
     UserSchema,
     UserTransactionSchema,
 )
+from scripts.hours_parser import parse_opening_hours
 
-import re
-
-
-TIMING_RE = re.compile(
-    "(?P<first>([a-zA-Z]+\s*,?-?\s*)*[a-zA-Z]+)\s*(?P<second>\d*:?\d+\s*[a-zA-Z]+\s*-\s*\d*:?\d+\s*[a-zA-Z]+)"
-)
-DAYS_MAP = {
-    "mon": Days.mon,
-    "tue": Days.tues,
-    "wed": Days.weds,
-    "thu": Days.thurs,
-    "fri": Days.fri,
-    "sat": Days.sat,
-    "sun": Days.sun,
-}
+import hashlib
+import json
 
 
 def make_model_obj(doc: dict, schema, model):
     return model(**schema(**doc).dict())
 
 
-def find_days_enum_value(day: str):
-    for _day, v in DAYS_MAP.items():
-        if day.lower().startswith(_day):
-            return v
-    raise Exception("Day lookup failed in map for day: %s" % (day))
+def source_hash(doc: dict):
+    # Stable across runs, keys are sorted before hashing.
+    encoded = json.dumps(doc, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
 
 
-def extract_days_list(days: str):
-    days = days.strip()
-    if "-" in days:
-        days_list = list(
-            map(lambda x: find_days_enum_value(x.strip()), days.split("-"))
-        )
-        start = days_list[0].value
-        end = start + (days_list[1].value - start + 7) % 7
-        return [Days(i % 7) for i in range(start, end + 1)]
-    elif "," in days:
-        return list(
-            map(lambda x: find_days_enum_value(x.strip()), days.split(","))
+def transform_into_restaurant_timing_objs(
+    timings: str, restaurant: Restaurant
+):
+    objs = []
+    for day, opens, closes in parse_opening_hours(timings):
+        doc = {
+            "restaurant": restaurant.id,
+            "day": day,
+            "opens": opens,
+            "closes": closes,
+        }
+        objs.append(
+            make_model_obj(doc, RestaurantTimingSchema, RestaurantTiming)
         )
+    return objs
 
-    return [find_days_enum_value(days)]
 
+def split_into_open_intervals(day: Days, opens: time, closes: time):
+    start = minute_of_week(day, opens)
+    end = minute_of_week(day, closes)
+    if end > start:
+        return [(start, end)]
+    # Band runs past midnight (eg. 5 pm - 1:30 am), split it into the rest
+    # of the day and the early hours of the next one.
+    intervals = [(start, (day.value + 1) * MINUTES_PER_DAY)]
+    next_day = Days((day.value + 1) % 7)
+    if closes != time(0):
+        intervals.append(
+            (
+                minute_of_week(next_day, time(0)),
+                minute_of_week(next_day, closes),
+            )
+        )
+    return intervals
 
-def transform_into_restaurant_timing_objs(
-    timings: str, restaurant: Restaurant
+
+def transform_into_restaurant_open_interval_objs(
+    timing_objs: List[RestaurantTiming], restaurant: Restaurant
 ):
-    objs = []
-    for timing in timings.split("/"):
-        matches = TIMING_RE.match(timing.strip())
-        days = matches.group("first")
-        time_band = matches.group("second")
-        open_closes = time_band.split("-")
-
-        opens = parse(open_closes[0]).time()
-        closes = parse(open_closes[1]).time()
-        days_list = extract_days_list(days)
-        for day in days_list:
-            doc = {
-                "restaurant": restaurant.id,
-                "day": day,
-                "opens": opens,
-                "closes": closes,
-            }
-            objs.append(
-                make_model_obj(doc, RestaurantTimingSchema, RestaurantTiming)
+    for timing in timing_objs:
+        for opens_at, closes_at in split_into_open_intervals(
+            timing.day, timing.opens, timing.closes
+        ):
+            yield RestaurantOpenInterval(
+                restaurant=restaurant.id,
+                opens_at=opens_at,
+                closes_at=closes_at,
             )
-    return objs
 
 
 def transform_into_menu_objs(menu_items: List[Dict], restaurant: Restaurant):
-    objs = []
+    # Dishes are keyed by name within the restaurant, repeats are skipped.
+    seen = set()
     for menu_item in menu_items:
         menu_item_obj = make_model_obj(menu_item, MenuItemSchema, MenuItem)
+        if menu_item_obj.dish_name in seen:
+            continue
+        seen.add(menu_item_obj.dish_name)
         menu_item_obj.restaurant = restaurant.id
-        objs.append(menu_item_obj)
-    return objs
+        yield menu_item_obj
 
 
 def transform_into_restaurant_obj(restaurant: dict):
-    return make_model_obj(restaurant, RestaurantSchema, Restaurant)
-
-
-def get_restaurant_with_name(name: str, session: Session):
-    query = select(Restaurant).filter_by(name=name)
-    return session.execute(query).scalars().first()
-
-
-def get_menu_item_with_dish_name(dish_name: str, session: Session):
-    query = select(MenuItem).filter_by(dish_name=dish_name)
-    return session.execute(query).scalars().first()
+    restaurant_obj = make_model_obj(restaurant, RestaurantSchema, Restaurant)
+    restaurant_obj.source_hash = source_hash(restaurant)
+    return restaurant_obj
+
+
+class PurchaseLookup:
+    """
+    Resolves the restaurant and dish names of purchases to ids. Loaded
+    with two queries once per ETL run instead of querying per purchase.
+    Dishes are looked up within their restaurant since dish names repeat
+    across restaurants.
+    """
+
+    def __init__(self, session: Session):
+        self.restaurants = {}
+        self.menu_items = {}
+        query = select(Restaurant.id, Restaurant.name).order_by(Restaurant.id)
+        for restaurant_id, name in session.execute(query):
+            self.restaurants[name] = restaurant_id
+        query = (
+            select(
+                MenuItem.id,
+                MenuItem.restaurant,
+                Restaurant.name,
+                MenuItem.dish_name,
+            )
+            .join(Restaurant, Restaurant.id == MenuItem.restaurant)
+            .order_by(MenuItem.id.desc())
+        )
+        for menu_item_id, restaurant_id, name, dish_name in session.execute(
+            query
+        ):
+            if self.restaurants.get(name) == restaurant_id:
+                self.menu_items[(name, dish_name)] = menu_item_id
+
+    def get_restaurant_id(self, name: str):
+        if name not in self.restaurants:
+            raise Exception("Restaurant lookup failed for: %s" % (name))
+        return self.restaurants[name]
+
+    def get_menu_item_id(self, restaurant_name: str, dish_name: str):
+        key = (restaurant_name, dish_name)
+        if key not in self.menu_items:
+            raise Exception(
+                "Dish lookup failed for: %s at %s"
+                % (dish_name, restaurant_name)
+            )
+        return self.menu_items[key]
 
 
 def transform_into_purchase_history_objs(
-    purchase_history: List[Dict], user: User
+    purchase_history: List[Dict], user: User, lookup: PurchaseLookup
 ):
-    objs = []
     for purchase in purchase_history:
-        with SessionLocal() as session:
-            restaurant = get_restaurant_with_name(
-                purchase["restaurantName"], session
-            )
-            menu_item = get_menu_item_with_dish_name(
-                purchase["dishName"], session
-            )
-            doc = {
-                "user": user.id,
-                "restaurant": restaurant.id,
-                "menu_item": menu_item.id,
-                "transactionAmount": purchase["transactionAmount"],
-                "transactionDate": parse(purchase["transactionDate"].strip()),
-            }
-            objs.append(
-                make_model_obj(doc, UserTransactionSchema, UserTransaction)
-            )
-    return objs
+        doc = {
+            "user": user.id,
+            "restaurant": lookup.get_restaurant_id(purchase["restaurantName"]),
+            "menu_item": lookup.get_menu_item_id(
+                purchase["restaurantName"], purchase["dishName"]
+            ),
+            "transactionAmount": purchase["transactionAmount"],
+            "transactionDate": parse(purchase["transactionDate"].strip()),
+        }
+        yield make_model_obj(doc, UserTransactionSchema, UserTransaction)
 
 
 def transform_into_user_obj(user: dict):
-    return make_model_obj(user, UserSchema, User)
+    user_obj = make_model_obj(user, UserSchema, User)
+    user_obj.source_hash = source_hash(user)
+    return user_obj